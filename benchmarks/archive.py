@@ -0,0 +1,130 @@
+"""
+Size and read speed of the delta-compressed telemetry archive
+
+Simulates a day of telemetry for a few devices: every stream starts from a
+synthetic payload and then drifts the way real ones do, a measurement
+byte or counter moving by one now and then. Compares the archive with the
+raw 20 byte frames plus 8 byte timestamps, and its read rate with how fast
+the parsers consume the payloads.
+
+    python -m benchmarks.archive
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from pychlorinator.archive import ArchiveReader, ArchiveWriter
+from pychlorinator.halo_parsers import (
+    CellCharacteristic2,
+    HeaterStateCharacteristic,
+    LightStateCharacteristic,
+    PowerBoardCharacteristic,
+    ProbeCharacteristic,
+    SolarStateCharacteristic,
+    StateCharacteristic3,
+    TempCharacteristic,
+    TimerStateCharacteristic,
+)
+from pychlorinator.synthetic import TELEMETRY_MIX, FrameGenerator
+
+TARGET_REDUCTION = 10
+RAW_RECORD_BYTES = 20 + 8
+
+PARSERS = {
+    9: TempCharacteristic,
+    104: StateCharacteristic3,
+    300: LightStateCharacteristic,
+    402: TimerStateCharacteristic,
+    600: ProbeCharacteristic,
+    601: CellCharacteristic2,
+    602: PowerBoardCharacteristic,
+    1102: HeaterStateCharacteristic,
+    1202: SolarStateCharacteristic,
+}
+# Payload offsets of the bytes that move between frames: temperatures, cell
+# current, ORP, pH and the running counters
+LIVE_BYTES = {
+    9: (2, 4, 6),
+    104: (2, 6, 9),
+    300: (),
+    402: (),
+    600: (0, 2),
+    601: (11, 13),
+    602: (0,),
+    1102: (9,),
+    1202: (0, 2, 4),
+}
+
+
+def simulate(devices: int, seconds: float, interval: float, seed: int = 1):
+    """(address, epoch, CmdType, payload) in time order"""
+    rng = random.Random(seed)
+    streams = []
+    for device in range(devices):
+        generator = FrameGenerator(seed=device)
+        address = f"02:00:00:00:00:{device:02X}"
+        for cmd_type, weight in TELEMETRY_MIX.items():
+            # Busier CmdTypes are sent more often
+            period = interval * max(TELEMETRY_MIX.values()) / weight
+            streams.append([rng.uniform(0, period), period, address, cmd_type, bytearray(generator.payload(cmd_type))])
+    start = 1_700_000_000.0
+    records = []
+    for offset, period, address, cmd_type, payload in streams:
+        epoch = offset
+        while epoch < seconds:
+            for position in LIVE_BYTES[cmd_type]:
+                if rng.random() < 0.3:
+                    payload[position] = (payload[position] + rng.choice((-1, 1))) & 0xFF
+            records.append((address, start + epoch, cmd_type, bytes(payload)))
+            epoch += period * rng.uniform(0.98, 1.02)
+    records.sort(key=lambda record: record[1])
+    return records
+
+
+def main(args: argparse.Namespace):
+    records = simulate(args.devices, args.hours * 3600, args.interval)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "telemetry.harc")
+        start = time.perf_counter()
+        writer = ArchiveWriter(path)
+        for address, epoch, cmd_type, payload in records:
+            writer(address, epoch, cmd_type, payload, None)
+        writer.close()
+        write_rate = len(records) / (time.perf_counter() - start)
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        read = list(ArchiveReader(path).read())
+        read_rate = len(read) / (time.perf_counter() - start)
+    # The archive keeps milliseconds, streams landing on the same one may come back in either order
+    if sorted((round(e * 1000), a, c, p) for a, e, c, p in read) != sorted(
+        (round(e * 1000), a, c, p) for a, e, c, p in records
+    ):
+        raise SystemExit("FAIL: archive did not round trip")
+
+    start = time.perf_counter()
+    for _, _, cmd_type, payload in read:
+        PARSERS[cmd_type](payload)
+    parse_rate = len(read) / (time.perf_counter() - start)
+
+    raw = len(records) * RAW_RECORD_BYTES
+    reduction = raw / size
+    print(f"records          {len(records):>12,}")
+    print(f"raw frames       {raw / 1024:>12,.0f} KiB")
+    print(f"archive          {size / 1024:>12,.0f} KiB ({size / len(records):.2f} bytes/record)")
+    print(f"write            {write_rate:>12,.0f} records/s")
+    print(f"read             {read_rate:>12,.0f} records/s")
+    print(f"parse            {parse_rate:>12,.0f} records/s")
+    status = "PASS" if reduction >= TARGET_REDUCTION and read_rate > parse_rate else "FAIL"
+    print(f"{status}: {reduction:.1f}x smaller than raw frames (target {TARGET_REDUCTION}x), reads {read_rate / parse_rate:.1f}x parse speed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=5)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between frames of the busiest CmdTypes")
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Notification ingest at high rates
+
+Compares the coroutine callback with asyncio.Queue.put() (bleak runs it as
+a task per frame) with the synchronous notification_callback() into a
+NotificationQueue, with and without decrypting in the callback. Frames are
+delivered in bursts from event loop callbacks, like a BLE backend
+dispatching a batch of notifications, and a consumer drains the queue.
+
+    python -m benchmarks.ingest
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from pychlorinator.chlorinator import encrypt_characteristic
+from pychlorinator.ingest import NotificationQueue, notification_callback
+
+TARGET_SPEEDUP = 1.5
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+
+
+def legacy_callback(queue, session_key):
+    async def callback_handler(_, data):
+        await queue.put((time.time(), data, session_key, ADDRESS, None))
+
+    background = set()
+
+    # What bleak does with a coroutine callback
+    def dispatch(sender, data):
+        task = asyncio.ensure_future(callback_handler(sender, data))
+        background.add(task)
+        task.add_done_callback(background.discard)
+
+    return dispatch
+
+
+async def run(queue, callback, frames, count, burst):
+    loop = asyncio.get_running_loop()
+    latencies = []
+    done = loop.create_future()
+
+    async def consume():
+        for _ in range(count):
+            epoch = (await queue.get())[0]
+            latencies.append(time.time() - epoch)
+        done.set_result(None)
+
+    def deliver(sent):
+        for i in range(sent, min(sent + burst, count)):
+            callback(None, frames[i % len(frames)])
+        if sent + burst < count:
+            loop.call_soon(deliver, sent + burst)
+
+    consumer = asyncio.create_task(consume())
+    start = time.perf_counter()
+    loop.call_soon(deliver, 0)
+    await done
+    elapsed = time.perf_counter() - start
+    await consumer
+    latencies.sort()
+    return count / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def measure(name, make, frames, args):
+    rate, p50, p99 = asyncio.run(run(*make(), frames, args.frames, args.burst))
+    print(f"{name:<28} {rate:>10,.0f} frames/s  p50 {p50 * 1e6:>8.0f} us  p99 {p99 * 1e6:>8.0f} us")
+    return rate
+
+
+def main(args: argparse.Namespace):
+    session_key = os.urandom(16)
+    frames = [encrypt_characteristic(bytes([2]) + os.urandom(19), session_key) for _ in range(256)]
+    # The ring must hold a whole burst, like a sized --queue-slots
+    slots = max(4096, args.burst)
+
+    def legacy():
+        queue = asyncio.Queue()
+        return queue, legacy_callback(queue, session_key)
+
+    def ring():
+        queue = NotificationQueue(slots)
+        return queue, notification_callback(queue, ADDRESS, session_key)
+
+    def ring_decrypt():
+        queue = NotificationQueue(slots)
+        return queue, notification_callback(queue, ADDRESS, session_key, decrypt=True)
+
+    baseline = measure("async callback + Queue.put", legacy, frames, args)
+    rate = measure("sync callback + ring", ring, frames, args)
+    measure("sync callback + ring + decrypt", ring_decrypt, frames, args)
+    speedup = rate / baseline
+    status = "PASS" if speedup >= TARGET_SPEEDUP else "FAIL"
+    print(f"{status}: synchronous ingest is {speedup:.1f}x the coroutine callback, target {TARGET_SPEEDUP}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--frames", type=int, default=200_000)
+    parser.add_argument("-b", "--burst", type=int, default=64, help="notifications per event loop iteration")
+    main(parser.parse_args())
@@ -0,0 +1,153 @@
+"""
+Sustained load through the decode pipeline
+
+Synthetic devices send valid encrypted frames (pychlorinator.synthetic)
+through the synchronous notification callback into halo_queue_consumer
+with the in-process sinks haloconnect uses (HTTP state cache, field
+history). Viron reads are decrypted and parsed like ChlorinatorAPI does.
+Reports sustained throughput, callback-to-sink latency percentiles, drops
+and memory growth.
+
+    python -m benchmarks.load --devices 50 --rate 5000 --seconds 20
+    python -m benchmarks.load --mix all --viron 0.2      # 0 rate = as fast as possible
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import time
+
+import haloconnect
+from pychlorinator.chlorinator import PARSERS, decrypt_characteristic
+from pychlorinator.history import HistoryStore
+from pychlorinator.http_api import StateCache
+from pychlorinator.ingest import NotificationQueue, notification_callback
+from pychlorinator.synthetic import TELEMETRY_MIX, FrameGenerator
+
+_TICK = 0.005
+_WARMUP = 0.2
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak where /proc is missing)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def parse_mix(text: str):
+    """'telemetry', 'all' or CmdType:weight pairs like '9:10,104:10,600:1'"""
+    if text == "telemetry":
+        return TELEMETRY_MIX
+    if text == "all":
+        return None
+    return {int(cmd): float(weight) for cmd, weight in (pair.split(":") for pair in text.split(","))}
+
+
+class LatencySink:
+    def __init__(self) -> None:
+        self.latencies = []
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        self.latencies.append(time.time() - epoch)
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    return {f"p{p}": ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1e3 for p in (50, 90, 99)}
+
+
+async def drive(args: argparse.Namespace):
+    queue = NotificationQueue(args.queue_slots)
+    latency = LatencySink()
+    sinks = [StateCache(), HistoryStore(args.history_kb * 1024), latency]
+    generators, callbacks = [], []
+    for device in range(args.devices):
+        generator = FrameGenerator(mix=parse_mix(args.mix), seed=device)
+        address = f"02:00:00:00:{device >> 8:02X}:{device & 0xFF:02X}"
+        generators.append(generator)
+        callbacks.append(notification_callback(queue, address, generator.session_key))
+    # Pre-encrypt a pool per device so the driver measures the pipeline, not AES on the send side
+    pools = [[generator.frame()[1] for _ in range(args.pool)] for generator in generators]
+    viron = [generator.viron() for generator in generators[:1] for _ in range(args.pool)]
+    viron_key = generators[0].session_key
+
+    consumer = asyncio.create_task(haloconnect.halo_queue_consumer(queue, sinks))
+    memory_start = rss_bytes()
+    memory_warm = None
+    latency_warm = 0
+    sent = viron_parsed = 0
+    start = time.perf_counter()
+    end = start + args.seconds
+    viron_credit = 0.0
+    while True:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        if memory_warm is None and now - start >= args.seconds * _WARMUP:
+            # History rings are allocated when a device's field is first seen, so with
+            # rare CmdTypes in the mix some growth after the warm-up is still expected
+            memory_warm = rss_bytes()
+            latency_warm = len(latency.latencies)
+        if args.rate:
+            due = int((now - start) * args.rate) - sent
+        else:
+            # As fast as the consumer keeps up, without overrunning the ring
+            due = args.queue_slots // 2 - queue.qsize()
+        for _ in range(max(0, due)):
+            device = sent % args.devices
+            callbacks[device](None, pools[device][(sent // args.devices) % args.pool])
+            sent += 1
+            viron_credit += args.viron
+            while viron_credit >= 1:
+                viron_credit -= 1
+                uuid, value = viron[viron_parsed % len(viron)]
+                PARSERS[uuid](decrypt_characteristic(value, viron_key)).to_dict()
+                viron_parsed += 1
+        await asyncio.sleep(_TICK if args.rate else 0)
+    await queue.put((time.time(), None, None, None, None))
+    await consumer
+    elapsed = time.perf_counter() - start
+    memory_end = rss_bytes()
+    memory_warm = memory_end if memory_warm is None else memory_warm
+
+    decoded = sent - queue.dropped
+    delivered = len(latency.latencies)
+    print(f"devices          {args.devices}")
+    print(f"offered          {sent / args.seconds:>12,.0f} frames/s")
+    print(f"sustained        {decoded / elapsed:>12,.0f} frames/s decoded, {delivered:,} parsed frames to sinks")
+    print(f"viron            {viron_parsed / elapsed:>12,.0f} reads/s")
+    print(f"dropped          {queue.dropped:>12,}")
+    print(
+        "latency ms       "
+        + "  ".join(f"{name} {value:.2f}" for name, value in _percentiles(latency.latencies).items())
+    )
+    # The latency sink itself keeps a float per frame
+    own = 32 * (delivered - latency_warm)
+    print(f"memory warm-up   {(memory_warm - memory_start) / 1024:>12,.0f} KiB")
+    print(f"memory growth    {(memory_end - memory_warm - own) / 1024:>12,.0f} KiB after warm-up")
+
+
+def main(args: argparse.Namespace):
+    # The consumer logs every frame at INFO, keep the console out of the measurement
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(drive(args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=0, help="offered frames/s over all devices, 0 for as fast as possible")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--mix", default="telemetry", help="'telemetry', 'all' or CmdType:weight pairs, e.g. 9:10,104:10,600:1")
+    parser.add_argument("--viron", type=float, default=0, help="Viron reads decoded per Halo frame")
+    parser.add_argument("--pool", type=int, default=256, help="distinct pre-encrypted frames per device")
+    parser.add_argument("--queue-slots", type=int, default=4096)
+    parser.add_argument("--history-kb", type=int, default=1024)
+    main(parser.parse_args())
@@ -0,0 +1,68 @@
+"""
+Retained memory per history sample of parsed characteristics
+
+Compares keeping the parser objects or copies of their vars() dicts with
+to_dict() and the compact to_record() NamedTuples. Each sample is parsed
+from its own payload, as it would be in a long-running history.
+
+    python -m benchmarks.memory
+"""
+
+import argparse
+import gc
+import struct
+import tracemalloc
+
+from pychlorinator.chlorinator_parsers import ChlorinatorState, ChlorinatorStatistics
+from pychlorinator.halo_parsers import (
+    HeaterStateCharacteristic,
+    SolarStateCharacteristic,
+    StateCharacteristic3,
+    TempCharacteristic,
+)
+
+TARGET_REDUCTION = 1.5
+
+
+def sample_payloads(count):
+    """Payloads that vary per sample, so no values are shared between samples"""
+    for i in range(count):
+        yield TempCharacteristic, struct.pack("<BBHHHHBHHB", 0, 63, 300 + i % 50, 270 + i % 40, 275, 0, 1, 352, 0, 2)
+        yield StateCharacteristic3, struct.pack("<BBHBBHBBB2sHB", 2, 5, 4100 + i % 300, 1, 3, 650 + i % 90, 4, 74, 0, b"\0\0", 0, 0)
+        yield HeaterStateCharacteristic, struct.pack("<BBBBBBBBBHB", 9, 1, 1, 28, 1, 0, 0, 0, 1, 276 + i % 30, 0)
+        yield SolarStateCharacteristic, struct.pack("<HHHBBBBBHB", 410 + i % 60, 276, 300, 1, 1, 1, 1, 1, 280, 2)
+        yield ChlorinatorState, bytes([2, 1, 0, 0, 0, 0x3B, 74 + i % 5, 4, 13, 45, 10])
+        yield ChlorinatorStatistics, struct.pack("@BBHHHIIB", 78, 71, 720 + i % 80, 640, 312, 4000 + i, 12, 80)
+
+
+def measure(name, keep, count):
+    """Bytes per sample retained when history holds keep(parsed)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = [keep(parser(payload)) for parser, payload in sample_payloads(count)]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    per_sample = retained / len(history)
+    print(f"{name:<24} {per_sample:>8.0f} bytes/sample")
+    return per_sample
+
+
+def main(args: argparse.Namespace):
+    # Build the record types before measuring
+    for parser, payload in sample_payloads(1):
+        parser(payload).to_record()
+    measure("parser objects", lambda obj: obj, args.samples)
+    legacy = measure("vars() dicts", lambda obj: dict(vars(obj)), args.samples)
+    measure("to_dict()", lambda obj: obj.to_dict(), args.samples)
+    compact = measure("to_record()", lambda obj: obj.to_record(), args.samples)
+    reduction = legacy / compact
+    status = "PASS" if reduction >= TARGET_REDUCTION else "FAIL"
+    print(f"{status}: to_record() is {reduction:.1f}x smaller than vars() dicts, target {TARGET_REDUCTION}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--samples", type=int, default=5000)
+    main(parser.parse_args())
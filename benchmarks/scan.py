@@ -0,0 +1,106 @@
+"""
+CPU spent per scan as unrelated advertisers pile up
+
+Builds scan results like BleakScanner.discover(return_adv=True) returns
+them: one pairable Halo whose TimeAlive byte counts up, plus phones, TVs and
+trackers with their own manufacturer data. The legacy pairing loop
+compares every local name, records RSSI for every advertiser on the adapter
+pool and parses the Halo's ScanResponse every scan. The filtered loop
+rejects on manufacturer ID first and decodes through a ScanResponseCache.
+
+    python -m benchmarks.scan
+"""
+
+import argparse
+import os
+import random
+import time
+
+from bleak.backends.scanner import AdvertisementData
+
+from pychlorinator.adapters import AdapterPool
+from pychlorinator.halo_parsers import ScanResponse
+from pychlorinator.scan_filter import HALO_MANUFACTURER_ID, ScanResponseCache, is_halo_advertisement
+
+TARGET_SPEEDUP = 3
+HALO_NAME = "HCHLOR"
+ADAPTER = "hci0"
+# Apple, Microsoft, Samsung, Google
+OTHER_MANUFACTURERS = (76, 6, 117, 224)
+
+
+class Device:
+    def __init__(self, address: str) -> None:
+        self.address = address
+
+
+def advertisement(name, manufacturer_data, rssi):
+    return AdvertisementData(name, manufacturer_data, {}, [], None, rssi, ())
+
+
+def scans(nearby: int, count: int, seed: int = 1):
+    """`count` scan results with `nearby` unrelated advertisers each"""
+    rng = random.Random(seed)
+    others = [
+        (Device(f"10:00:00:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}"), rng.choice(OTHER_MANUFACTURERS),
+         rng.choice((None, "Phone", "TV", "Tag")), os.urandom(rng.randint(4, 24)))
+        for i in range(nearby)
+    ]
+    halo = Device("02:00:00:00:00:01")
+    head = bytes([1, 1, 1, 0, 0, 0]) + os.urandom(4) + b"1234" + bytes([1, 2, 1, 0, 1, 0])
+    results = []
+    for scan in range(count):
+        found = {
+            device.address: (device, advertisement(name, {manufacturer: data}, rng.randint(-100, -60)))
+            for device, manufacturer, name, data in others
+        }
+        found[halo.address] = (halo, advertisement(HALO_NAME, {HALO_MANUFACTURER_ID: head + bytes([scan % 8])}, -70))
+        results.append(found)
+    return results
+
+
+def legacy(pool: AdapterPool, found: dict):
+    for device, adv in found.values():
+        pool.report_rssi(device.address, ADAPTER, adv.rssi)
+    halos = [adv for device, adv in found.values() if adv.local_name == HALO_NAME]
+    return ScanResponse(halos[0].manufacturer_data[HALO_MANUFACTURER_ID])
+
+
+def filtered(pool: AdapterPool, cache: ScanResponseCache, found: dict):
+    halos = []
+    for device, adv in found.values():
+        if not is_halo_advertisement(adv):
+            continue
+        pool.report_rssi(device.address, ADAPTER, adv.rssi)
+        if adv.local_name == HALO_NAME:
+            halos.append(adv)
+    return cache.get(halos[0].manufacturer_data[HALO_MANUFACTURER_ID])
+
+
+def per_scan(run, results) -> float:
+    start = time.perf_counter()
+    for found in results:
+        run(found)
+    return (time.perf_counter() - start) / len(results)
+
+
+def main(args: argparse.Namespace):
+    speedups = []
+    print(f"{'nearby':>8} {'legacy us/scan':>16} {'filtered us/scan':>18}")
+    for nearby in args.nearby:
+        results = scans(nearby, args.scans)
+        pool = AdapterPool([ADAPTER])
+        old = per_scan(lambda found: legacy(pool, found), results)
+        pool, cache = AdapterPool([ADAPTER]), ScanResponseCache()
+        new = per_scan(lambda found: filtered(pool, cache, found), results)
+        speedups.append(old / new)
+        print(f"{nearby:>8} {old * 1e6:>16,.1f} {new * 1e6:>18,.1f}")
+    status = "PASS" if speedups[-1] >= TARGET_SPEEDUP else "FAIL"
+    print(f"{status}: {speedups[-1]:.1f}x less CPU per scan with {args.nearby[-1]} advertisers nearby (target {TARGET_SPEEDUP}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nearby", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--scans", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+"""
+Serialization throughput of parsed characteristics
+
+Compares the FastSerializable to_dict/to_tuple/to_json_bytes paths with
+json.dumps(vars(obj)) plus a default= encoder for the Enum/IntFlag values.
+
+    python -m benchmarks.serialization
+"""
+
+import argparse
+import datetime
+import json
+import struct
+import time
+from enum import Enum
+
+from pychlorinator.chlorinator_parsers import ChlorinatorState, ChlorinatorStatistics
+from pychlorinator.halo_parsers import (
+    EquipmentModeCharacteristic,
+    HeaterStateCharacteristic,
+    SolarStateCharacteristic,
+    StateCharacteristic3,
+    TempCharacteristic,
+)
+
+TARGET_OBJECTS_PER_SECOND = 100_000
+
+
+def sample_objects():
+    return [
+        TempCharacteristic(struct.pack("<BBHHHHBHHB", 0, 63, 312, 274, 275, 0, 1, 352, 0, 2)),
+        StateCharacteristic3(struct.pack("<BBHBBHBBB2sHB", 2, 5, 4100, 1, 3, 650, 4, 74, 0, b"\0\0", 0, 0)),
+        EquipmentModeCharacteristic(struct.pack("<12BHH", 1, 1, 2, 0, 1, 255, 0, 0, 0, 0, 1, 0, 3, 17)),
+        HeaterStateCharacteristic(struct.pack("<BBBBBBBBBHB", 9, 1, 1, 28, 1, 0, 0, 0, 1, 276, 0)),
+        SolarStateCharacteristic(struct.pack("<HHHBBBBBHB", 410, 276, 300, 1, 1, 1, 1, 1, 280, 2)),
+        ChlorinatorState(bytes([2, 1, 0, 0, 0, 0x3B, 74, 4, 13, 45, 10])),
+        ChlorinatorStatistics(struct.pack("@BBHHHIIB", 78, 71, 720, 640, 312, 4000, 12, 80)),
+    ]
+
+
+def _legacy_default(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    raise TypeError(value)
+
+
+def legacy_json(obj):
+    return json.dumps(vars(obj), default=_legacy_default).encode()
+
+
+def measure(name, func, objects, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for obj in objects:
+            func(obj)
+    elapsed = time.perf_counter() - start
+    rate = iterations * len(objects) / elapsed
+    print(f"{name:<28} {rate:>12,.0f} objects/s")
+    return rate
+
+
+def main(args: argparse.Namespace):
+    objects = sample_objects()
+    measure("vars + json default=", legacy_json, objects, args.iterations)
+    rates = [
+        measure("to_dict", lambda obj: obj.to_dict(), objects, args.iterations),
+        measure("to_tuple", lambda obj: obj.to_tuple(), objects, args.iterations),
+        measure("to_json_bytes", lambda obj: obj.to_json_bytes(), objects, args.iterations),
+    ]
+    worst = min(rates)
+    status = "PASS" if worst >= TARGET_OBJECTS_PER_SECOND else "FAIL"
+    print(f"{status}: slowest fast path {worst:,.0f}/s, target {TARGET_OBJECTS_PER_SECOND:,}/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,262 @@
+"""
+Decode Halo and Viron traffic from a btsnoop / btmon capture
+
+    btmon -w capture.btsnoop
+    python decodecapture.py capture.btsnoop -o decoded.jsonl
+    python decodecapture.py archive/*.btsnoop -o decoded.jsonl --jobs 8
+
+Halo notifications are decrypted and parsed by the same queue consumer as
+haloconnect.py, Viron characteristic reads by the ChlorinatorAPI parsers.
+The session key is taken from the key read at the start of each connection,
+and forgotten when the connection ends.
+
+With --jobs the captures are cut into chunks at record boundaries. A cheap
+sequential pass per capture records the connection state (GATT handles,
+partial fragments, session keys) at every cut, then the chunks are
+decrypted and parsed by a process pool into part files that are merged in
+the order the captures are given, the same output as without --jobs. The
+planning pass is sequential, so one capture speeds up by about 6-7x at most. Finished parts are kept in <output>.parts, so an interrupted
+run picks up where it stopped.
+
+This file is covered under the MIT license described in the file LICENSE
+"""
+import argparse
+import asyncio
+import copy
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import struct
+import sys
+
+import haloconnect
+from pychlorinator import chlorinator
+from pychlorinator.btsnoop import AttExtractor, iter_att_events, iter_packets
+from pychlorinator.chlorinator_parsers import ChlorinatorActions
+
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_UUIDS = (haloconnect.UUID_SLAVE_SESSION_KEY_2, chlorinator.UUID_SLAVE_SESSION_KEY)
+
+
+class JsonLinesOutput:
+    """Consumer sink writing one JSON object per decoded characteristic"""
+
+    def __init__(self, file) -> None:
+        self._file = file
+        self.count = 0
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        self._file.write(
+            b'{"address":"%s","epoch":%r,"cmd_type":"%s","name":"%s","data":%s}\n'
+            % (address.encode(), epoch, str(cmd_type).encode(), type(parsed).__name__.encode(), parsed.to_json_bytes())
+        )
+        self.count += 1
+
+
+def update_session_key(session_keys: dict, address, kind, uuid, value) -> bool:
+    """Record the event as the connection's session key if it is one, forget it when the connection ends"""
+    if kind in ("connect", "disconnect"):
+        # A reconnect reads a new key, frames until then cannot be decrypted
+        session_keys.pop(address, None)
+        return True
+    if kind != "read":
+        return False
+    if uuid in SESSION_KEY_UUIDS or (uuid is None and len(value) == 16 and address not in session_keys):
+        # Without GATT discovery in the capture, the first 16 byte read is the key
+        session_keys[address] = value
+        logger.info(f"{address} session key {value.hex()}")
+        return True
+    return False
+
+
+async def produce(events, queue: asyncio.Queue, output: JsonLinesOutput, session_keys=None):
+    session_keys = {} if session_keys is None else session_keys
+    for epoch, address, kind, uuid, value in events:
+        if kind in ("connect", "disconnect"):
+            update_session_key(session_keys, address, kind, uuid, value)
+            continue
+        if kind == "read":
+            if update_session_key(session_keys, address, kind, uuid, value):
+                pass
+            elif uuid in chlorinator.PARSERS and address in session_keys:
+                data = chlorinator.decrypt_characteristic(value, session_keys[address])
+                try:
+                    output(address, epoch, uuid, value, chlorinator.PARSERS[uuid](data))
+                except (ValueError, struct.error) as err:
+                    logger.warning(f"Failed to parse {uuid} read from {address}: {err}")
+            continue
+        session_key = session_keys.get(address)
+        if session_key is None:
+            continue
+        if kind == "notify" and (uuid == haloconnect.UUID_TX_CHARACTERISTIC or (uuid is None and len(value) == 20)):
+            await queue.put((epoch, value, session_key, address, None))
+        elif kind == "write" and uuid == haloconnect.UUID_RX_CHARACTERISTIC:
+            request = chlorinator.decrypt_characteristic(value, session_key)
+            logger.debug(f"{address} request {int.from_bytes(request[1:3], 'little')} {request.hex()}")
+        elif kind == "write" and uuid == chlorinator.UUID_CHLORINATOR_APP_ACTION:
+            action = chlorinator.decrypt_characteristic(value, session_key)[0]
+            try:
+                action = ChlorinatorActions(action).name
+            except ValueError:
+                pass
+            logger.info(f"{address} action {action}")
+    # Send an "exit command to the consumer"
+    await queue.put((0, None, None, None, None))
+
+
+async def decode(events, output: JsonLinesOutput, session_keys=None):
+    # Bounded queue keeps memory flat however long the capture is
+    queue = asyncio.Queue(maxsize=1024)
+    await asyncio.gather(
+        produce(events, queue, output, session_keys),
+        haloconnect.halo_queue_consumer(queue, [output]),
+    )
+
+
+def capture_id(path: str, chunk_bytes: int) -> str:
+    """Name of a capture's plan and parts, changes with the file or the chunk size"""
+    stat = os.stat(path)
+    fingerprint = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, chunk_bytes)
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()[:16]
+
+
+def plan_chunks(job):
+    """Cut one capture into chunks, returns [(start, end, extractor, session keys)]
+
+    The plan is cached next to the parts and reused while the capture is unchanged.
+    Planning reassembles ACL and tracks GATT state over the whole capture in one
+    process, about 15% of the work of a sequential decode, which caps the speedup
+    of --jobs on a single capture at roughly 6-7x however many cores there are.
+    """
+    path, chunk_bytes, plan_path = job
+    stat = os.stat(path)
+    if os.path.exists(plan_path):
+        with open(plan_path, "rb") as file:
+            cached = pickle.load(file)
+        if cached[0] == (stat.st_size, stat.st_mtime, chunk_bytes):
+            return cached[1]
+    extractor = AttExtractor()
+    session_keys = {}
+    cuts = [(None, AttExtractor(), {})]
+    boundary = chunk_bytes
+    for offset, epoch, adapter, received, packet_type, packet in iter_packets(path):
+        if offset >= boundary:
+            cuts.append((offset, copy.deepcopy(extractor), dict(session_keys)))
+            boundary = offset + chunk_bytes
+        events = (
+            extractor.event(epoch, adapter, packet)
+            if packet_type == "event"
+            else extractor.acl(epoch, adapter, received, packet)
+        )
+        for event in events:
+            update_session_key(session_keys, *event[1:])
+    ends = [cut[0] for cut in cuts[1:]] + [None]
+    plan = [(start, end, state, keys) for (start, state, keys), end in zip(cuts, ends)]
+    temp_path = plan_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump(((stat.st_size, stat.st_mtime, chunk_bytes), plan), file)
+    os.replace(temp_path, plan_path)
+    return plan
+
+
+def decode_chunk(job):
+    """Decode one chunk into its part file, skipped if the part already exists"""
+    path, start, end, extractor, session_keys, part_path = job
+    if os.path.exists(part_path):
+        return part_path
+    temp_path = part_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        asyncio.run(
+            decode(iter_att_events(path, start, end, extractor), JsonLinesOutput(file), session_keys)
+        )
+    os.replace(temp_path, part_path)
+    return part_path
+
+
+def decode_parallel(args: argparse.Namespace):
+    parts_dir = args.output + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    chunk_bytes = args.chunk_mb * 1024 * 1024
+    # Keyed by capture identity, not position, so a changed or reordered capture never reuses stale parts
+    ids = [capture_id(path, chunk_bytes) for path in args.capture]
+    with multiprocessing.Pool(args.jobs) as pool:
+        plans = pool.map(
+            plan_chunks,
+            [(path, chunk_bytes, os.path.join(parts_dir, f"{ids[index]}.plan")) for index, path in enumerate(args.capture)],
+        )
+        jobs = []
+        # Captures are merged in command line order like a sequential run, chunks in file order
+        for index, plan in enumerate(plans):
+            for number, (start, end, extractor, session_keys) in enumerate(plan):
+                part_path = os.path.join(parts_dir, f"{ids[index]}-{number:06d}.jsonl")
+                jobs.append((args.capture[index], start, end, extractor, session_keys, part_path))
+        for done, _ in enumerate(pool.imap_unordered(decode_chunk, jobs), 1):
+            logger.info(f"decoded chunk {done}/{len(jobs)}")
+
+    count = 0
+    temp_path = args.output + ".tmp"
+    with open(temp_path, "wb") as out:
+        for job in jobs:
+            with open(job[-1], "rb") as part:
+                for line in part:
+                    out.write(line)
+                    count += 1
+    os.replace(temp_path, args.output)
+    shutil.rmtree(parts_dir)
+    print(f"decoded {count} characteristics from {len(jobs)} chunks", file=sys.stderr)
+
+
+async def main(args: argparse.Namespace):
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    output = JsonLinesOutput(out)
+    try:
+        for path in args.capture:
+            await decode(iter_att_events(path), output)
+    finally:
+        out.flush()
+        if args.output:
+            out.close()
+    print(f"decoded {output.count} characteristics", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture", nargs="+", help="btsnoop or btmon capture files")
+    parser.add_argument("-o", "--output", help="write JSON lines here instead of stdout")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="decode chunks in this many processes (resumable, needs --output)",
+    )
+    parser.add_argument(
+        "--chunk-mb",
+        type=int,
+        default=64,
+        help="size of the chunks captures are cut into with --jobs",
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_true",
+        help="sets the log level to debug",
+    )
+    args = parser.parse_args()
+    if args.jobs and not args.output:
+        parser.error("--jobs writes its parts next to --output, which is required")
+
+    # Per frame logging of the consumer would dominate a multi-GB decode
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.WARNING,
+        format="%(asctime)-15s %(name)-8s %(levelname)s: %(message)s",
+    )
+
+    if args.jobs:
+        decode_parallel(args)
+    else:
+        asyncio.run(main(args))
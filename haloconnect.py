@@ -8,12 +8,34 @@ import time
 import asyncio
 import logging
 import binascii
+import functools
+import os
+import random
+import struct
 
 from bleak import BleakClient, BleakScanner
+from bleak.exc import BleakError
 from pychlorinator.halo_parsers import *
 
 
 import pychlorinator.chlorinator
+from pychlorinator import metrics
+from pychlorinator.airtime import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, get_scheduler
+from pychlorinator.adapters import AdapterPool
+from pychlorinator.halo_gateway import ShardedGateway
+from pychlorinator.state_table import StateTableWriter
+from pychlorinator.http_api import HttpStateServer, StateCache
+from pychlorinator.tracing import FrameTracer
+from pychlorinator.halo_sync import HistorySync, JsonLinesStore
+from pychlorinator.snapshot import SnapshotWriter, read_snapshot
+from pychlorinator.halo_requests import RequestCorrelator
+from pychlorinator.ingest import NotificationQueue, notification_callback
+from pychlorinator.history import HistoryStore
+from pychlorinator.capabilities import CAPABILITY_CMD_TYPES, CapabilityModel
+from pychlorinator.device_clock import DeviceClock
+from pychlorinator.archive import ArchiveWriter
+from pychlorinator.scan_filter import HALO_MANUFACTURER_ID, ScanResponseCache, is_halo_advertisement
+from pychlorinator.halo_validation import frame_error, header_error, payload_error
 
 
 logger = logging.getLogger(__name__)
@@ -25,12 +47,32 @@ UUID_MASTER_AUTHENTICATION_2 = "45000002-98b7-4e29-a03f-160174643002"
 UUID_TX_CHARACTERISTIC = "45000003-98b7-4e29-a03f-160174643002"
 UUID_RX_CHARACTERISTIC = "45000004-98b7-4e29-a03f-160174643002"
 ASTRALPOOL_HALO_BLE_NAME = "HCHLOR"
+# ReadForCatchAll CmdTypes of the statistics page, requested every loop
+STATS_CMD_TYPES = (600, 601, 602, 603)
+# Seconds before the first reconnect after a link failure, doubled per failure
+RECONNECT_BACKOFF = 1.0
+RECONNECT_BACKOFF_MAX = 60.0
 
 class DeviceNotFoundError(Exception):
     pass
 
 
-async def halo_ble_client(args: argparse.Namespace, queue: asyncio.Queue):
+async def monitor_adapters(pool: AdapterPool, interval: float = 60.0):
+    """Refresh per adapter RSSI with a short scan so degraded links can be migrated"""
+    while True:
+        await asyncio.sleep(interval)
+        await pool.scan(timeout=2, accept=is_halo_advertisement)
+
+
+async def halo_ble_client(
+    args: argparse.Namespace,
+    queue: asyncio.Queue,
+    tracer: FrameTracer = None,
+    history: HistorySync = None,
+    pool: AdapterPool = None,
+    requests: RequestCorrelator = None,
+    capabilities: CapabilityModel = None,
+):
     #ACCESS_CODE = bytes("xxxx", "utf_8")
     ACCESS_CODE = None
 
@@ -38,14 +80,21 @@ async def halo_ble_client(args: argparse.Namespace, queue: asyncio.Queue):
 
     halo_scan_response = None
     halo_device = None
+    scheduler = get_scheduler()
+    scan_responses = ScanResponseCache()
 
     while not isPaired:
         logger.info("Scanning for HALO Advertisements...")
 
-        all_devices = await BleakScanner.discover(return_adv=True, timeout=5)
+        if pool is not None:
+            all_devices = await pool.scan(timeout=5, accept=is_halo_advertisement)
+        else:
+            await scheduler.wait_scan_allowed()
+            all_devices = await BleakScanner.discover(return_adv=True, timeout=5)
         found_devices = []
         for device, adv in all_devices.values():
-               if adv.local_name == ASTRALPOOL_HALO_BLE_NAME:
+            # Manufacturer ID first, most advertisers nearby are not a Halo
+            if is_halo_advertisement(adv) and adv.local_name == ASTRALPOOL_HALO_BLE_NAME:
                 found_devices.append([device, adv])
                 logger.info(f"Halo Device found: {adv}")
         if len(found_devices) == 0:
@@ -55,12 +104,12 @@ async def halo_ble_client(args: argparse.Namespace, queue: asyncio.Queue):
             halo_device = found_devices[0][0]
             manufacturer_data = found_devices[0][1].manufacturer_data
             
-            logger.info(f"Halo Scan: {halo_device} {binascii.hexlify(manufacturer_data[1095])}")
-            halo_scan_response = ScanResponse(manufacturer_data[1095])
+            logger.info(f"Halo Scan: {halo_device} {binascii.hexlify(manufacturer_data[HALO_MANUFACTURER_ID])}")
+            halo_scan_response = scan_responses.get(manufacturer_data[HALO_MANUFACTURER_ID])
             logger.info(f"Scan response: {vars(halo_scan_response)}")
             logger.info(f"Is Pairable?: {halo_scan_response.isPairable}")
 
-        if halo_scan_response.isPairable:
+        if halo_scan_response is not None and halo_scan_response.isPairable:
             ''' Grab Access code from Manufactorer_Data in Advertisement'''
             logger.info(f"Access Code: {halo_scan_response.ByteAccessCode}")
             ACCESS_CODE = halo_scan_response.ByteAccessCode
@@ -71,9 +120,18 @@ async def halo_ble_client(args: argparse.Namespace, queue: asyncio.Queue):
 
 
     ''' ASSUME DEVICE IS PAIRED / VALID ACCESS_CODE FOR BELOW TO WORK '''
-    device = await BleakScanner.find_device_by_name(
-        ASTRALPOOL_HALO_BLE_NAME, cb=dict(use_bdaddr=args.macos_use_bdaddr)
-    )
+    if pool is not None:
+        device = next(
+            (device for device, adv in (await pool.scan(timeout=5, accept=is_halo_advertisement)).values()
+             if adv.local_name == ASTRALPOOL_HALO_BLE_NAME),
+            None,
+        )
+    else:
+        await scheduler.wait_scan_allowed()
+        device = await BleakScanner.find_device_by_filter(
+            lambda _, adv: is_halo_advertisement(adv) and adv.local_name == ASTRALPOOL_HALO_BLE_NAME,
+            cb=dict(use_bdaddr=args.macos_use_bdaddr),
+        )
     if device is None:
         logger.error("Could not find Halo named '%s'", args.name)
         raise DeviceNotFoundError
@@ -81,136 +139,270 @@ async def halo_ble_client(args: argparse.Namespace, queue: asyncio.Queue):
     #logger.info(f"Halo name: {device.name}, Address: {device.address}, meta: {device.metadata}")
     logger.info("connecting to Halo...")
 
-    async def callback_handler(_, data):
-        await queue.put((time.time(), data, session_key))
-
-  
-    async with BleakClient(device) as client:
-        logger.info("connected to Halo...")
-        session_key = await client.read_gatt_char(UUID_SLAVE_SESSION_KEY_2)
-        print(f"got session key {session_key.hex()}")
-        
-        await client.start_notify(UUID_TX_CHARACTERISTIC, callback_handler)
-        print(f"Turn on notifications for {UUID_TX_CHARACTERISTIC}")
-
-        await client.start_notify(UUID_TX_CHARACTERISTIC, callback_handler)
-        print(f"Turn on notifications for {UUID_TX_CHARACTERISTIC}")
-
-        mac = pychlorinator.chlorinator.encrypt_mac_key(session_key, ACCESS_CODE)
-        print(f"mac key to write {mac.hex()}")
-        await client.write_gatt_char(UUID_MASTER_AUTHENTICATION_2, mac)
-
-        ''' PerformVomitAsync'''
-        logger.info("PerformVomitAsync...")
-        await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 107, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(107)
-        await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(5)
-
-        while True:
-            logger.info("***** Sending Keep Alive")
-            await asyncio.sleep(5)
-            await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(1) KEEP ALIVE
-
-            logger.info("***** Requesting Additional Stats")
-            await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 88, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(600) StatsPage Data
-            await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 89, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(601) StatsPage Data
-            await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 90, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(602) StatsPage Data
-            await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 91, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(603) StatsPage Data
-            #await client.write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 101, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(101) Testing request for 101
-
-        await asyncio.sleep(25.0)
-        await client.stop_notify(UUID_TX_CHARACTERISTIC)
-        # Send an "exit command to the consumer"
-        await queue.put((time.time(), None))
+    def wanted(cmd_type: int) -> bool:
+        """Whether a request is for a feature the device may have"""
+        return capabilities is None or capabilities.wants(device.address, cmd_type)
 
+    monitor = asyncio.create_task(monitor_adapters(pool)) if pool is not None else None
+    adapter = None
+    backoff = RECONNECT_BACKOFF
+    retry_delay = 0.0
+    while True:
+        if retry_delay:
+            await asyncio.sleep(retry_delay)
+            retry_delay = 0.0
+        client_target = device
+        client_kwargs = {}
+        if pool is not None:
+            # Connect by address through the adapter with the best signal and load
+            adapter = pool.assign(device.address)
+            scheduler = get_scheduler(adapter)
+            client_target = device.address
+            client_kwargs["adapter"] = adapter
+        migrate_to = None
+        try:
+            connect_slot = await scheduler.connect_slot(PRIORITY_INTERACTIVE)
+            connect_start = time.perf_counter()
+            async with connect_slot, BleakClient(client_target, **client_kwargs) as client:
+                logger.info("connected to Halo...")
+                auth_start = time.perf_counter()
+                metrics.CONNECT_SECONDS.observe(auth_start - connect_start, "halo")
+
+                async def write_gatt_char(uuid, data, priority=PRIORITY_BACKGROUND):
+                    await scheduler.acquire(device.address, priority)
+                    with metrics.WRITE_SECONDS.time("halo"):
+                        await client.write_gatt_char(uuid, data)
+
+                await scheduler.acquire(device.address, PRIORITY_INTERACTIVE)
+                session_key = await client.read_gatt_char(UUID_SLAVE_SESSION_KEY_2)
+                print(f"got session key {session_key.hex()}")
+
+                callback_handler = notification_callback(
+                    queue, device.address, session_key, tracer, decrypt=args.inline_decrypt
+                )
+                await client.start_notify(UUID_TX_CHARACTERISTIC, callback_handler)
+                print(f"Turn on notifications for {UUID_TX_CHARACTERISTIC}")
+
+                await client.start_notify(UUID_TX_CHARACTERISTIC, callback_handler)
+                print(f"Turn on notifications for {UUID_TX_CHARACTERISTIC}")
+
+                mac = pychlorinator.chlorinator.encrypt_mac_key(session_key, ACCESS_CODE)
+                print(f"mac key to write {mac.hex()}")
+                await write_gatt_char(UUID_MASTER_AUTHENTICATION_2, mac, PRIORITY_INTERACTIVE)
+                metrics.AUTH_SECONDS.observe(time.perf_counter() - auth_start, "halo")
+                connect_slot.release()  # connection is set up, let the next device connect
+                if pool is not None:
+                    pool.report_success(device.address)
+                backoff = RECONNECT_BACKOFF
+                if requests is not None:
+                    async def send_request(frame):
+                        await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(frame, session_key))
+
+                    requests.attach(device.address, send_request)
+
+                ''' PerformVomitAsync'''
+                logger.info("PerformVomitAsync...")
+                await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 107, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(107)
+                await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(5)
+
+                while True:
+                    logger.info("***** Sending Keep Alive")
+                    await asyncio.sleep(5)
+                    await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(1) KEEP ALIVE
+
+                    logger.info("***** Requesting Additional Stats")
+                    cmd_types = [cmd_type for cmd_type in STATS_CMD_TYPES if wanted(cmd_type)]
+                    if requests is not None:
+                        # Awaits the 600-603 responses, the refresh is done as soon as they are in
+                        stats_start = time.perf_counter()
+                        results = await asyncio.gather(
+                            *(requests.request(device.address, cmd_type) for cmd_type in cmd_types),
+                            return_exceptions=True,
+                        )
+                        for cmd_type, result in zip(cmd_types, results):
+                            if isinstance(result, asyncio.TimeoutError):
+                                logger.warning(f"Stats request {cmd_type} failed: {result!r}")
+                            elif isinstance(result, BaseException):
+                                # A failed send means the link is gone, leave it to the reconnect path
+                                raise result
+                        logger.info(f"Stats refreshed in {time.perf_counter() - stats_start:.3f}s")
+                    else:
+                        for cmd_type in cmd_types:
+                            await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(read_for_catch_all(cmd_type), session_key)) # ReadForCatchAll(600-603) StatsPage Data
+                    if history is not None:
+                        # Only new info log entries and timer slots that may have changed
+                        for request in history.requests(device.address):
+                            cmd_type = int.from_bytes(request[1:3], "little")
+                            if request != read_for_catch_all(603) and wanted(cmd_type):  # 603 already requested above
+                                await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(request, session_key))
+                    if pool is not None:
+                        migrate_to = pool.migration_target(device.address)
+                        if migrate_to is not None:
+                            logger.info(f"link on {adapter} degraded, migrating to {migrate_to}")
+                            break
+                #await write_gatt_char(UUID_RX_CHARACTERISTIC, pychlorinator.chlorinator.encrypt_characteristic(bytes([2, 101, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]), session_key)) # ReadForCatchAll(101) Testing request for 101
+
+                if migrate_to is not None:
+                    continue
+                await asyncio.sleep(25.0)
+                await client.stop_notify(UUID_TX_CHARACTERISTIC)
+                # Send an "exit command to the consumer"
+                await queue.put((time.time(), None, None, device.address, None))
+        except (BleakError, asyncio.TimeoutError) as err:
+            if pool is None:
+                raise
+            # Jittered so a device that is down or a wedged adapter does not eat the airtime
+            retry_delay = backoff / 2 + random.uniform(0, backoff / 2)
+            backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+            logger.warning(f"Halo link on {adapter} failed: {err}, reconnecting in {retry_delay:.1f}s")
+            pool.report_failure(device.address)
+            continue
+        finally:
+            if requests is not None:
+                requests.detach(device.address)
+            if pool is not None:
+                pool.release(device.address)
+        break
+
+    if monitor is not None:
+        monitor.cancel()
     logger.info("disconnected")
 
 
 
-async def halo_queue_consumer(queue: asyncio.Queue):
+async def halo_queue_consumer(
+    queue: asyncio.Queue,
+    sinks=(),
+    tracer: FrameTracer = None,
+    warm_start=(),
+    capabilities: CapabilityModel = None,
+):
+    """Decrypt and parse queued frames, handing each parsed characteristic to the sinks
+
+    A sink is called as sink(address, epoch, CmdType, CmdData, parsed) and may
+    have a close() method that is called when the consumer exits. Sampled
+    frames carry a trace that is stamped at each stage and handed to tracer.
+    warm_start (address, epoch, CmdType, CmdData) records from a snapshot are
+    parsed first and handed to sink.restore() where a sink has one.
+    Frames of features the CapabilityModel (also one of the sinks) knows a
+    device lacks are counted and skipped before parsing, warm start records
+    included. Exceptions from a
+    handler or a sink are counted and logged, the consumer carries on.
+    """
     logger.info("Starting Halo queue consumer")
 
+    def log_parsed(name, parsed):
+        logger.info(f"{name} {vars(parsed)}")
+        return parsed
+
+    def parse(address):
+        """Parsed characteristic of the current frame, None if its handler failed"""
+        try:
+            return cmds[CmdType]()
+        except (ValueError, struct.error) as err:
+            # Never let one corrupt frame kill the consumer
+            metrics.REJECTED_FRAMES.inc("parse")
+            logger.warning(f"Failed to parse {CmdType} frame from {address}: {err}")
+        except Exception:  # pylint: disable=broad-except
+            # Nor a bug in a handler
+            metrics.REJECTED_FRAMES.inc("parse")
+            logger.exception(f"Handler for {CmdType} failed on a frame from {address}")
+        return None
+
+    def deliver(sink, address, epoch, parsed, restore=False):
+        try:
+            (getattr(sink, "restore", sink) if restore else sink)(address, epoch, CmdType, CmdData, parsed)
+        except Exception:  # pylint: disable=broad-except
+            name = getattr(sink, "__name__", type(sink).__name__)
+            metrics.SINK_ERRORS.inc(name)
+            logger.exception(f"Sink {name} failed on {CmdType} frame from {address}")
+
     def ExtractUnknown():
         logger.debug(f"Unknown {CmdType} {CmdData}")
 
     def ExtractProfile(): #1
-        logger.info(f"ExtractProfile: {vars(DeviceProfileCharacteristic2(CmdData))}")
+        return log_parsed("ExtractProfile", DeviceProfileCharacteristic2(CmdData))
+    def ExtractTime(): #2
+        return log_parsed("ExtractTime", TimeCharacteristic(CmdData))
+    def ExtractDate(): #3
+        return log_parsed("ExtractDate", DateCharacteristic(CmdData))
     def ExtractName(): #6
         logger.info(f"ExtractName {CmdData.decode('utf-8', errors='ignore')}")
     def ExtractTemp(): #9
-        logger.info(f"ExtractTemp {vars(TempCharacteristic(CmdData))}")
+        return log_parsed("ExtractTemp", TempCharacteristic(CmdData))
 
     def ExtractSettings(): #100
-        logger.info(f"ExtractSettings {vars(SettingsCharacteristic2(CmdData))}")
+        return log_parsed("ExtractSettings", SettingsCharacteristic2(CmdData))
     def ExtractWaterVolume(): #101
-        logger.info(f"ExtractWaterVolume {vars(WaterVolumeCharacteristic(CmdData))}")
+        return log_parsed("ExtractWaterVolume", WaterVolumeCharacteristic(CmdData))
     def ExtractSetPoint(): #102
-        logger.info(f"ExtractSetPoint {vars(SetPointCharacteristic(CmdData))}")
+        return log_parsed("ExtractSetPoint", SetPointCharacteristic(CmdData))
     def ExtractState(): #104
-        logger.info(f"ExtractState {vars(StateCharacteristic3(CmdData))}")
+        return log_parsed("ExtractState", StateCharacteristic3(CmdData))
     def ExtractCapabilities(): #105
-        logger.info(f"ExtractCapabilities {vars(CapabilitiesCharacteristic2(CmdData))}")
+        return log_parsed("ExtractCapabilities", CapabilitiesCharacteristic2(CmdData))
     def ExtractMaintenanceState(): #106
-        logger.info(f"ExtractMaintenanceState {vars(MaintenanceStateCharacteristic(CmdData))}")
+        return log_parsed("ExtractMaintenanceState", MaintenanceStateCharacteristic(CmdData))
     def ExtractFlexSettings(): #107
-        logger.inf(f"ExtractFlexSettings")
+        logger.info(f"ExtractFlexSettings")
 
     def ExtractEquipmentConfig(): #201
-        logger.info(f"ExtractEquipmentConfig {vars(EquipmentModeCharacteristic(CmdData))}")
+        return log_parsed("ExtractEquipmentConfig", EquipmentModeCharacteristic(CmdData))
     def ExtractEquipmentParameter(): #202
-        logger.info(f"ExtractEquipmentParameter {vars(EquipmentParameterCharacteristic(CmdData))}")
+        return log_parsed("ExtractEquipmentParameter", EquipmentParameterCharacteristic(CmdData))
 
     def ExtractLightState(): #300
-        logger.info(f"ExtractLightState {vars(LightStateCharacteristic(CmdData))}")
+        return log_parsed("ExtractLightState", LightStateCharacteristic(CmdData))
     def ExtractLightCapabilities(): #301
-        logger.info(f"ExtractLightCapabilities {vars(LightCapabilitiesCharacteristic(CmdData))}")
+        return log_parsed("ExtractLightCapabilities", LightCapabilitiesCharacteristic(CmdData))
     def ExtractLightZoneNames(): #302
-        logger.info(f"ExtractLightZoneNames {vars(LightSetupCharacteristic(CmdData))}")
+        return log_parsed("ExtractLightZoneNames", LightSetupCharacteristic(CmdData))
 
     def ExtractTimerCapabilities(): #400
-        logger.info(f"ExtractTimerCapabilities")
+        return log_parsed("ExtractTimerCapabilities", TimerCapabilitiesCharacteristic(CmdData))
     def ExtractTimerSetup(): #401
-        logger.info(f"ExtractTimerSetup")
+        return log_parsed("ExtractTimerSetup", TimerSetupCharacteristic(CmdData))
     def ExtractTimerState(): #402
-        logger.info(f"ExtractTimerState")
+        return log_parsed("ExtractTimerState", TimerStateCharacteristic(CmdData))
     def ExtractTimerConfig(): #403
-        logger.info(f"ExtractTimerConfig")
+        return log_parsed("ExtractTimerConfig", TimerConfigCharacteristic(CmdData))
 
     def ExtractProbeStatistics(): #600
-        logger.info(f"ExtractProbeStatistics {vars(ProbeCharacteristic(CmdData))}")
+        return log_parsed("ExtractProbeStatistics", ProbeCharacteristic(CmdData))
     def ExtractCellStatistics(): #601
-        logger.info(f"ExtractCellStatistics {vars(CellCharacteristic2(CmdData))}")
+        return log_parsed("ExtractCellStatistics", CellCharacteristic2(CmdData))
     def ExtractPowerBoardStatistics(): #602
-        logger.info(f"ExtractPowerBoardStatistics {vars(PowerBoardCharacteristic(CmdData))}")
+        return log_parsed("ExtractPowerBoardStatistics", PowerBoardCharacteristic(CmdData))
     def ExtractInfoLog(): #603
-        logger.info(f"ExtractInfoLog")
+        return log_parsed("ExtractInfoLog", InfoLogCharacteristic(CmdData))
 
     def ExtractHeaterCapabilities(): #1100
-        logger.info(f"ExtractHeaterCapabilities {vars(HeaterCapabilitiesCharacteristic(CmdData))}")
+        return log_parsed("ExtractHeaterCapabilities", HeaterCapabilitiesCharacteristic(CmdData))
     def ExtractHeaterConfig(): #1101
-        logger.info(f"HeaterConfigCharacteristic {vars(HeaterConfigCharacteristic(CmdData))}")
+        return log_parsed("HeaterConfigCharacteristic", HeaterConfigCharacteristic(CmdData))
     def ExtractHeaterState(): #1102
-        logger.info(f"ExtractHeaterState {vars(HeaterStateCharacteristic(CmdData))}")
+        return log_parsed("ExtractHeaterState", HeaterStateCharacteristic(CmdData))
     def ExtractHeaterCooldownState(): #1104
-        logger.info(f"ExtractHeaterCooldownState {vars(HeaterCooldownStateCharacteristic(CmdData))}")
+        return log_parsed("ExtractHeaterCooldownState", HeaterCooldownStateCharacteristic(CmdData))
 
     def ExtractSolarCapabilities(): #1200
-        logger.info(f"ExtractSolarCapabilities {vars(SolarCapabilitiesCharacteristic(CmdData))}")
+        return log_parsed("ExtractSolarCapabilities", SolarCapabilitiesCharacteristic(CmdData))
     def ExtractSolarConfig(): #1201
-        logger.info(f"ExtractSolarConfig {vars(SolarConfigCharacteristic(CmdData))}")
+        return log_parsed("ExtractSolarConfig", SolarConfigCharacteristic(CmdData))
     def ExtractSolarState(): #1202
-        logger.info(f"ExtractSolarState {vars(SolarStateCharacteristic(CmdData))}")
+        return log_parsed("ExtractSolarState", SolarStateCharacteristic(CmdData))
 
     def ExtractGPONames(): #1300
-        logger.info(f"ExtractGPONames {vars(GPOSetupCharacteristic(CmdData))}")
+        return log_parsed("ExtractGPONames", GPOSetupCharacteristic(CmdData))
     def ExtractRelayNames(): #1301
-        logger.info(f"ExtractRelayNames {vars(RelaySetupCharacteristic(CmdData))}")
+        return log_parsed("ExtractRelayNames", RelaySetupCharacteristic(CmdData))
     def ExtractValveNames(): #1302
-        logger.info(f"ExtractValveNames {vars(ValveSetupCharacteristic(CmdData))}")
+        return log_parsed("ExtractValveNames", ValveSetupCharacteristic(CmdData))
 
     cmds = {
         1: ExtractProfile,
-        2: ExtractUnknown, # Extract Time (do we care?)
-        3: ExtractUnknown, # Extract Date (do we care?)
+        2: ExtractTime,
+        3: ExtractDate,
         5: ExtractUnknown,
         6: ExtractName,
         9: ExtractTemp,
@@ -246,24 +438,88 @@ async def halo_queue_consumer(queue: asyncio.Queue):
         1302: ExtractValveNames
     }
 
+    # Capability records first, so the model prunes the rest of the snapshot like live frames
+    for address, epoch, CmdType, CmdData in sorted(warm_start, key=lambda record: record[2] not in CAPABILITY_CMD_TYPES):
+        if CmdType not in cmds or payload_error(CmdType, CmdData):
+            continue
+        if capabilities is not None and not capabilities.wants(address, CmdType):
+            metrics.PRUNED_FRAMES.inc(CmdType)
+            continue
+        parsed = parse(address)
+        if parsed is not None:
+            for sink in sinks:
+                deliver(sink, address, epoch, parsed, restore=True)
+    if warm_start:
+        logger.info(f"Restored {len(warm_start)} characteristics from snapshot")
+
     while True:
         # Use await asyncio.wait_for(queue.get(), timeout=1.0) if you want a timeout for getting data.
-        epoch, data, session_key = await queue.get()
+        epoch, data, session_key, address, trace = await queue.get()
+        FrameTracer.mark(trace)  # dequeue
         if data is None:
             logger.info(
                 "Got message from client about disconnection. Exiting consumer loop..."
             )
             break
         else:
-            decrypted = pychlorinator.chlorinator.decrypt_characteristic(data, session_key)
+            metrics.QUEUE_DEPTH.set(queue.qsize())
+            metrics.QUEUE_WAIT_SECONDS.observe(time.time() - epoch)
+
+            error = frame_error(data)
+            if error:
+                metrics.REJECTED_FRAMES.inc(error)
+                logger.debug(f"Dropped frame from {address}: {error}")
+                continue
+
+            decrypt_start = time.perf_counter()
+            if session_key is None:
+                decrypted = data  # decrypted in the BLE callback
+            else:
+                decrypted = pychlorinator.chlorinator.decrypt_characteristic(data, session_key)
+            FrameTracer.mark(trace)  # decrypt
+            parse_start = time.perf_counter()
+            metrics.DECRYPT_SECONDS.observe(parse_start - decrypt_start)
             #logger.info("Received data at %s: %r", epoch, binascii.hexlify(decrypted))
 
             CmdType = int.from_bytes(decrypted[1:3], byteorder='little')
             CmdData = decrypted[3:19]
             #logger.info(f"CMD: {CmdType} DATA: {binascii.hexlify(CmdData)}")
+            error = header_error(CmdType)
+            if error:
+                metrics.REJECTED_FRAMES.inc(error)
+                logger.debug(f"Dropped frame from {address}: {error} {binascii.hexlify(decrypted)}")
+                continue
+            metrics.NOTIFICATIONS.inc(CmdType)
+            if capabilities is not None and not capabilities.wants(address, CmdType):
+                metrics.PRUNED_FRAMES.inc(CmdType)
+                continue
 
             if CmdType in cmds:
-                cmds[CmdType]()
+                error = payload_error(CmdType, CmdData)
+                if error:
+                    metrics.REJECTED_FRAMES.inc(error)
+                    logger.debug(f"Dropped {CmdType} frame from {address}: {error} {binascii.hexlify(CmdData)}")
+                    continue
+                parsed = parse(address)
+                FrameTracer.mark(trace)  # parse
+                metrics.PARSE_SECONDS.observe(time.perf_counter() - parse_start, CmdType)
+                FrameTracer.mark(trace)  # dispatch
+                if parsed is not None:
+                    for sink in sinks:
+                        deliver(sink, address, epoch, parsed)
+            else:
+                metrics.UNKNOWN_CMD_TYPES.inc(CmdType)
+                FrameTracer.mark(trace)  # parse
+                FrameTracer.mark(trace)  # dispatch
+            if trace is not None:
+                tracer.finish(trace, address, CmdType)  # sink
+
+    for sink in sinks:
+        if hasattr(sink, "close"):
+            try:
+                sink.close()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(f"Closing sink {type(sink).__name__} failed")
 
 
 
@@ -271,15 +527,96 @@ async def halo_queue_consumer(queue: asyncio.Queue):
 
 
 
+def decoder_consumer(state_table: bool = False):
+    """Consumer of one --workers decoder process, with sinks built in that process"""
+    # First sink, so capability frames update the model before the others see them
+    capabilities = CapabilityModel()
+    sinks = [capabilities]
+    if state_table:
+        sinks.append(StateTableWriter())
+    return functools.partial(halo_queue_consumer, sinks=sinks, capabilities=capabilities)
+
+
 async def main(args: argparse.Namespace):
-    queue = asyncio.Queue()
-    client_task = halo_ble_client(args, queue)  # Handles outbound BLE messages
-    consumer_task = halo_queue_consumer(queue)  # Handles inbound BLE messages (inserted to queue from BLE Callback)
+    pool = AdapterPool(args.adapters.split(",")) if args.adapters else None
+
+    if args.workers:
+        # BLE I/O stays on this process, decrypt/parse runs in decoder processes
+        # Each decoder prunes with its own model, requests are not pruned
+        gateway = ShardedGateway(decoder_consumer, {"state_table": args.state_table}, workers=args.workers)
+        gateway.start()
+        http_server = None
+        if args.http_port:
+            # Decoding happens in the worker processes, only BLE metrics are local
+            http_server = HttpStateServer(None, port=args.http_port, registry=metrics.REGISTRY)
+            await http_server.start()
+        try:
+            await halo_ble_client(args, gateway, pool=pool)
+        except DeviceNotFoundError:
+            pass
+        finally:
+            gateway.stop()
+            if http_server is not None:
+                await http_server.close()
+        logger.info("Main method done.")
+        return
+
+    # First sink, so capability frames update the model before the others see them
+    capabilities = CapabilityModel()
+    sinks = [capabilities]
+    if args.state_table:
+        sinks.append(StateTableWriter())
+    clock = DeviceClock()
+    sinks.append(clock)
+    http_server = None
+    if args.http_port:
+        history_store = HistoryStore(args.history_kb * 1024) if args.history_kb else None
+        http_server = HttpStateServer(
+            StateCache(), port=args.http_port, registry=metrics.REGISTRY, history=history_store, clock=clock
+        )
+        sinks.append(http_server.cache)
+        if history_store is not None:
+            sinks.append(history_store)
+        await http_server.start()
+
+    queue = NotificationQueue(args.queue_slots)
+    history = None
+    if args.history_dir:
+        os.makedirs(args.history_dir, exist_ok=True)
+        history = HistorySync(
+            os.path.join(args.history_dir, "cursors.json"),
+            JsonLinesStore(os.path.join(args.history_dir, "history.jsonl")),
+        )
+        sinks.append(history)
+
+    warm_start = []
+    if args.snapshot:
+        warm_start = read_snapshot(args.snapshot)
+        sinks.append(SnapshotWriter(args.snapshot))
+
+    if args.archive:
+        sinks.append(ArchiveWriter(args.archive))
+
+    requests = RequestCorrelator()
+    sinks.append(requests)
+
+    tracer = FrameTracer(args.trace_rate) if args.trace_rate else None
+    client_task = halo_ble_client(args, queue, tracer, history, pool, requests, capabilities)  # Handles outbound BLE messages
+    consumer_task = halo_queue_consumer(queue, sinks, tracer, warm_start, capabilities)  # Handles inbound BLE messages (inserted to queue from BLE Callback)
 
     try:
         await asyncio.gather(client_task, consumer_task)
     except DeviceNotFoundError:
         pass
+    finally:
+        if http_server is not None:
+            await http_server.close()
+        if tracer is not None:
+            for stage, stats in tracer.percentiles().items():
+                logger.info(f"trace {stage}: {stats}")
+            if args.trace_file:
+                count = tracer.export_chrome_trace(args.trace_file)
+                logger.info(f"wrote {count} frame traces to {args.trace_file}")
 
     logger.info("Main method done.")
 
@@ -300,7 +637,103 @@ if __name__ == "__main__":
         help="sets the logging level to debug",
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=0,
+        help="decode frames in this many decoder processes (0 decodes in-process)",
+    )
+
+    parser.add_argument(
+        "--queue-slots",
+        type=int,
+        default=4096,
+        help="frames the in-process decode queue holds before notifications are dropped",
+    )
+
+    parser.add_argument(
+        "--inline-decrypt",
+        action="store_true",
+        help="decrypt notifications in the BLE callback, not available with --workers",
+    )
+
+    parser.add_argument(
+        "--state-table",
+        action="store_true",
+        help="publish the latest state of each device in shared memory (see pychlorinator.state_table)",
+    )
+
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        default=0,
+        help="serve the latest device state and /metrics over HTTP on 127.0.0.1 at this port "
+        "(with --workers only /metrics is served)",
+    )
+
+    parser.add_argument(
+        "--history-kb",
+        type=int,
+        default=1024,
+        help="memory per device for the in-process field history served at "
+        "/devices/<address>/history/<field> (0 disables it)",
+    )
+
+    parser.add_argument(
+        "--trace-rate",
+        type=float,
+        default=0,
+        help="trace this fraction of frames through each pipeline stage (e.g. 0.01)",
+    )
+
+    parser.add_argument(
+        "--trace-file",
+        help="write sampled frame traces to this Chrome trace / Perfetto JSON file on exit",
+    )
+
+    parser.add_argument(
+        "--snapshot",
+        help="keep a warm-start snapshot of the last payloads in this file, "
+        "restored as stale values on startup",
+    )
+
+    parser.add_argument(
+        "--archive",
+        help="append every decoded payload to this delta-compressed telemetry archive, "
+        "not available with --workers",
+    )
+
+    parser.add_argument(
+        "--adapters",
+        help="comma separated local Bluetooth adapters to spread devices over, e.g. hci0,hci1",
+    )
+
+    parser.add_argument(
+        "--history-dir",
+        help="incrementally sync the info log and timers into this directory "
+        "(history.jsonl plus cursors.json), needs --experimental-history-sync, "
+        "not available with --workers",
+    )
+
+    parser.add_argument(
+        "--experimental-history-sync",
+        action="store_true",
+        help="allow --history-dir, which sends indexed ReadForCatchAll requests and stores "
+        "info log and timer layouts not yet confirmed against the .net code",
+    )
+
     args = parser.parse_args()
+    if args.history_dir and not args.experimental_history_sync:
+        parser.error("--history-dir uses unconfirmed request and frame layouts, add --experimental-history-sync to use it")
+    if args.history_dir and args.workers:
+        parser.error("--history-dir plans requests from the in-process decoder and cannot be used with --workers")
+    if args.inline_decrypt and args.workers:
+        parser.error("--inline-decrypt would hand plaintext to the decoder processes and cannot be used with --workers")
+    if args.snapshot and args.workers:
+        parser.error("--snapshot is written by the in-process decoder and cannot be used with --workers")
+    if args.archive and args.workers:
+        parser.error("--archive is written by the in-process decoder and cannot be used with --workers")
 
     log_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(
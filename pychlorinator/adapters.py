@@ -0,0 +1,153 @@
+"""Distribution of devices over several local Bluetooth adapters
+
+One HCI controller limits how many connections and how much airtime we get.
+AdapterPool scans on every adapter (hci0, hci1, ...), keeps a smoothed RSSI
+per device and adapter, assigns each device to the adapter with the best
+signal after a penalty for the connections it already carries, and proposes
+a migration when the link on the current adapter degrades.
+"""
+
+import asyncio
+import logging
+
+from bleak import BleakScanner
+
+from .airtime import get_scheduler
+
+_LOGGER = logging.getLogger(__name__)
+
+# dB of RSSI one extra connection on an adapter is worth
+LOAD_PENALTY = 6.0
+# Smoothing factor of the per adapter RSSI average
+RSSI_ALPHA = 0.3
+# Below this the link counts as degraded
+WEAK_RSSI = -85.0
+# A migration target must be this much better than the current adapter
+MIGRATE_MARGIN = 10.0
+# dB of RSSI each recent link failure of a device on an adapter costs
+FAILURE_PENALTY = 10.0
+# Link failures after which the current adapter is given up on
+MAX_FAILURES = 3
+
+
+class AdapterPool:
+    """Assigns devices to adapters by RSSI and load"""
+
+    def __init__(self, adapters, max_connections: int = 5) -> None:
+        if not adapters:
+            raise ValueError("at least one adapter is required")
+        self.adapters = list(adapters)
+        self.max_connections = max_connections
+        self._rssi: dict[tuple, float] = {}  # (address, adapter) -> smoothed RSSI
+        self._assigned: dict[str, str] = {}  # address -> adapter
+        self._failures: dict[tuple, int] = {}  # (address, adapter) -> failures since last success
+
+    def report_rssi(self, address: str, adapter: str, rssi: float) -> None:
+        """Record an advertisement RSSI of a device seen on an adapter"""
+        key = (address.upper(), adapter)
+        previous = self._rssi.get(key)
+        self._rssi[key] = rssi if previous is None else previous + RSSI_ALPHA * (rssi - previous)
+
+    def report_failure(self, address: str) -> None:
+        """Record a timeout or dropped link on the device's current adapter"""
+        address = address.upper()
+        key = (address, self._assigned.get(address))
+        self._failures[key] = self._failures.get(key, 0) + 1
+
+    def report_success(self, address: str) -> None:
+        """Record an established session on the device's current adapter"""
+        address = address.upper()
+        self._failures.pop((address, self._assigned.get(address)), None)
+
+    def rssi(self, address: str, adapter: str):
+        return self._rssi.get((address.upper(), adapter))
+
+    def load(self, adapter: str) -> int:
+        return sum(1 for assigned in self._assigned.values() if assigned == adapter)
+
+    def _score(self, address: str, adapter: str, load: int):
+        rssi = self.rssi(address, adapter)
+        if rssi is None or load >= self.max_connections:
+            return None
+        failures = self._failures.get((address.upper(), adapter), 0)
+        return rssi - LOAD_PENALTY * load - FAILURE_PENALTY * failures
+
+    def _best(self, address: str, exclude=None):
+        best, best_score = None, None
+        for adapter in self.adapters:
+            if adapter == exclude:
+                continue
+            score = self._score(address, adapter, self.load(adapter))
+            if score is not None and (best_score is None or score > best_score):
+                best, best_score = adapter, score
+        return best, best_score
+
+    def assign(self, address: str) -> str:
+        """Adapter to connect a device with, recorded until release()"""
+        address = address.upper()
+        self._assigned.pop(address, None)
+        adapter, _ = self._best(address)
+        if adapter is None:
+            # Not seen in a scan yet, least loaded and least failing adapter
+            adapter = min(
+                self.adapters,
+                key=lambda name: (self._failures.get((address, name), 0), self.load(name)),
+            )
+        self._assigned[address] = adapter
+        _LOGGER.info(f"{address} assigned to {adapter} (rssi {self.rssi(address, adapter)})")
+        return adapter
+
+    def adapter_for(self, address: str):
+        return self._assigned.get(address.upper())
+
+    def release(self, address: str) -> None:
+        self._assigned.pop(address.upper(), None)
+
+    def migration_target(self, address: str):
+        """Better adapter for a device whose link degraded, or None"""
+        address = address.upper()
+        current = self._assigned.get(address)
+        if current is None:
+            return None
+        failing = self._failures.get((address, current), 0) >= MAX_FAILURES
+        current_rssi = self.rssi(address, current)
+        if not failing and (current_rssi is None or current_rssi >= WEAK_RSSI):
+            return None
+        target, score = self._best(address, exclude=current)
+        if target is None:
+            return None
+        if failing:
+            return target
+        # Compare with the current adapter as if this device were not counted in its load
+        current_score = current_rssi - LOAD_PENALTY * (self.load(current) - 1)
+        if score < current_score + MIGRATE_MARGIN:
+            return None
+        return target
+
+    async def scan(self, timeout: float = 5.0, accept=None) -> dict:
+        """Scan on all adapters at once, returns {address: (BLEDevice, AdvertisementData)}
+
+        The entry kept for a device is from the adapter that heard it loudest.
+        Advertisers failing `accept(adv)` are dropped before any bookkeeping.
+        """
+
+        async def scan_adapter(adapter):
+            await get_scheduler(adapter).wait_scan_allowed()
+            try:
+                return adapter, await BleakScanner.discover(
+                    return_adv=True, timeout=timeout, adapter=adapter
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                _LOGGER.warning(f"scan on {adapter} failed: {err}")
+                return adapter, {}
+
+        found = {}
+        for adapter, devices in await asyncio.gather(*map(scan_adapter, self.adapters)):
+            for device, adv in devices.values():
+                if accept is not None and not accept(adv):
+                    continue
+                self.report_rssi(device.address, adapter, adv.rssi)
+                best = found.get(device.address)
+                if best is None or adv.rssi > best[1].rssi:
+                    found[device.address] = (device, adv)
+        return found
@@ -0,0 +1,182 @@
+"""Airtime scheduling for BLE operations sharing one adapter
+
+Concurrent connects, scans and GATT bursts to several devices on one HCI
+adapter collide and end in timeouts. Every BLE operation goes through the
+AirtimeScheduler of its adapter instead:
+
+- GATT reads/writes take a token from the adapter bucket and from the
+  device's own bucket, interactive operations are served before background
+  ones while waiting for tokens.
+- Connects are serialised per adapter, again interactive first.
+- Scans wait while any connect is being set up.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class PriorityTokenBucket:
+    """Token bucket whose waiters are served in priority order"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_BACKGROUND) -> None:
+        """Wait for one token"""
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancel, hand the token back
+                self._tokens += 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+        while self._waiters and self._waiters[0][2].cancelled():
+            heapq.heappop(self._waiters)
+        if self._waiters and self._timer is None:
+            delay = (1 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+class _ConnectSlot:
+    """Held while a connection is set up, release() is idempotent"""
+
+    def __init__(self, scheduler: "AirtimeScheduler") -> None:
+        self._scheduler = scheduler
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release_connect()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+class AirtimeScheduler:
+    """Rate limits and orders the BLE operations of one adapter
+
+    `adapter_rate`/`device_rate` are GATT operations per second with bursts
+    of `adapter_burst`/`device_burst`.
+    """
+
+    def __init__(
+        self,
+        adapter: str = None,
+        adapter_rate: float = 40.0,
+        adapter_burst: int = 8,
+        device_rate: float = 20.0,
+        device_burst: int = 4,
+    ) -> None:
+        self.adapter = adapter
+        self._adapter_bucket = PriorityTokenBucket(adapter_rate, adapter_burst)
+        self._device_rate = device_rate
+        self._device_burst = device_burst
+        self._device_buckets: dict[str, PriorityTokenBucket] = {}
+        self._connecting = False
+        self._connect_waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._scan_allowed = asyncio.Event()
+        self._scan_allowed.set()
+
+    def _device_bucket(self, address: str) -> PriorityTokenBucket:
+        bucket = self._device_buckets.get(address)
+        if bucket is None:
+            bucket = self._device_buckets[address] = PriorityTokenBucket(
+                self._device_rate, self._device_burst
+            )
+        return bucket
+
+    async def acquire(self, address: str, priority: int = PRIORITY_BACKGROUND) -> None:
+        """Wait until a GATT operation to `address` may go on air"""
+        await self._device_bucket(address).acquire(priority)
+        await self._adapter_bucket.acquire(priority)
+
+    async def connect_slot(self, priority: int = PRIORITY_BACKGROUND) -> _ConnectSlot:
+        """Wait for the adapter's connect slot, release it once connected and authenticated"""
+        self._scan_allowed.clear()
+        if self._connecting:
+            _LOGGER.debug(f"waiting for the connect slot of adapter {self.adapter}")
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._connect_waiters, (priority, next(self._seq), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release_connect()
+                else:
+                    self._update_scan_allowed()
+                raise
+        self._connecting = True
+        return _ConnectSlot(self)
+
+    def _release_connect(self) -> None:
+        self._connecting = False
+        while self._connect_waiters:
+            _, _, future = heapq.heappop(self._connect_waiters)
+            if not future.cancelled():
+                self._connecting = True
+                future.set_result(None)
+                break
+        self._update_scan_allowed()
+
+    def _update_scan_allowed(self) -> None:
+        if not self._connecting and not any(
+            not future.cancelled() for _, _, future in self._connect_waiters
+        ):
+            self._scan_allowed.set()
+
+    async def wait_scan_allowed(self) -> None:
+        """Wait until no connect is being set up"""
+        await self._scan_allowed.wait()
+
+
+_SCHEDULERS: dict = {}
+
+
+def get_scheduler(adapter: str = None) -> AirtimeScheduler:
+    """Shared scheduler for an adapter (None for the default adapter)"""
+    scheduler = _SCHEDULERS.get(adapter)
+    if scheduler is None:
+        scheduler = _SCHEDULERS[adapter] = AirtimeScheduler(adapter)
+    return scheduler
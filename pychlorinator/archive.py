@@ -0,0 +1,365 @@
+"""Compact archive of decrypted payloads per device and CmdType
+
+Consecutive payloads of one (device, CmdType) stream usually differ in a
+byte or two, so ArchiveWriter stores each payload XORed with the previous
+one of its stream, and frames arrive at a steady rate, so each timestamp is
+a zigzag varint of the change in millisecond interval. Records are grouped
+per stream into blocks of up to `block_records`, laid out column-wise (all
+timestamps, then byte 0 of every payload delta, then byte 1, ...) and zlib
+compressed.
+Every block starts from a zero payload and an absolute time, so it decodes
+on its own and ArchiveReader can seek straight to the blocks of a window.
+
+File layout: header (magic, version), then chunks, each starting with a
+kind byte:
+
+    S  stream declaration: stream id, CmdType, payload length, address
+    B  block: stream id, record count, first/last ms, compressed length, data
+    I  index of all streams and blocks, followed by its offset and INDEX_MAGIC
+
+The index is written on close. An archive without one (the writer was
+killed) is indexed by walking the chunk headers, and reopening it for
+writing carries on after the last complete block.
+
+    writer = ArchiveWriter("telemetry.harc")  # a halo_queue_consumer sink
+    ...
+    for address, epoch, cmd_type, payload in ArchiveReader("telemetry.harc").read(cmd_type=9, since=t0):
+        TempCharacteristic(payload)
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import struct
+import time
+import zlib
+from bisect import bisect_right
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"HARC"
+INDEX_MAGIC = b"HIDX"
+VERSION = 1
+_HEADER = struct.Struct("<4sH")
+_STREAM = struct.Struct("<cIHBB")  # kind, stream id, CmdType, payload length, address length
+_BLOCK = struct.Struct("<cIIqqI")  # kind, stream id, count, first ms, last ms, data length
+_INDEX = struct.Struct("<cII")  # kind, streams, blocks
+_INDEX_BLOCK = struct.Struct("<IQIIqq")  # stream id, data offset, data length, count, first ms, last ms
+_TRAILER = struct.Struct("<Q4s")  # index offset, magic
+_COMPRESS_LEVEL = 6
+
+
+class ArchiveError(Exception):
+    """The file is not a telemetry archive"""
+
+
+def _put_varint(out: bytearray, value: int) -> None:
+    value = (value << 1) ^ (value >> 63)  # zigzag, clock steps can go backwards
+    while value > 0x7F:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    out.append(value)
+
+
+def _encode_block(times, payloads, length: int) -> bytes:
+    out = bytearray()
+    previous, interval = times[0], 0
+    for ms in times[1:]:
+        _put_varint(out, ms - previous - interval)
+        previous, interval = ms, ms - previous
+    deltas = bytearray()
+    last = 0
+    for payload in payloads:
+        value = int.from_bytes(payload, "little")
+        deltas += (value ^ last).to_bytes(length, "little")
+        last = value
+    for column in range(length):
+        out += deltas[column::length]
+    return zlib.compress(bytes(out), _COMPRESS_LEVEL)
+
+
+def _decode_block(data: bytes, count: int, first_ms: int, length: int):
+    """(epoch, payload) of every record of a block"""
+    raw = zlib.decompress(data)
+    times = [first_ms]
+    append = times.append
+    position = 0
+    ms, interval = first_ms, 0
+    for _ in range(count - 1):
+        value = shift = 0
+        while True:
+            byte = raw[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        interval += (value >> 1) ^ -(value & 1)
+        ms += interval
+        append(ms)
+    deltas = bytearray(count * length)
+    for column in range(length):
+        deltas[column::length] = raw[position + column * count:position + (column + 1) * count]
+    records = []
+    payload = 0
+    from_bytes = int.from_bytes
+    for index, start in enumerate(range(0, count * length, length)):
+        payload ^= from_bytes(deltas[start:start + length], "little")
+        records.append((times[index] / 1000, payload.to_bytes(length, "little")))
+    return records
+
+
+class _Stream:
+    __slots__ = ("id", "address", "cmd_type", "length", "times", "payloads", "opened")
+
+    def __init__(self, stream_id: int, address: str, cmd_type: int, length: int) -> None:
+        self.id = stream_id
+        self.address = address
+        self.cmd_type = cmd_type
+        self.length = length
+        self.times = []
+        self.payloads = []
+        self.opened = 0.0
+
+
+def _read_chunks(file, size: int):
+    """Streams and blocks by walking the chunk headers, plus where the last complete chunk ends"""
+    streams, blocks = {}, []
+    offset = _HEADER.size
+    while offset < size:
+        file.seek(offset)
+        kind = file.read(1)
+        if kind == b"S":
+            head = file.read(_STREAM.size - 1)
+            if len(head) < _STREAM.size - 1:
+                break
+            _, stream_id, cmd_type, length, address_length = _STREAM.unpack(kind + head)
+            address = file.read(address_length)
+            if len(address) < address_length:
+                break
+            streams[stream_id] = (address.decode("ascii"), cmd_type, length)
+            offset += _STREAM.size + address_length
+        elif kind == b"B":
+            head = file.read(_BLOCK.size - 1)
+            if len(head) < _BLOCK.size - 1:
+                break
+            _, stream_id, count, first_ms, last_ms, data_length = _BLOCK.unpack(kind + head)
+            end = offset + _BLOCK.size + data_length
+            if end > size:
+                break
+            blocks.append((stream_id, offset + _BLOCK.size, data_length, count, first_ms, last_ms))
+            offset = end
+        else:
+            # the index, or a chunk cut short
+            break
+    return streams, blocks, offset
+
+
+def _read_index(file, size: int):
+    """Streams and blocks from the index, None if there is no valid index"""
+    if size < _HEADER.size + _TRAILER.size:
+        return None
+    file.seek(size - _TRAILER.size)
+    index_offset, magic = _TRAILER.unpack(file.read(_TRAILER.size))
+    if magic != INDEX_MAGIC or index_offset >= size:
+        return None
+    file.seek(index_offset)
+    kind, stream_count, block_count = _INDEX.unpack(file.read(_INDEX.size))
+    if kind != b"I":
+        return None
+    streams = {}
+    for _ in range(stream_count):
+        _, stream_id, cmd_type, length, address_length = _STREAM.unpack(file.read(_STREAM.size))
+        streams[stream_id] = (file.read(address_length).decode("ascii"), cmd_type, length)
+    blocks = list(_INDEX_BLOCK.iter_unpack(file.read(block_count * _INDEX_BLOCK.size)))
+    return streams, blocks, index_offset
+
+
+def _read_at(file, offset: int, length: int) -> bytes:
+    file.seek(offset)
+    return file.read(length)
+
+
+def _open_existing(file):
+    size = os.fstat(file.fileno()).st_size
+    if size < _HEADER.size:
+        raise ArchiveError(f"{file.name} is too short for a telemetry archive")
+    magic, version = _HEADER.unpack(_read_at(file, 0, _HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ArchiveError(f"{file.name} is not a version {VERSION} telemetry archive")
+    indexed = _read_index(file, size)
+    if indexed is not None:
+        return indexed
+    _LOGGER.warning(f"{file.name} has no index, scanning its blocks")
+    return _read_chunks(file, size)
+
+
+class ArchiveWriter:
+    """Consumer sink appending payloads to a telemetry archive
+
+    A stream's block is written once it holds `block_records` records or its
+    first record is `max_age` seconds old, and the file is flushed after
+    every block, so at most about `max_age` seconds of records are lost if
+    the process dies without close(). Ages are checked on every record
+    (throttled) and, inside a running event loop, by a timer so quiet or
+    disconnected devices are written out too.
+    """
+
+    def __init__(self, path: str, block_records: int = 512, max_age: float = 300.0) -> None:
+        self.block_records = block_records
+        self.max_age = max_age
+        self._streams: dict[tuple, _Stream] = {}
+        self._blocks = []
+        self._next_sweep = 0.0
+        self._timer: asyncio.TimerHandle = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._file = open(path, "r+b")
+            streams, self._blocks, end = _open_existing(self._file)
+            for stream_id, (address, cmd_type, length) in streams.items():
+                self._streams[(address, cmd_type)] = _Stream(stream_id, address, cmd_type, length)
+            # Drop the old index (or a torn chunk), new chunks go after the last complete one
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(_HEADER.pack(MAGIC, VERSION))
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        stream = self._streams.get((address, cmd_type))
+        if stream is None:
+            stream = self._streams[(address, cmd_type)] = _Stream(
+                len(self._streams), address, cmd_type, len(payload)
+            )
+            encoded = address.encode("ascii")
+            self._file.write(_STREAM.pack(b"S", stream.id, cmd_type, stream.length, len(encoded)) + encoded)
+        elif len(payload) != stream.length:
+            _LOGGER.warning(f"{address} {cmd_type} payload length changed to {len(payload)}, not archived")
+            return
+        now = time.monotonic()
+        if not stream.times:
+            stream.opened = now
+        stream.times.append(round(epoch * 1000))
+        stream.payloads.append(bytes(payload))
+        if len(stream.times) >= self.block_records:
+            self._write_block(stream)
+            self._file.flush()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        if self._timer is None:
+            self._arm_timer()
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        # Snapshot values are already archived
+        pass
+
+    def _sweep(self, now: float) -> None:
+        """Write the blocks of streams whose first pending record is max_age old"""
+        self._next_sweep = now + self.max_age / 10
+        written = False
+        for stream in self._streams.values():
+            if stream.times and now - stream.opened >= self.max_age:
+                self._write_block(stream)
+                written = True
+        if written:
+            self._file.flush()
+
+    def _arm_timer(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # driven without an event loop, records trigger the sweeps
+        self._timer = loop.call_later(self.max_age, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        if self._file.closed:
+            return
+        self._sweep(time.monotonic())
+        if any(stream.times for stream in self._streams.values()):
+            self._arm_timer()
+
+    def _write_block(self, stream: _Stream) -> None:
+        data = _encode_block(stream.times, stream.payloads, stream.length)
+        offset = self._file.tell()
+        first_ms, last_ms = stream.times[0], stream.times[-1]
+        self._file.write(_BLOCK.pack(b"B", stream.id, len(stream.times), first_ms, last_ms, len(data)) + data)
+        self._blocks.append((stream.id, offset + _BLOCK.size, len(data), len(stream.times), first_ms, last_ms))
+        stream.times, stream.payloads = [], []
+
+    def flush(self) -> None:
+        """Write the pending records of every stream as blocks"""
+        for stream in self._streams.values():
+            if stream.times:
+                self._write_block(stream)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.flush()
+        index_offset = self._file.tell()
+        index = bytearray(_INDEX.pack(b"I", len(self._streams), len(self._blocks)))
+        for stream in sorted(self._streams.values(), key=lambda stream: stream.id):
+            encoded = stream.address.encode("ascii")
+            index += _STREAM.pack(b"S", stream.id, stream.cmd_type, stream.length, len(encoded)) + encoded
+        for block in self._blocks:
+            index += _INDEX_BLOCK.pack(*block)
+        self._file.write(bytes(index) + _TRAILER.pack(index_offset, INDEX_MAGIC))
+        self._file.close()
+
+
+class ArchiveReader:
+    """Seekable reader of a telemetry archive"""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            streams, blocks, _ = _open_existing(file)
+        self._path = path
+        self._streams = streams
+        # stream id -> blocks in time order, with their first ms for bisecting
+        self._blocks: dict[int, list] = {stream_id: [] for stream_id in streams}
+        for block in sorted(blocks, key=lambda block: block[4]):
+            self._blocks[block[0]].append(block)
+        self._firsts = {stream_id: [block[4] for block in found] for stream_id, found in self._blocks.items()}
+
+    def streams(self):
+        """(address, CmdType, record count) of every stream"""
+        return [
+            (address, cmd_type, sum(block[3] for block in self._blocks[stream_id]))
+            for stream_id, (address, cmd_type, _) in self._streams.items()
+        ]
+
+    def _read_stream(self, file, stream_id: int, since_ms, until_ms):
+        address, cmd_type, length = self._streams[stream_id]
+        blocks = self._blocks[stream_id]
+        first = 0
+        if since_ms is not None:
+            # the last block starting before `since` may still hold records after it
+            first = max(0, bisect_right(self._firsts[stream_id], since_ms) - 1)
+        for _, data_offset, data_length, count, first_ms, last_ms in blocks[first:]:
+            if until_ms is not None and first_ms >= until_ms:
+                break
+            if since_ms is not None and last_ms < since_ms:
+                continue
+            for epoch, payload in _decode_block(_read_at(file, data_offset, data_length), count, first_ms, length):
+                if since_ms is not None and epoch * 1000 < since_ms:
+                    continue
+                if until_ms is not None and epoch * 1000 >= until_ms:
+                    break
+                yield epoch, address, cmd_type, payload
+
+    def read(self, address: str = None, cmd_type: int = None, since: float = None, until: float = None):
+        """Yield (address, epoch, CmdType, payload) with since <= epoch < until, in time order"""
+        since_ms = None if since is None else round(since * 1000)
+        until_ms = None if until is None else round(until * 1000)
+        selected = [
+            stream_id
+            for stream_id, (stream_address, stream_cmd_type, _) in self._streams.items()
+            if (address is None or stream_address == address) and (cmd_type is None or stream_cmd_type == cmd_type)
+        ]
+        with open(self._path, "rb") as file:
+            merged = heapq.merge(*(self._read_stream(file, stream_id, since_ms, until_ms) for stream_id in selected))
+            for epoch, record_address, record_cmd_type, payload in merged:
+                yield record_address, epoch, record_cmd_type, payload
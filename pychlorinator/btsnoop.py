@@ -0,0 +1,230 @@
+"""Streaming reader for btsnoop / btmon captures
+
+Captures can be gigabytes long, so the file is memory-mapped and walked one
+record at a time; only ACL fragments that are still being reassembled and
+the per connection GATT handle map are kept in memory.
+
+Supported datalinks are HCI un-encapsulated (1001), HCI UART/H4 (1002) and
+the Linux monitor format btmon writes (2001).
+
+    for event in iter_att_events("capture.btsnoop"):
+        epoch, address, kind, uuid, value = event
+
+kind is "notify" (notification or indication), "write" (write request or
+command), "read" (read response, matched to its request) or "connect" /
+"disconnect" (uuid None, value empty) when a connection starts or ends. uuid is the
+characteristic value's UUID when the capture contains the GATT discovery of
+the connection, else None.
+"""
+
+import logging
+import mmap
+import struct
+import uuid as uuid_module
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"btsnoop\0"
+DATALINK_HCI = 1001
+DATALINK_H4 = 1002
+DATALINK_MONITOR = 2001
+# Microseconds from btsnoop's epoch (year 0) to the Unix epoch
+EPOCH_DELTA_US = 0x00DCDDB30F2F8000
+
+_FILE_HEADER = struct.Struct(">8sII")
+_RECORD_HEADER = struct.Struct(">IIIIq")
+
+_H4_ACL = 0x02
+_H4_EVENT = 0x04
+_MONITOR_EVENT = 3
+_MONITOR_ACL_TX = 4
+_MONITOR_ACL_RX = 5
+
+_EVENT_LE_META = 0x3E
+_LE_CONNECTION_COMPLETE = (0x01, 0x0A)
+_EVENT_DISCONNECTION_COMPLETE = 0x05
+
+_CID_ATT = 0x0004
+
+ATT_FIND_INFORMATION_RSP = 0x05
+ATT_READ_BY_TYPE_REQ = 0x08
+ATT_READ_BY_TYPE_RSP = 0x09
+ATT_READ_REQ = 0x0A
+ATT_READ_RSP = 0x0B
+ATT_WRITE_REQ = 0x12
+ATT_WRITE_CMD = 0x52
+ATT_NOTIFICATION = 0x1B
+ATT_INDICATION = 0x1D
+
+_CHARACTERISTIC_DECLARATION = 0x2803
+
+
+class CaptureError(Exception):
+    """The file is not a supported btsnoop capture"""
+
+
+def _uuid(raw: bytes) -> str:
+    if len(raw) == 2:
+        return f"0000{int.from_bytes(raw, 'little'):04x}-0000-1000-8000-00805f9b34fb"
+    return str(uuid_module.UUID(bytes=bytes(reversed(raw))))
+
+
+def iter_packets(path: str, start: int = None, end: int = None):
+    """Yield (offset, epoch, adapter, received, packet type, packet bytes) for ACL data and events
+
+    packet type is "acl" or "event". Other records are skipped without
+    copying them out of the mapping. start/end limit the walk to records
+    starting in [start, end), start must be a record offset.
+    """
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        if len(view) < _FILE_HEADER.size:
+            raise CaptureError(f"{path} is too short for a btsnoop capture")
+        magic, version, datalink = _FILE_HEADER.unpack_from(view)
+        if magic != MAGIC or datalink not in (DATALINK_HCI, DATALINK_H4, DATALINK_MONITOR):
+            raise CaptureError(f"{path} is not a supported btsnoop capture ({datalink})")
+        offset = start or _FILE_HEADER.size
+        size = len(view)
+        end = size if end is None else min(end, size)
+        while offset + _RECORD_HEADER.size <= end:
+            record = offset
+            _, included, flags, _, timestamp = _RECORD_HEADER.unpack_from(view, offset)
+            start = offset + _RECORD_HEADER.size
+            offset = start + included
+            if offset > size:
+                _LOGGER.warning(f"{path} ends in a truncated record")
+                break
+            epoch = (timestamp - EPOCH_DELTA_US) / 1e6
+            if datalink == DATALINK_MONITOR:
+                opcode = flags & 0xFFFF
+                adapter = flags >> 16
+                if opcode == _MONITOR_EVENT:
+                    yield record, epoch, adapter, True, "event", view[start:offset]
+                elif opcode in (_MONITOR_ACL_TX, _MONITOR_ACL_RX):
+                    yield record, epoch, adapter, opcode == _MONITOR_ACL_RX, "acl", view[start:offset]
+            elif datalink == DATALINK_H4:
+                if included == 0:
+                    continue
+                packet_type = view[start]
+                if packet_type == _H4_ACL:
+                    yield record, epoch, 0, bool(flags & 1), "acl", view[start + 1:offset]
+                elif packet_type == _H4_EVENT:
+                    yield record, epoch, 0, True, "event", view[start + 1:offset]
+            elif flags & 2:
+                # un-encapsulated, command or event
+                if flags & 1:
+                    yield record, epoch, 0, True, "event", view[start:offset]
+            else:
+                yield record, epoch, 0, bool(flags & 1), "acl", view[start:offset]
+
+
+class _Connection:
+    def __init__(self, address: str) -> None:
+        self.address = address
+        self.fragments = {}  # received -> [expected length, bytearray]
+        self.uuids = {}  # value handle -> UUID
+        self.pending_read = None
+        self.pending_type = None
+
+
+class AttExtractor:
+    """Reassembles ACL data into ATT PDUs and turns them into characteristic events
+
+    An extractor is picklable, a copy taken at a record offset lets another
+    process continue the capture from there (see iter_att_events).
+    """
+
+    def __init__(self) -> None:
+        self._connections: dict[tuple, _Connection] = {}
+
+    def _connection(self, adapter: int, handle: int) -> _Connection:
+        connection = self._connections.get((adapter, handle))
+        if connection is None:
+            connection = self._connections[(adapter, handle)] = _Connection(f"hci{adapter}/{handle:#06x}")
+        return connection
+
+    def event(self, epoch: float, adapter: int, packet):
+        """Track connection handles and peer addresses from HCI events, returns connect / disconnect events"""
+        if len(packet) < 2:
+            return []
+        code = packet[0]
+        if code == _EVENT_LE_META and len(packet) >= 14 and packet[2] in _LE_CONNECTION_COMPLETE:
+            status, handle = packet[3], int.from_bytes(packet[4:6], "little") & 0x0FFF
+            if status == 0:
+                address = ":".join(f"{byte:02X}" for byte in reversed(bytes(packet[8:14])))
+                self._connections[(adapter, handle)] = _Connection(address)
+                return [(epoch, address, "connect", None, b"")]
+        elif code == _EVENT_DISCONNECTION_COMPLETE and len(packet) >= 5:
+            connection = self._connections.pop((adapter, int.from_bytes(packet[3:5], "little") & 0x0FFF), None)
+            if connection is not None:
+                return [(epoch, connection.address, "disconnect", None, b"")]
+        return []
+
+    def acl(self, epoch: float, adapter: int, received: bool, packet):
+        """Feed one ACL packet, returns a list of (epoch, address, kind, uuid, value)"""
+        if len(packet) < 4:
+            return []
+        header = int.from_bytes(packet[0:2], "little")
+        handle, boundary = header & 0x0FFF, (header >> 12) & 0x3
+        connection = self._connection(adapter, handle)
+        data = packet[4:4 + int.from_bytes(packet[2:4], "little")]
+        if boundary == 0b01:
+            fragment = connection.fragments.get(received)
+            if fragment is None:
+                return []
+            fragment[1] += data
+        else:
+            if len(data) < 4:
+                return []
+            fragment = connection.fragments[received] = [
+                int.from_bytes(data[0:2], "little") + 4,
+                bytearray(data),
+            ]
+        expected, buffer = fragment
+        if len(buffer) < expected:
+            return []
+        del connection.fragments[received]
+        if int.from_bytes(buffer[2:4], "little") != _CID_ATT:
+            return []
+        return self._att(epoch, connection, received, bytes(buffer[4:expected]))
+
+    def _att(self, epoch, connection: _Connection, received: bool, pdu: bytes):
+        if not pdu:
+            return []
+        opcode = pdu[0]
+        if opcode in (ATT_NOTIFICATION, ATT_INDICATION, ATT_WRITE_REQ, ATT_WRITE_CMD) and len(pdu) >= 3:
+            handle = int.from_bytes(pdu[1:3], "little")
+            kind = "notify" if opcode in (ATT_NOTIFICATION, ATT_INDICATION) else "write"
+            return [(epoch, connection.address, kind, connection.uuids.get(handle), pdu[3:])]
+        if opcode == ATT_READ_REQ and len(pdu) >= 3:
+            connection.pending_read = int.from_bytes(pdu[1:3], "little")
+        elif opcode == ATT_READ_RSP and connection.pending_read is not None:
+            handle, connection.pending_read = connection.pending_read, None
+            return [(epoch, connection.address, "read", connection.uuids.get(handle), pdu[1:])]
+        elif opcode == ATT_READ_BY_TYPE_REQ and len(pdu) >= 7:
+            connection.pending_type = int.from_bytes(pdu[5:7], "little") if len(pdu) == 7 else None
+        elif opcode == ATT_READ_BY_TYPE_RSP and len(pdu) >= 2:
+            length = pdu[1]
+            if connection.pending_type == _CHARACTERISTIC_DECLARATION and length in (7, 21):
+                for start in range(2, len(pdu) - length + 1, length):
+                    entry = pdu[start:start + length]
+                    connection.uuids[int.from_bytes(entry[3:5], "little")] = _uuid(entry[5:])
+        elif opcode == ATT_FIND_INFORMATION_RSP and len(pdu) >= 2:
+            width = 2 if pdu[1] == 1 else 16
+            for start in range(2, len(pdu) - width - 1, width + 2):
+                handle = int.from_bytes(pdu[start:start + 2], "little")
+                connection.uuids.setdefault(handle, _uuid(pdu[start + 2:start + 2 + width]))
+        return []
+
+
+def iter_att_events(path: str, start: int = None, end: int = None, extractor: AttExtractor = None):
+    """Yield (epoch, address, kind, uuid, value) for every characteristic notify, write and read,
+    and every connect and disconnect
+
+    To decode part of a capture pass the extractor state at `start`.
+    """
+    extractor = extractor or AttExtractor()
+    for _, epoch, adapter, received, packet_type, packet in iter_packets(path, start, end):
+        if packet_type == "event":
+            yield from extractor.event(epoch, adapter, packet)
+        else:
+            yield from extractor.acl(epoch, adapter, received, packet)
@@ -0,0 +1,79 @@
+"""Per-device feature model from the Halo capability frames
+
+CapabilityModel follows 105 (pH / ORP control), 301 (lighting), 1100
+(heater) and 1200 (solar) for every device. halo_queue_consumer skips
+parsing frames of features a device does not have, and halo_ble_client
+leaves out requests for them, so a basic install spends no airtime or CPU
+on a heater, solar controller or lights it lacks.
+
+Until a capability frame has been seen the feature counts as present,
+nothing is pruned on guesswork.
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+CMD_CAPABILITIES = 105
+CMD_LIGHT_CAPABILITIES = 301
+CMD_HEATER_CAPABILITIES = 1100
+CMD_SOLAR_CAPABILITIES = 1200
+
+# Feature -> CmdTypes that only carry data on units with that feature.
+# 600 holds the highest / lowest pH and ORP readings of the probes.
+FEATURE_CMD_TYPES = {
+    "chemistry": (600,),
+    "lighting": (300, 302),
+    "heater": (1101, 1102, 1104),
+    "solar": (1201, 1202),
+}
+_CMD_FEATURE = {
+    cmd_type: feature for feature, cmd_types in FEATURE_CMD_TYPES.items() for cmd_type in cmd_types
+}
+
+
+def _chemistry(capabilities) -> dict:
+    # NoneType (0) for both control types means no probes are fitted
+    return {"chemistry": bool(capabilities.PhControlType.value or capabilities.ChlorineControlType.value)}
+
+
+_FEATURES = {
+    CMD_CAPABILITIES: _chemistry,
+    CMD_LIGHT_CAPABILITIES: lambda lights: {"lighting": bool(lights.LightingEnabled)},
+    CMD_HEATER_CAPABILITIES: lambda heater: {"heater": bool(heater.HeaterEnabled)},
+    CMD_SOLAR_CAPABILITIES: lambda solar: {"solar": bool(solar.SolarEnabled)},
+}
+# CmdTypes the model learns features from
+CAPABILITY_CMD_TYPES = tuple(_FEATURES)
+
+
+class CapabilityModel:
+    """Consumer sink keeping the known features of each device"""
+
+    def __init__(self) -> None:
+        self._devices: dict[str, dict[str, bool]] = {}
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        features = _FEATURES.get(cmd_type)
+        if features is None:
+            return
+        known = self._devices.setdefault(address, {})
+        for feature, present in features(parsed).items():
+            if known.get(feature) != present:
+                _LOGGER.info(f"{address} {feature} {'present' if present else 'absent, pruned'}")
+                known[feature] = present
+
+    # Capabilities do not change between runs, snapshot values can prune right away
+    restore = __call__
+
+    def has(self, address: str, feature: str) -> bool:
+        """False only once the device said it lacks the feature"""
+        return self._devices.get(address, {}).get(feature, True)
+
+    def wants(self, address: str, cmd_type: int) -> bool:
+        """Whether frames or requests of a CmdType are worth handling for a device"""
+        feature = _CMD_FEATURE.get(cmd_type)
+        return feature is None or self.has(address, feature)
+
+    def features(self, address: str) -> dict:
+        return dict(self._devices.get(address, {}))
@@ -1,11 +1,21 @@
 """API for Astra Pool Viron eQuilibrium pool chlorinator"""
 
+import asyncio
 import logging
-from typing import Any
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Callable
 from bleak import BleakClient
 from bleak.backends.device import BLEDevice
 from Crypto.Cipher import AES
 
+from . import metrics
+from .airtime import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    AirtimeScheduler,
+    get_scheduler,
+)
 from .chlorinator_parsers import (
     ChlorinatorSettings,
     ChlorinatorStatistics,
@@ -16,6 +26,8 @@ from .chlorinator_parsers import (
     ChlorinatorActions,
     ChlorinatorAction,
 )
+from .device_clock import DeviceClock
+from .refresh import RefreshCoordinator
 
 
 UUID_ASTRALPOOL_SERVICE = "45000001-98b7-4e29-a03f-160174643001"
@@ -41,6 +53,34 @@ UUID_LIGHTING_TIMERS = "45000304-98b7-4e29-a03f-160174643001"
 
 SECRET_KEY = bytes.fromhex("2b7e151628aed2a6abf7158809cf4f3c")
 
+PARSERS = {
+    UUID_CHLORINATOR_STATE: ChlorinatorState,
+    UUID_CHLORINATOR_SETUP: ChlorinatorSetup,
+    UUID_CHLORINATOR_CAPABILITIES: ChlorinatorCapabilities,
+    UUID_CHLORINATOR_TIMERS: ChlorinatorTimers,
+    UUID_CHLORINATOR_STATISTICS: ChlorinatorStatistics,
+    UUID_CHLORINATOR_SETTINGS: ChlorinatorSettings,
+}
+
+# Actions that override each other, only the last queued one of a group is sent
+ACTION_GROUPS = {
+    ChlorinatorActions.Off: "mode",
+    ChlorinatorActions.Auto: "mode",
+    ChlorinatorActions.Manual: "mode",
+    ChlorinatorActions.Low: "speed",
+    ChlorinatorActions.Medium: "speed",
+    ChlorinatorActions.High: "speed",
+    ChlorinatorActions.Pool: "pool_spa",
+    ChlorinatorActions.Spa: "pool_spa",
+}
+
+# Characteristics that change on their own, subscribed to when the firmware allows
+NOTIFY_CANDIDATES = (
+    UUID_CHLORINATOR_STATE,
+    UUID_LIGHTING_STATE,
+    UUID_CHLORINATOR_STATISTICS,
+)
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -83,69 +123,293 @@ class ChlorinatorAPI:
         self,
         ble_device: BLEDevice,
         access_code: str,
+        max_age: float = 30.0,
+        refresh_debounce: float = 2.0,
+        scheduler: AirtimeScheduler = None,
+        clock: DeviceClock = None,
     ) -> None:
         self._ble_device = ble_device
         self._access_code = access_code
         self._session_key = None
         self._result: dict[str, Any] = None
+        # The device takes one connection at a time, sessions wait for each other
+        self._session_lock = asyncio.Lock()
+        # Session kept open by async_subscribe, shared by gathers and actions meanwhile
+        self._subscribed: BleakClient = None
+        self._scheduler = scheduler or get_scheduler()
+        # Fed with the time in every ChlorinatorState read, see device_clock
+        self.clock = clock
+        self._refresher = RefreshCoordinator(
+            self.async_gatherdata, max_age=max_age, debounce=refresh_debounce
+        )
+        # [action, futures] waiting for the next batch, see async_queue_action
+        self._pending_actions: list[list] = []
+        self._flush_task: asyncio.Task = None
+
+    async def _async_read(self, client: BleakClient, uuid: str, priority: int) -> bytearray:
+        await self._scheduler.acquire(self._ble_device.address, priority)
+        return await client.read_gatt_char(uuid)
+
+    async def _async_write(
+        self, client: BleakClient, uuid: str, data: bytes, priority: int, response: bool = None
+    ) -> None:
+        await self._scheduler.acquire(self._ble_device.address, priority)
+        with metrics.WRITE_SECONDS.time("viron"):
+            if response is None:
+                await client.write_gatt_char(uuid, data)
+            else:
+                await client.write_gatt_char(uuid, data, response=response)
+
+    @asynccontextmanager
+    async def _async_session(self, priority: int, **kwargs):
+        """Authenticated client, connected while holding the adapter's connect slot"""
+        client = BleakClient(self._ble_device, timeout=10, **kwargs)
+        async with await self._scheduler.connect_slot(priority):
+            connect_start = time.perf_counter()
+            await client.connect()
+            metrics.CONNECT_SECONDS.observe(time.perf_counter() - connect_start, "viron")
+            try:
+                await self._async_authenticate(client, priority)
+            except BaseException:
+                await client.disconnect()
+                raise
+        try:
+            yield client
+        finally:
+            await client.disconnect()
+
+    @asynccontextmanager
+    async def _async_client(self, priority: int):
+        """The open subscribe session if there is one, otherwise a new session.
+
+        Callers hold the session lock.
+        """
+        if self._subscribed is not None and self._subscribed.is_connected:
+            yield self._subscribed
+        else:
+            async with self._async_session(priority) as client:
+                yield client
+
+    async def _async_authenticate(self, client: BleakClient, priority: int) -> None:
+        """Read the session key and write the mac key for a freshly connected client"""
+        auth_start = time.perf_counter()
+        self._session_key = await self._async_read(client, UUID_SLAVE_SESSION_KEY, priority)
+        _LOGGER.info(f"got session key {self._session_key.hex()}")
+
+        mac = encrypt_mac_key(self._session_key, bytes(self._access_code, "utf_8"))
+        _LOGGER.info(f"mac key to write {mac.hex()}")
+        await self._async_write(client, UUID_MASTER_AUTHENTICATION, mac, priority)
+        metrics.AUTH_SECONDS.observe(time.perf_counter() - auth_start, "viron")
+
+    def _decode(self, uuid: str, data: bytes, primitive: bool = False) -> dict[str, Any]:
+        """Decrypt and parse one characteristic into result fields"""
+        databytes = decrypt_characteristic(bytes(data), self._session_key)
+        parser = PARSERS.get(uuid)
+        if parser is None:
+            # No parser for this characteristic (lighting), pass it through
+            return {f"raw_{uuid[4:8]}": databytes.hex()}
+        parsed = parser(databytes)
+        if parser is ChlorinatorState and self.clock is not None:
+            self.clock.observe_time(
+                self._ble_device.address, parsed.time_hours, parsed.time_minutes, parsed.time_seconds
+            )
+        return parsed.to_dict() if primitive else vars(parsed)
 
     async def async_write_action(self, action: ChlorinatorActions):
         """Connect to the Chlorinator and write an action command to it"""
-        async with BleakClient(self._ble_device, timeout=10) as client:
-            self._session_key = await client.read_gatt_char(UUID_SLAVE_SESSION_KEY)
-            _LOGGER.info(f"got session key {self._session_key.hex()}")
+        await self._async_write_actions([action])
+
+    def async_queue_action(
+        self, action: ChlorinatorActions, delay: float = 0.2
+    ) -> asyncio.Future:
+        """Queue an action to be sent with others over one session.
+
+        Actions queued within `delay` seconds of each other share a connection.
+        A queued mode, speed or pool/spa action replaces an earlier pending one
+        of the same group in its place in the batch. The returned future resolves to the action that was
+        actually written once the write is acknowledged.
+        """
+        future = asyncio.get_running_loop().create_future()
+        group = ACTION_GROUPS.get(action)
+        for entry in self._pending_actions if group is not None else ():
+            if ACTION_GROUPS.get(entry[0]) == group:
+                # Keeps its slot, so the order against other groups is what the user asked for
+                _LOGGER.debug(f"{action.name} replaces queued {entry[0].name}")
+                entry[0] = action
+                entry[1].append(future)
+                break
+        else:
+            self._pending_actions.append([action, [future]])
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._async_flush_actions(delay))
+        return future
+
+    async def _async_flush_actions(self, delay: float) -> None:
+        batch = []
+        try:
+            await asyncio.sleep(delay)
+            while self._pending_actions:
+                batch, self._pending_actions = self._pending_actions, []
+
+                def on_written(index):
+                    action, futures = batch[index]
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(action)
 
-            mac = encrypt_mac_key(self._session_key, bytes(self._access_code, "utf_8"))
-            _LOGGER.info(f"mac key to write {mac}")
-            await client.write_gatt_char(UUID_MASTER_AUTHENTICATION, mac)
+                try:
+                    await self._async_write_actions([action for action, _ in batch], on_written)
+                except Exception as err:  # pylint: disable=broad-except
+                    for _, futures in batch:
+                        for future in futures:
+                            if not future.done():
+                                future.set_exception(err)
+        except asyncio.CancelledError:
+            # Nothing will write the rest, don't leave callers waiting forever
+            for _, futures in batch + self._pending_actions:
+                for future in futures:
+                    if not future.done():
+                        future.cancel()
+            self._pending_actions = []
+            raise
 
+    async def _async_write_actions(self, actions: list, on_written=None) -> None:
+        """Write actions in order over one authenticated session"""
+        async with self._session_lock:
+            await self._async_write_actions_locked(actions, on_written)
+        self._refresher.request_refresh()
+
+    async def _async_write_actions_locked(self, actions: list, on_written) -> None:
+        async with self._async_client(PRIORITY_INTERACTIVE) as client:
             # I think we need to read all the following characteristics so that we are 'authenticated'
             # Otherwise we seem to get kicked out
-            await client.read_gatt_char(UUID_CHLORINATOR_STATE)
-            await client.read_gatt_char(UUID_CHLORINATOR_SETUP)
-            await client.read_gatt_char(UUID_CHLORINATOR_TIMERS)
-            await client.read_gatt_char(UUID_CHLORINATOR_SETTINGS)
-            await client.read_gatt_char(UUID_LIGHTING_STATE)
-            await client.read_gatt_char(UUID_LIGHTING_SETUP)
-            await client.read_gatt_char(UUID_LIGHTING_TIMERS)
-
-            data = ChlorinatorAction(action).__bytes__()
-            _LOGGER.info(f"data to write {data.hex()}")
-            data = encrypt_characteristic(data, self._session_key)
-            _LOGGER.info(f"encrypted data to write {data.hex()}")
-            await client.write_gatt_char(UUID_CHLORINATOR_APP_ACTION, data)
-
-    async def async_gatherdata(self) -> dict[str, Any]:
-        """Connect to the Chlorinator to get data."""
+            for uuid in (
+                UUID_CHLORINATOR_STATE,
+                UUID_CHLORINATOR_SETUP,
+                UUID_CHLORINATOR_TIMERS,
+                UUID_CHLORINATOR_SETTINGS,
+                UUID_LIGHTING_STATE,
+                UUID_LIGHTING_SETUP,
+                UUID_LIGHTING_TIMERS,
+            ):
+                await self._async_read(client, uuid, PRIORITY_INTERACTIVE)
+
+            for index, action in enumerate(actions):
+                data = ChlorinatorAction(action).__bytes__()
+                _LOGGER.info(f"data to write {data.hex()}")
+                data = encrypt_characteristic(data, self._session_key)
+                _LOGGER.info(f"encrypted data to write {data.hex()}")
+                # With response, so the write is acknowledged before its futures resolve
+                await self._async_write(
+                    client, UUID_CHLORINATOR_APP_ACTION, data, PRIORITY_INTERACTIVE,
+                    response=True if on_written is not None else None,
+                )
+                if on_written is not None:
+                    on_written(index)
+
+    async def async_gatherdata(self, primitive: bool = False) -> dict[str, Any]:
+        """Connect to the Chlorinator to get data.
+
+        With primitive=True enums, flags and timedeltas are returned as plain
+        values (see FastSerializable.to_dict), ready for JSON or MQTT.
+        """
         if self._ble_device is None:
             self._result = {}
             return self._result
 
-        self._result = {}
+        # Built apart from self._result, which a live subscription updates meanwhile
+        result = {}
 
-        parsers = {
-            UUID_CHLORINATOR_STATE: ChlorinatorState,
-            UUID_CHLORINATOR_SETUP: ChlorinatorSetup,
-            UUID_CHLORINATOR_CAPABILITIES: ChlorinatorCapabilities,
-            UUID_CHLORINATOR_TIMERS: ChlorinatorTimers,
-            UUID_CHLORINATOR_STATISTICS: ChlorinatorStatistics,
-            UUID_CHLORINATOR_SETTINGS: ChlorinatorSettings,
-        }
-
-        async with BleakClient(self._ble_device, timeout=10) as client:
-            self._session_key = await client.read_gatt_char(UUID_SLAVE_SESSION_KEY)
-            _LOGGER.info(f"got session key {self._session_key.hex()}")
-
-            mac = encrypt_mac_key(self._session_key, bytes(self._access_code, "utf_8"))
-            _LOGGER.info(f"mac key to write {mac.hex()}")
-            await client.write_gatt_char(UUID_MASTER_AUTHENTICATION, mac)
-
-            for uuid, parser in parsers.items():
-                databytes = decrypt_characteristic(
-                    await client.read_gatt_char(uuid), self._session_key
-                )
-                self._result.update(vars(parser(databytes)))
+        async with self._session_lock, self._async_client(PRIORITY_BACKGROUND) as client:
+            for uuid in PARSERS:
+                data = await self._async_read(client, uuid, PRIORITY_BACKGROUND)
+                result.update(self._decode(uuid, data, primitive))
+
+            _LOGGER.debug(result)
+            self._result = {**self._result, **result} if self._subscribed is not None else dict(result)
+
+        return result
+
+    async def async_get_data(self, max_age: float = None) -> dict[str, Any]:
+        """Data from async_gatherdata shared between concurrent callers.
+
+        Returns the cached result if younger than max_age (default from the
+        constructor), otherwise joins the fetch in flight or starts one.
+        Actions written through this API schedule a debounced refresh.
+        """
+        return await self._refresher.async_get(max_age)
+
+    async def async_subscribe(
+        self,
+        callback: Callable[[dict[str, Any]], None],
+        poll_interval: float = 300.0,
+        primitive: bool = False,
+    ) -> None:
+        """Keep a session open and call callback(result) whenever data changes.
+
+        State, lighting and statistics are subscribed to where the firmware
+        marks them notify/indicate, and only the pushed characteristic is
+        decoded. Everything else is re-read every poll_interval seconds.
+        Returns when the device disconnects, cancel the task to stop earlier.
+        Gathers and actions meanwhile go over this session, the device takes
+        one connection at a time.
+        """
+        disconnected = asyncio.Event()
+        async with AsyncExitStack() as stack:
+            async with self._session_lock:
+                try:
+                    client = await stack.enter_async_context(
+                        self._async_session(
+                            PRIORITY_BACKGROUND, disconnected_callback=lambda _: disconnected.set()
+                        )
+                    )
+                    polled = await self._async_start_subscription(client, callback, primitive)
+                except BaseException:
+                    # Disconnect before the next session may connect
+                    await stack.aclose()
+                    raise
+                self._subscribed = client
+            _LOGGER.info(f"polling every {poll_interval}s: {polled}")
+
+            try:
+                while not disconnected.is_set():
+                    try:
+                        await asyncio.wait_for(disconnected.wait(), poll_interval)
+                    except asyncio.TimeoutError:
+                        async with self._session_lock:
+                            for uuid in polled:
+                                data = await self._async_read(client, uuid, PRIORITY_BACKGROUND)
+                                self._result.update(self._decode(uuid, data, primitive))
+                        callback(dict(self._result))
+            finally:
+                async with self._session_lock:
+                    self._subscribed = None
+                    await stack.aclose()
+
+    async def _async_start_subscription(self, client: BleakClient, callback, primitive: bool) -> list:
+        """Read everything once and start notifications, returns the UUIDs left to poll"""
+        self._result = {}
+        for uuid in PARSERS:
+            data = await self._async_read(client, uuid, PRIORITY_BACKGROUND)
+            self._result.update(self._decode(uuid, data, primitive))
+        callback(dict(self._result))
 
-            _LOGGER.debug(self._result)
+        def notification_handler(characteristic, data):
+            self._result.update(self._decode(characteristic.uuid, data, primitive))
+            callback(dict(self._result))
 
-        return self._result
+        notifying = []
+        candidates = NOTIFY_CANDIDATES
+        if self._result.get("lighting_enabled") is False:
+            # The capabilities say there are no lights, don't spend airtime on them
+            candidates = [uuid for uuid in candidates if uuid != UUID_LIGHTING_STATE]
+        for uuid in candidates:
+            characteristic = client.services.get_characteristic(uuid)
+            if characteristic is not None and {"notify", "indicate"} & set(
+                characteristic.properties
+            ):
+                await self._scheduler.acquire(self._ble_device.address, PRIORITY_BACKGROUND)
+                await client.start_notify(uuid, notification_handler)
+                notifying.append(uuid)
+        _LOGGER.info(f"notifying: {notifying}")
+        return [uuid for uuid in PARSERS if uuid not in notifying]
@@ -4,6 +4,8 @@ import datetime
 import struct
 from enum import Enum, IntFlag, IntEnum
 
+from .serialization import FastSerializable
+
 
 class ChlorinatorActions(IntEnum):
     NoAction = 0
@@ -180,7 +182,7 @@ class TimerFlags(IntFlag):
 NUMBER_OF_PUMP_TIMERS_SUPPORTED = 4
 
 
-class PumpTimer:
+class PumpTimer(FastSerializable):
     """Represent a single pump timer"""
 
     enabled = False
@@ -203,7 +205,7 @@ class PumpTimer:
         return False
 
 
-class ChlorinatorAction:
+class ChlorinatorAction(FastSerializable):
     """Represent an action command"""
 
     # period_minutes only used for setting ChlorinatorActions:DisableAcidDosingForPeriod
@@ -221,7 +223,7 @@ class ChlorinatorAction:
         return struct.pack(fmt, self.action, self.period_minutes)
 
 
-class ChlorinatorSetup:
+class ChlorinatorSetup(FastSerializable):
     """Parser class for the Chlorinator Setup characteristic"""
 
     fmt = "@BBHB"
@@ -242,7 +244,7 @@ class ChlorinatorSetup:
         )
 
 
-class ChlorinatorState:
+class ChlorinatorState(FastSerializable):
     """Parser class for the Chlorinator State characteristic"""
 
     fmt = "@BBBBBBBBBBB"
@@ -285,7 +287,7 @@ class ChlorinatorState:
         )
 
 
-class ChlorinatorCapabilities:
+class ChlorinatorCapabilities(FastSerializable):
     """Parser class for the Chlorinator Capabilities characteristic"""
 
     fmt = "@BBBBBBBBBBBBBBB3sH"
@@ -338,7 +340,7 @@ class ChlorinatorCapabilities:
         self.filter_pump_size /= 10
 
 
-class ChlorinatorSettings:
+class ChlorinatorSettings(FastSerializable):
     """Parser class for the Chlorinator Settings characteristic"""
 
     fmt = "@HB"
@@ -354,7 +356,7 @@ class ChlorinatorSettings:
         )
 
 
-class ChlorinatorStatistics:
+class ChlorinatorStatistics(FastSerializable):
     """Parser class for the Chlorinator Statistics characteristic"""
 
     fmt = "@BBHHHIIB"
@@ -380,7 +382,7 @@ class ChlorinatorStatistics:
         )
 
 
-class ChlorinatorTimers:
+class ChlorinatorTimers(FastSerializable):
     """Parser class for the Chlorinator Timers characteristic"""
 
     fmt = "@BBBB"
@@ -0,0 +1,180 @@
+"""Clock offset and drift of each device relative to the gateway
+
+Halo time (2) and date (3) frames and the Viron ChlorinatorState time carry
+the unit's wall clock at one second resolution. DeviceClock compares every
+reading with the gateway's receive time. The highest (device - receive)
+difference seen in a minute is the reading that spent the least time in
+flight, and a line through those per minute maxima gives the offset and its
+drift. Drift is measured against time.monotonic(), so it needs no network
+time on the gateway host.
+
+The unit's clock is local time without a zone, so offsets include the UTC
+offset of the installation. Without a date (Viron) the offset is only known
+to within a day and is taken as the one closest to the host clock.
+
+    clock.to_device_time(address, epoch)  # host epoch -> device clock
+    clock.status(address)  # offset, drift_ppm, lag of the last reading
+
+Each reading's lag behind the clock model is how much longer it took to
+arrive than the fastest readings did. Lags above STALE_LAG mean the reading
+sat in a queue or was cached; lags above STEP_SECONDS mean the unit's clock
+was set, and the model starts over.
+"""
+
+import calendar
+import logging
+import time
+from collections import deque
+
+from . import metrics
+
+_LOGGER = logging.getLogger(__name__)
+
+CMD_TIME = 2
+CMD_DATE = 3
+
+BUCKET_SECONDS = 60
+MAX_BUCKETS = 360
+# Drift is not estimated from less than this much history
+MIN_DRIFT_SPAN = 600
+STALE_LAG = 5.0
+STEP_SECONDS = 120.0
+DAY = 86400
+
+
+class _Clock:
+    __slots__ = ("date", "buckets", "offset", "drift", "reference", "lag")
+
+    def __init__(self) -> None:
+        self.date = None  # (year, month, day) of the last date frame
+        self.buckets = deque(maxlen=MAX_BUCKETS)  # [bucket, monotonic, best offset]
+        self.offset = None
+        self.drift = 0.0
+        self.reference = 0.0
+        self.lag = None
+
+    def predict(self, monotonic: float) -> float:
+        return self.offset + self.drift * (monotonic - self.reference)
+
+    def add(self, monotonic: float, observed: float) -> None:
+        bucket = int(monotonic // BUCKET_SECONDS)
+        if self.buckets and self.buckets[-1][0] == bucket:
+            best = self.buckets[-1]
+            if observed <= best[2]:
+                return
+            best[1], best[2] = monotonic, observed
+        else:
+            self.buckets.append([bucket, monotonic, observed])
+        self._fit()
+
+    def _fit(self) -> None:
+        points = self.buckets
+        if len(points) < 2 or points[-1][1] - points[0][1] < MIN_DRIFT_SPAN:
+            self.offset = max(point[2] for point in points)
+            self.drift = 0.0
+            self.reference = points[-1][1]
+            return
+        mean_t = sum(point[1] for point in points) / len(points)
+        mean_o = sum(point[2] for point in points) / len(points)
+        slope = sum((point[1] - mean_t) * (point[2] - mean_o) for point in points) / sum(
+            (point[1] - mean_t) ** 2 for point in points
+        )
+        # Raise the fitted line onto the upper envelope of the readings
+        self.offset = max(point[2] - slope * (point[1] - mean_t) for point in points)
+        self.drift = slope
+        self.reference = mean_t
+
+
+def _monotonic_at(epoch: float) -> float:
+    return time.monotonic() - (time.time() - epoch)
+
+
+class DeviceClock:
+    """Consumer sink estimating each device's clock offset and drift"""
+
+    def __init__(self) -> None:
+        self._clocks: dict[str, _Clock] = {}
+
+    def _clock(self, address: str) -> _Clock:
+        clock = self._clocks.get(address)
+        if clock is None:
+            clock = self._clocks[address] = _Clock()
+        return clock
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        if cmd_type == CMD_DATE:
+            self._clock(address).date = (parsed.Year, parsed.Month, parsed.Day)
+        elif cmd_type == CMD_TIME:
+            self.observe_time(address, parsed.Hours, parsed.Minutes, parsed.Seconds, epoch)
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        # Old readings with new receive times would skew the offset
+        pass
+
+    def observe_time(self, address: str, hours: int, minutes: int, seconds: int, epoch: float = None):
+        """Feed a time of day reading, dated by the last date frame if there was one"""
+        epoch = time.time() if epoch is None else epoch
+        clock = self._clock(address)
+        if clock.offset is not None:
+            expected = epoch + clock.predict(_monotonic_at(epoch))
+        elif clock.date is not None:
+            expected = calendar.timegm(clock.date + (12, 0, 0))
+        else:
+            expected = epoch
+        # Readings are unwrapped to the day closest to the expected device time, which
+        # also covers a date frame that has not caught up with midnight yet
+        base = calendar.timegm(clock.date + (0, 0, 0)) if clock.date is not None else expected // DAY * DAY
+        device_epoch = base + hours * 3600 + minutes * 60 + seconds
+        device_epoch += round((expected - device_epoch) / DAY) * DAY
+        return self.observe(address, device_epoch, epoch)
+
+    def observe(self, address: str, device_epoch: float, epoch: float = None):
+        """Feed a device clock reading received at host `epoch`, returns its lag in seconds"""
+        epoch = time.time() if epoch is None else epoch
+        monotonic = _monotonic_at(epoch)
+        clock = self._clock(address)
+        observed = device_epoch - epoch
+        lag = 0.0
+        if clock.offset is not None:
+            lag = clock.predict(monotonic) - observed
+            if abs(lag) > STEP_SECONDS:
+                _LOGGER.info(f"{address} clock stepped by {-lag:.0f}s, estimating again")
+                clock.buckets.clear()
+                lag = 0.0
+            elif lag > STALE_LAG:
+                metrics.STALE_READINGS.inc()
+                _LOGGER.debug(f"{address} clock reading is {lag:.1f}s late, queued or stale")
+        clock.add(monotonic, observed)
+        clock.lag = lag
+        # Reading to sink, beyond the fastest delivery seen
+        metrics.DEVICE_LATENCY_SECONDS.observe(max(0.0, lag) + time.time() - epoch)
+        return lag
+
+    def offset(self, address: str, epoch: float = None):
+        """Device clock minus host clock in seconds at `epoch` (now), None before any reading"""
+        clock = self._clocks.get(address)
+        if clock is None or clock.offset is None:
+            return None
+        return clock.predict(_monotonic_at(time.time() if epoch is None else epoch))
+
+    def drift_ppm(self, address: str):
+        clock = self._clocks.get(address)
+        if clock is None or clock.offset is None:
+            return None
+        return clock.drift * 1e6
+
+    def to_device_time(self, address: str, epoch: float):
+        """Host epoch expressed on the device clock, None before any reading"""
+        offset = self.offset(address, epoch)
+        return None if offset is None else epoch + offset
+
+    def status(self, address: str) -> dict:
+        clock = self._clocks.get(address)
+        if clock is None or clock.offset is None:
+            return {}
+        return {
+            "offset": self.offset(address),
+            "drift_ppm": clock.drift * 1e6,
+            "lag": clock.lag,
+            "readings_minutes": len(clock.buckets),
+        }
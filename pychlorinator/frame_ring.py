@@ -0,0 +1,85 @@
+"""Shared memory ring buffer of raw BLE frames"""
+
+import struct
+from multiprocessing import shared_memory
+
+MAX_FRAME_SIZE = 32
+
+# write count, read count, number of slots
+_HEADER = struct.Struct("<QQI")
+# epoch, device address, frame length, frame, session key
+_SLOT = struct.Struct(f"<d40sB{MAX_FRAME_SIZE}s16s")
+
+
+class FrameRing:
+    """Single producer / single consumer ring of raw frames in shared memory
+
+    The producer (BLE I/O process) only ever writes the write count and the
+    consumer (decoder process) only ever writes the read count, so no lock is
+    needed. A full ring drops the frame instead of blocking the producer.
+    """
+
+    def __init__(self, name: str = None, slots: int = 4096) -> None:
+        if name is None:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=_HEADER.size + slots * _SLOT.size
+            )
+            _HEADER.pack_into(self._shm.buf, 0, 0, 0, slots)
+            self._owner = True
+        else:
+            # Decoder processes are children of the owner and share its
+            # resource tracker, so attaching normally is safe here.
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.slots = _HEADER.unpack_from(self._shm.buf, 0)[2]
+        self.dropped = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def __len__(self) -> int:
+        write_count, read_count, _ = _HEADER.unpack_from(self._shm.buf, 0)
+        return write_count - read_count
+
+    def put(self, epoch: float, address: str, data: bytes, session_key: bytes) -> bool:
+        """Append a frame, returns False (and counts a drop) if the ring is full"""
+        buf = self._shm.buf
+        write_count, read_count, _ = _HEADER.unpack_from(buf, 0)
+        if write_count - read_count >= self.slots:
+            self.dropped += 1
+            return False
+        offset = _HEADER.size + (write_count % self.slots) * _SLOT.size
+        _SLOT.pack_into(
+            buf,
+            offset,
+            epoch,
+            address.encode("ascii"),
+            len(data),
+            data,
+            session_key or b"",
+        )
+        # Publish the slot only once it is fully written
+        struct.pack_into("<Q", buf, 0, write_count + 1)
+        return True
+
+    def get(self):
+        """Pop the oldest frame as (epoch, address, data, session_key), or None if empty"""
+        buf = self._shm.buf
+        write_count, read_count, _ = _HEADER.unpack_from(buf, 0)
+        if write_count == read_count:
+            return None
+        offset = _HEADER.size + (read_count % self.slots) * _SLOT.size
+        epoch, address, length, data, session_key = _SLOT.unpack_from(buf, offset)
+        struct.pack_into("<Q", buf, 8, read_count + 1)
+        return (
+            epoch,
+            address.rstrip(b"\0").decode("ascii"),
+            data[:length],
+            session_key,
+        )
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,135 @@
+"""Process-sharded decoding of Halo frames
+
+The BLE I/O process only copies raw notifications into a shared memory
+FrameRing per decoder process. Each decoder process runs the usual queue
+consumer (decrypt, parse, sinks) on its own core. Devices are consistently
+hashed to decoder processes so all frames of one device stay in order.
+
+Sinks are built per decoder process: the gateway is given an importable
+factory and plain config, so it works with any multiprocessing start
+method, and no sink state is shared between processes or with the parent.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+
+from .frame_ring import FrameRing
+
+_LOGGER = logging.getLogger(__name__)
+
+_SHUTDOWN = ""
+_IDLE_SLEEP = 0.001
+_MAX_IDLE_SLEEP = 0.05
+# Frames between the ring and the consumer, a full queue leaves the backlog (and drops) to the ring
+_QUEUE_SIZE = 1024
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping & Veach), moves 1/n keys when a bucket is added"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for(address: str, workers: int) -> int:
+    """Decoder process index for a device address"""
+    return jump_hash(zlib.crc32(address.upper().encode("ascii")), workers)
+
+
+async def _pump(ring: FrameRing, consumer) -> None:
+    queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+    consumer_task = asyncio.create_task(consumer(queue))
+    idle = _IDLE_SLEEP
+    while True:
+        frame = ring.get()
+        if frame is None:
+            await asyncio.sleep(idle)
+            idle = min(idle * 2, _MAX_IDLE_SLEEP)
+            continue
+        idle = _IDLE_SLEEP
+        epoch, address, data, session_key = frame
+        if address == _SHUTDOWN:
+            await queue.put((epoch, None, None, None, None))
+            break
+        if not data:
+            # One device disconnected, others on this shard keep going
+            continue
+        await queue.put((epoch, data, session_key, address, None))
+    await consumer_task
+
+
+def _decoder_main(ring_name: str, factory, config: dict) -> None:
+    ring = FrameRing(ring_name)
+    try:
+        asyncio.run(_pump(ring, factory(**config)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+class ShardedGateway:
+    """Queue-like front end that fans frames out to decoder processes
+
+    `factory(**config)` is called in each decoder process and returns a
+    coroutine function taking an asyncio.Queue of (epoch, data, session_key,
+    address, trace) tuples, like halo_queue_consumer with its sinks bound.
+    The factory must be importable (a module level function) and config
+    picklable. Frame traces are not carried across processes, so trace is
+    always None.
+    """
+
+    def __init__(self, factory, config: dict = None, workers: int = None, slots: int = 4096) -> None:
+        self._factory = factory
+        self._config = config or {}
+        self.workers = workers or os.cpu_count() or 1
+        self._slots = slots
+        self._rings: list[FrameRing] = []
+        self._processes: list[multiprocessing.Process] = []
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            ring = FrameRing(slots=self._slots)
+            process = multiprocessing.Process(
+                target=_decoder_main,
+                args=(ring.name, self._factory, self._config),
+                name=f"halo-decoder-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._rings.append(ring)
+            self._processes.append(process)
+        _LOGGER.info(f"started {self.workers} decoder processes")
+
+    def put_nowait(self, item) -> None:
+        epoch, data, session_key, address, _ = item
+        ring = self._rings[shard_for(address, self.workers)]
+        if not ring.put(epoch, address, data or b"", session_key):
+            _LOGGER.warning(f"decoder ring full, dropped frame from {address}")
+
+    async def put(self, item) -> None:
+        self.put_nowait(item)
+
+    @property
+    def dropped(self) -> int:
+        return sum(ring.dropped for ring in self._rings)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        for ring in self._rings:
+            while not ring.put(time.time(), _SHUTDOWN, b"", b""):
+                time.sleep(_IDLE_SLEEP)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for ring in self._rings:
+            ring.close()
+        self._rings.clear()
+        self._processes.clear()
@@ -1,10 +1,13 @@
 """protocol parsers and types for halo chlorinator API"""
 
+import datetime
 import struct
 
 from enum import Enum, IntFlag, IntEnum
 
-class ScanResponse:
+from .serialization import FastSerializable
+
+class ScanResponse(FastSerializable):
     _fmt = '<BBBBBBI4sBBBBBBB'
     def __init__(self, data) -> None:
         fields = struct.unpack(self._fmt, data[: struct.calcsize(self._fmt)])
@@ -32,7 +35,7 @@ class ScanResponse:
         self.DeviceType = DeviceType(self.DeviceType)
         self.DeviceProtocol = DeviceProtocol(self.DeviceProtocol)
 
-class DeviceProfileCharacteristic2:
+class DeviceProfileCharacteristic2(FastSerializable):
     def __init__(self, data, fmt='<BBBBBBBBBI'):
         (
             self.DeviceType,
@@ -50,7 +53,7 @@ class DeviceProfileCharacteristic2:
         self.DeviceType = DeviceType(self.DeviceType)
         self.DeviceProtocol = DeviceProtocol(self.DeviceProtocol)
 
-class TempCharacteristic:
+class TempCharacteristic(FastSerializable):
     
     fmt = "<BBHHHHBHHB"
     def __init__(self, data):
@@ -103,7 +106,7 @@ class TempCharacteristic:
         SolarRoof = 16
         Heater = 32
 
-class SettingsCharacteristic2:
+class SettingsCharacteristic2(FastSerializable):
     fmt = "<HBBBBBB"
     def __init__(self, data):
         (
@@ -144,7 +147,7 @@ class SettingsCharacteristic2:
         Model_35 = 2
         Model_45 = 3
 
-class StateCharacteristic3:
+class StateCharacteristic3(FastSerializable):
     fmt = "<BBHBBHBBB2sHB"
     
     def __init__(self, data):
@@ -182,7 +185,7 @@ class StateCharacteristic3:
         AIModeActive = 128
 
 
-class WaterVolumeCharacteristic:
+class WaterVolumeCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BIHIHB'):
         (
             self.VolumeUnits,
@@ -213,7 +216,7 @@ class WaterVolumeCharacteristic:
         ImperialGallons = 2
 
 
-class SetPointCharacteristic:
+class SetPointCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BHBBB'):
         (
             self.PhControlSetpoint,
@@ -228,7 +231,7 @@ class SetPointCharacteristic:
 
         
 
-class CapabilitiesCharacteristic2:
+class CapabilitiesCharacteristic2(FastSerializable):
     def __init__(self, data, fmt='<BB'):
         (
             self.PhControlType,
@@ -268,7 +271,7 @@ class CapabilitiesCharacteristic2:
         Automatic = 2
 
 
-class EquipmentModeCharacteristic:
+class EquipmentModeCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBBBBBBBBBHH'):
         (
             self.EquipmentEnabled,
@@ -362,7 +365,7 @@ class EquipmentModeCharacteristic:
         Relay2 = 1024
 
 
-class LightStateCharacteristic:
+class LightStateCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<4s4sB'):
         (
             self.ZoneModes,
@@ -400,7 +403,7 @@ class LightStateCharacteristic:
 
 
 
-class LightCapabilitiesCharacteristic:
+class LightCapabilitiesCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<5B'):
         (
             self.LightingEnabled,
@@ -425,7 +428,7 @@ class LightCapabilitiesCharacteristic:
 
 
 
-class LightSetupCharacteristic:
+class LightSetupCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<4s'):
         (
             self.ZoneNames,
@@ -448,7 +451,7 @@ class LightSetupCharacteristic:
         Other = 7
 
 
-class MaintenanceStateCharacteristic:
+class MaintenanceStateCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BHBBIHBB'):
         (
             self.Flags,
@@ -517,7 +520,85 @@ class MaintenanceStateCharacteristic:
 
 
 
-class HeaterCapabilitiesCharacteristic:
+class TimeCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<BBB'):
+        (
+            self.Hours,
+            self.Minutes,
+            self.Seconds,
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+        if self.Hours > 23 or self.Minutes > 59 or self.Seconds > 59:
+            raise ValueError(f"invalid time {self.Hours}:{self.Minutes}:{self.Seconds}")
+
+
+class DateCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<BBH'):
+        (
+            self.Day,
+            self.Month,
+            self.Year,
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+        if self.Year < 100:
+            self.Year += 2000
+        datetime.date(self.Year, self.Month, self.Day)  # ValueError for an impossible date
+
+
+class TimerCapabilitiesCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<BB'):
+        (
+            self.NumberOfTimers,
+            self.NumberOfTimersInUse,
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+
+
+class TimerSetupCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<BBB'):
+        (
+            self.Index,
+            self.TimerEnabled,
+            self.Output,
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+
+
+class TimerStateCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<HB'):
+        (
+            self.ActiveTimers, # bit per timer slot
+            self.ConfigChangeCounter, # bumped whenever a timer is edited on the unit
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+
+
+class TimerConfigCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<BBBBBBB'):
+        (
+            self.Index,
+            self.StartHour,
+            self.StartMinute,
+            self.StopHour,
+            self.StopMinute,
+            self.Days, # bit per weekday, Sunday = 1
+            self.SpeedLevel,
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+
+
+class InfoLogCharacteristic(FastSerializable):
+    # Layout is an assumption, not confirmed against the .net code
+    def __init__(self, data, fmt='<HHIB'):
+        (
+            self.EntryIndex, # sequence number of this entry
+            self.EntryCount, # total entries written so far
+            self.Timestamp, # device seconds
+            self.InfoMessage,
+        ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
+
+
+class HeaterCapabilitiesCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBB'):
         (
             self.HeaterEnabled,
@@ -528,7 +609,7 @@ class HeaterCapabilitiesCharacteristic:
         ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
 
 
-class HeaterConfigCharacteristic:
+class HeaterConfigCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BB'):
         (
         self.HeaterPumpEnabled, 
@@ -547,7 +628,7 @@ class HeaterConfigCharacteristic:
     
 
 
-class HeaterStateCharacteristic:
+class HeaterStateCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBBBBBBHB'):
         (
             self.HeaterStatusFlag,
@@ -610,7 +691,7 @@ class HeaterStateCharacteristic:
         WasValid = 2
 
 
-class EquipmentParameterCharacteristic:
+class EquipmentParameterCharacteristic(FastSerializable):
     def __init__(self, data, fmt='BBBBBBBBBBB'):
         (
             self.FilterPumpSpeed,
@@ -645,7 +726,7 @@ class DeviceType(Enum):
     ChlorinatorEmulator = 129 # 0x00000081
 
 
-class ProbeCharacteristic:
+class ProbeCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBHH'):
         (
             self.HighestPhMeasured,
@@ -658,7 +739,7 @@ class ProbeCharacteristic:
 
 
 
-class CellCharacteristic2:
+class CellCharacteristic2(FastSerializable):
     def __init__(self, data, fmt='<HIIBHH'):
         (
             self.CellReversalCount,
@@ -671,14 +752,14 @@ class CellCharacteristic2:
         #self.CellRunningTime /= 3600 #??  TimeSpan.FromHours
         #self.LowSaltCellRunningTime /= 3600 #??
 
-class PowerBoardCharacteristic:
+class PowerBoardCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<I'):
         (
         self.PowerBoardRuntime # hrs
         ) = struct.unpack(fmt, data[: struct.calcsize(fmt)])
         #self.PowerBoardRuntime /= 3600 #??
 
-class HeaterCooldownStateCharacteristic:
+class HeaterCooldownStateCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBHH'):
         (
             self.HeaterCooldownEventOccurredFlag,
@@ -689,11 +770,11 @@ class HeaterCooldownStateCharacteristic:
             self.TotalHeaterCooldownTime,
         ) = struct.unpack(fmt, data[:struct.calcsize(fmt)])
 
-class SolarCapabilitiesCharacteristic:
+class SolarCapabilitiesCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<B'):
         self.SolarEnabled = struct.unpack(fmt, data[:struct.calcsize(fmt)])[0]
 
-class SolarConfigCharacteristic:
+class SolarConfigCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBBBBHB'):
         (
             self.SolarPumpStartHR,
@@ -708,7 +789,7 @@ class SolarConfigCharacteristic:
         ) = struct.unpack(fmt, data[:struct.calcsize(fmt)])
 
 
-class SolarStateCharacteristic:
+class SolarStateCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<HHHBBBBBHB'):
         (
             self.SolarRoofTemp,
@@ -750,7 +831,7 @@ class SolarStateCharacteristic:
         WasValid = 2
 
 
-class GPOSetupCharacteristic:
+class GPOSetupCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBBBB'):
         (
             self.DeviceType,
@@ -794,7 +875,7 @@ class GPOSetupCharacteristic:
         Blower = 7
         Jets = 8
 
-class RelaySetupCharacteristic:
+class RelaySetupCharacteristic(FastSerializable):
     def __init__(self, data, fmt='<BBBBB'):
         (
             self.Index,
@@ -810,7 +891,7 @@ class RelaySetupCharacteristic:
         Relay2 = 1
 
 
-class ValveSetupCharacteristic:
+class ValveSetupCharacteristic(FastSerializable):
 
     def __init__(self, data, fmt='<BBBB'):
         (
@@ -851,4 +932,9 @@ class GPOMode(Enum):
     Off = 0
     Auto = 1
     On = 2
-    NotEnabled = 255
\ No newline at end of file
+    NotEnabled = 255
+
+
+def read_for_catch_all(cmd_type: int, params: bytes = b"") -> bytes:
+    """Plaintext ReadForCatchAll request for a CmdType, params follow the CmdType"""
+    return (bytes([2]) + cmd_type.to_bytes(2, "little") + params).ljust(20, b"\0")
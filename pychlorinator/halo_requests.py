@@ -0,0 +1,124 @@
+"""Awaitable ReadForCatchAll requests for the Halo
+
+RequestCorrelator pairs each request with the notification that answers it:
+halo_ble_client attaches a sender per connected device, the correlator is a
+halo_queue_consumer sink, and request() resolves to the parsed
+characteristic as soon as a frame with the requested CmdType comes in.
+
+    stats = await asyncio.gather(*(correlator.request(address, cmd) for cmd in (600, 601, 602)))
+
+Concurrent requests for the same CmdType and parameters share one write and
+one response; requests for different CmdTypes are in flight together.
+"""
+
+import asyncio
+import logging
+import time
+
+from . import metrics
+from .halo_parsers import read_for_catch_all
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RequestCorrelator:
+    """Matches ReadForCatchAll requests to the notifications answering them"""
+
+    def __init__(self, timeout: float = 2.0, retries: int = 2) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self._senders = {}
+        self._waiting: dict[tuple, list] = {}  # (address, cmd_type) -> [(future, match)]
+        self._shared: dict[tuple, asyncio.Future] = {}  # (address, cmd_type, params) -> future
+
+    def attach(self, address: str, send) -> None:
+        """Register `await send(frame)` writing a plaintext request frame to a device"""
+        self._senders[address] = send
+
+    def detach(self, address: str) -> None:
+        """Forget a disconnected device, its outstanding requests fail"""
+        self._senders.pop(address, None)
+        for (waiting_address, cmd_type), entries in list(self._waiting.items()):
+            if waiting_address != address:
+                continue
+            for future, _ in entries:
+                _fail(future, ConnectionError(f"{address} disconnected"))
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        for future, match in self._waiting.get((address, cmd_type), ()):
+            if not future.done() and (match is None or match(parsed)):
+                future.set_result(parsed)
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        # Snapshot values never answer a request
+        pass
+
+    async def request(
+        self,
+        address: str,
+        cmd_type: int,
+        params: bytes = b"",
+        timeout: float = None,
+        retries: int = None,
+        match=None,
+    ):
+        """Send ReadForCatchAll(cmd_type, params) and return the parsed response
+
+        `match(parsed)` can narrow which frame counts as the answer (e.g. the
+        EntryIndex of an info log entry). Each attempt waits `timeout`
+        seconds, after `retries` resends asyncio.TimeoutError is raised.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        key = (address, cmd_type, bytes(params))
+        if match is None and key in self._shared:
+            return await asyncio.shield(self._shared[key])
+
+        send = self._senders.get(address)
+        if send is None:
+            raise ConnectionError(f"{address} is not connected")
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, match)
+        self._waiting.setdefault((address, cmd_type), []).append(entry)
+        if match is None:
+            self._shared[key] = future
+        start = time.perf_counter()
+        try:
+            frame = read_for_catch_all(cmd_type, params)
+            for attempt in range(retries + 1):
+                if attempt:
+                    metrics.REQUEST_RETRIES.inc(cmd_type)
+                    _LOGGER.debug(f"no {cmd_type} response from {address}, resending")
+                await send(frame)
+                try:
+                    parsed = await asyncio.wait_for(asyncio.shield(future), timeout)
+                except asyncio.TimeoutError:
+                    continue
+                metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, cmd_type)
+                return parsed
+            error = asyncio.TimeoutError(f"no {cmd_type} response from {address}")
+            _fail(future, error)
+            raise error
+        except Exception as err:
+            # Joined callers get the same failure, e.g. the BleakError of a dead link
+            _fail(future, err)
+            raise
+        except asyncio.CancelledError:
+            # Only this caller was cancelled, the ones that joined its request were not
+            _fail(future, ConnectionError(f"{cmd_type} request to {address} was abandoned"))
+            raise
+        finally:
+            entries = self._waiting.get((address, cmd_type))
+            if entries is not None:
+                entries.remove(entry)
+                if not entries:
+                    del self._waiting[(address, cmd_type)]
+            if self._shared.get(key) is future:
+                del self._shared[key]
+
+
+def _fail(future: asyncio.Future, error: Exception) -> None:
+    if not future.done():
+        future.set_exception(error)
+        # Joined callers see it through their own await, don't log it as unretrieved
+        future.exception()
@@ -0,0 +1,200 @@
+"""Incremental sync of the Halo info log (603) and timers (400-403)
+
+Instead of re-reading whole pages every loop, HistorySync remembers per
+device how far the info log has been stored (a high-water mark on
+EntryIndex) and which ConfigChangeCounter the stored timer slots belong to.
+Each loop it plans only the requests needed for new log entries and for
+timer slots that may have changed, so sync cost follows new data.
+
+It is both a halo_queue_consumer sink (frames in) and a request planner for
+halo_ble_client (requests out).
+
+Experimental: the indexed request parameters and the 400-403 / 603 layouts
+are assumptions, not confirmed against the .net code or captures, so
+haloconnect only enables this with --experimental-history-sync.
+"""
+
+import json
+import logging
+import os
+
+from .halo_parsers import read_for_catch_all
+
+_LOGGER = logging.getLogger(__name__)
+
+CMD_TIMER_CAPABILITIES = 400
+CMD_TIMER_SETUP = 401
+CMD_TIMER_STATE = 402
+CMD_TIMER_CONFIG = 403
+CMD_INFO_LOG = 603
+
+
+class JsonLinesStore:
+    """Appends synced records to a JSON lines file"""
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, address: str, kind: str, record: dict) -> None:
+        self._file.write(json.dumps({"address": address, "kind": kind, **record}) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _log_store(address: str, kind: str, record: dict) -> None:
+    _LOGGER.info(f"{address} {kind} {record}")
+
+
+class _DeviceCursor:
+    def __init__(self, saved: dict = None) -> None:
+        saved = saved or {}
+        self.log_high_water = saved.get("log_high_water", -1)
+        self.log_count = None
+        self.log_received = set()
+        self.timer_count = saved.get("timer_count")
+        self.timer_change_counter = saved.get("timer_change_counter")
+        self.timer_pending_counter = None
+        self.slots = {
+            int(index): {kind: bytes.fromhex(value) for kind, value in slot.items()}
+            for index, slot in saved.get("slots", {}).items()
+        }
+        # slot index -> CmdTypes still to fetch, None until a sync is planned
+        self.stale = None
+
+    def to_dict(self) -> dict:
+        return {
+            "log_high_water": self.log_high_water,
+            "timer_count": self.timer_count,
+            "timer_change_counter": self.timer_change_counter,
+            "slots": {
+                str(index): {kind: value.hex() for kind, value in slot.items()}
+                for index, slot in self.slots.items()
+            },
+        }
+
+
+class HistorySync:
+    """Per-device cursors for the info log and timer slots
+
+    `store(address, kind, record)` receives each new log entry ("info_log")
+    and each changed timer slot ("timer_setup" / "timer_config"). Cursors are
+    kept in `cursor_path` (JSON) so a restart carries on where it stopped.
+    """
+
+    def __init__(self, cursor_path: str = None, store=None, log_batch: int = 8) -> None:
+        self._cursor_path = cursor_path
+        self._store = store or _log_store
+        self._log_batch = log_batch
+        saved = {}
+        if cursor_path and os.path.exists(cursor_path):
+            with open(cursor_path, encoding="utf-8") as file:
+                saved = json.load(file)
+        self._devices = {address: _DeviceCursor(cursor) for address, cursor in saved.items()}
+
+    def _device(self, address: str) -> _DeviceCursor:
+        device = self._devices.get(address)
+        if device is None:
+            device = self._devices[address] = _DeviceCursor()
+        return device
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        if cmd_type == CMD_INFO_LOG:
+            self._on_info_log(address, self._device(address), parsed)
+        elif cmd_type == CMD_TIMER_CAPABILITIES:
+            device = self._device(address)
+            device.timer_count = parsed.NumberOfTimers
+        elif cmd_type == CMD_TIMER_STATE:
+            device = self._device(address)
+            counter = parsed.ConfigChangeCounter
+            if counter not in (device.timer_change_counter, device.timer_pending_counter):
+                # (Re)start a sync of every slot, planned by requests()
+                device.timer_pending_counter = counter
+                device.stale = None
+        elif cmd_type in (CMD_TIMER_SETUP, CMD_TIMER_CONFIG):
+            self._on_timer_slot(address, self._device(address), cmd_type, payload, parsed)
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        # Snapshot values are not new history
+        pass
+
+    def _on_info_log(self, address, device: _DeviceCursor, entry) -> None:
+        if device.log_count is not None and entry.EntryCount < device.log_count:
+            _LOGGER.info(f"{address} info log was reset, syncing from the start")
+            device.log_high_water = -1
+            device.log_received.clear()
+        device.log_count = entry.EntryCount
+        index = entry.EntryIndex
+        if index <= device.log_high_water or index in device.log_received or index >= entry.EntryCount:
+            return
+        self._store(address, "info_log", entry.to_dict())
+        device.log_received.add(index)
+        high_water = device.log_high_water
+        while device.log_high_water + 1 in device.log_received:
+            device.log_high_water += 1
+            device.log_received.discard(device.log_high_water)
+        if device.log_high_water != high_water:
+            # Stored entries are not stored again after a crash
+            self.save()
+
+    def _on_timer_slot(self, address, device: _DeviceCursor, cmd_type, payload, slot) -> None:
+        kind = "timer_setup" if cmd_type == CMD_TIMER_SETUP else "timer_config"
+        stored = device.slots.setdefault(slot.Index, {})
+        if stored.get(kind) != payload:
+            stored[kind] = payload
+            self._store(address, kind, slot.to_dict())
+        if device.stale:
+            waiting = device.stale.get(slot.Index)
+            if waiting is not None:
+                waiting.discard(cmd_type)
+                if not waiting:
+                    del device.stale[slot.Index]
+            if not device.stale:
+                self._timers_synced(device)
+
+    def _timers_synced(self, device: _DeviceCursor) -> None:
+        device.timer_change_counter = device.timer_pending_counter
+        device.timer_pending_counter = None
+        device.stale = None
+        self.save()
+
+    def requests(self, address: str) -> list[bytes]:
+        """Plaintext request frames to send this loop for one device"""
+        device = self._device(address)
+        # One probe each for the log size and the timer change counter
+        requests = [read_for_catch_all(CMD_INFO_LOG), read_for_catch_all(CMD_TIMER_STATE)]
+        if device.timer_count is None:
+            requests.append(read_for_catch_all(CMD_TIMER_CAPABILITIES))
+        elif device.timer_pending_counter is not None and device.stale is None:
+            device.stale = {
+                index: {CMD_TIMER_SETUP, CMD_TIMER_CONFIG} for index in range(device.timer_count)
+            }
+            if not device.stale:
+                self._timers_synced(device)
+        if device.log_count is not None:
+            wanted = (
+                index
+                for index in range(device.log_high_water + 1, device.log_count)
+                if index not in device.log_received
+            )
+            for _, index in zip(range(self._log_batch), wanted):
+                requests.append(read_for_catch_all(CMD_INFO_LOG, index.to_bytes(2, "little")))
+        for index, waiting in sorted((device.stale or {}).items()):
+            for cmd_type in sorted(waiting):
+                requests.append(read_for_catch_all(cmd_type, bytes([index])))
+        return requests
+
+    def save(self) -> None:
+        if not self._cursor_path:
+            return
+        cursors = {address: device.to_dict() for address, device in self._devices.items()}
+        temp_path = self._cursor_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(cursors, file)
+        os.replace(temp_path, self._cursor_path)
+
+    def close(self) -> None:
+        self.save()
+        if hasattr(self._store, "close"):
+            self._store.close()
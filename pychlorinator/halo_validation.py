@@ -0,0 +1,115 @@
+"""Cheap validation of Halo frames before they reach the parsers
+
+A frame with the wrong length, or decrypted with the wrong session key, would
+otherwise raise deep inside struct.unpack or an Enum constructor. These
+checks only look at raw bytes so bad frames are dropped before any parser
+object is built.
+"""
+
+from .halo_parsers import (
+    CapabilitiesCharacteristic2,
+    DeviceProtocol,
+    DeviceType,
+    EquipmentParameterCharacteristic,
+    GPOMode,
+    GPOSetupCharacteristic,
+    HeaterConfigCharacteristic,
+    HeaterStateCharacteristic,
+    LightSetupCharacteristic,
+    MaintenanceStateCharacteristic,
+    Mode,
+    RelaySetupCharacteristic,
+    SettingsCharacteristic2,
+    SolarStateCharacteristic,
+    ValveSetupCharacteristic,
+    WaterVolumeCharacteristic,
+)
+
+FRAME_LENGTH = 20
+PAYLOAD_OFFSET = 3
+PAYLOAD_LENGTH = 16
+# Highest CmdType we know of is 1302, anything far above it is what a frame
+# decrypted with the wrong session key looks like
+MAX_CMD_TYPE = 0x7FF
+
+
+def _values(enum) -> frozenset:
+    return frozenset(member.value for member in enum)
+
+
+# CmdType -> ((payload offset, allowed byte values), ...) for every byte the
+# parser turns into an Enum
+ENUM_BYTES = {
+    1: ((0, _values(DeviceType)), (2, _values(DeviceProtocol))),
+    100: ((2, _values(SettingsCharacteristic2.CellModelValues)),),
+    101: ((0, _values(WaterVolumeCharacteristic.VolumeUnitsValues)),),
+    105: (
+        (0, _values(CapabilitiesCharacteristic2.PhControlTypes)),
+        (1, _values(CapabilitiesCharacteristic2.ChlorineControlTypes)),
+    ),
+    106: (
+        (3, _values(MaintenanceStateCharacteristic.TaskStatesValues)),
+        (4, _values(MaintenanceStateCharacteristic.TaskReturnCodesValues)),
+        (11, _values(MaintenanceStateCharacteristic.CalibrateStatesValues)),
+        (12, _values(Mode)),
+    ),
+    201: ((1, _values(Mode)),) + tuple((i, _values(GPOMode)) for i in range(2, 12)),
+    202: ((0, _values(EquipmentParameterCharacteristic.SpeedLevels)),),
+    300: tuple((i, _values(Mode)) for i in range(4)),
+    302: tuple((i, _values(LightSetupCharacteristic.ZoneNamesValues)) for i in range(4)),
+    1101: ((1, _values(HeaterConfigCharacteristic.SpeedLevels)),),
+    1102: (
+        (1, _values(Mode)),
+        (4, _values(HeaterStateCharacteristic.HeatpumpModeValues)),
+        (5, _values(HeaterStateCharacteristic.HeaterForcedEnum)),
+        (8, _values(HeaterStateCharacteristic.TempValidEnum)),
+    ),
+    1202: (
+        (7, _values(Mode)),
+        (9, _values(SolarStateCharacteristic.TempValidEnum)),
+        (10, _values(SolarStateCharacteristic.TempValidEnum)),
+        (13, _values(SolarStateCharacteristic.SolarMessageValues)),
+    ),
+    1300: (
+        (0, _values(GPOSetupCharacteristic.GPODeviceTypeValues)),
+        (3, _values(GPOSetupCharacteristic.GPOFunctionValues)),
+        (4, _values(GPOSetupCharacteristic.GPONameValues)),
+    ),
+    1301: ((2, _values(RelaySetupCharacteristic.RelayNameValue)),),
+    1302: ((2, _values(ValveSetupCharacteristic.ValveNameValue)),),
+}
+
+
+# CmdType -> ((payload offset, lowest, highest), ...) for numeric bytes with a
+# fixed range, the time (2) and date (3) frames that feed DeviceClock
+VALUE_RANGES = {
+    2: ((0, 0, 23), (1, 0, 59), (2, 0, 59)),
+    3: ((0, 1, 31), (1, 1, 12)),
+}
+
+
+def frame_error(data: bytes):
+    """Reason a raw (encrypted) frame must be dropped, or None"""
+    if data is None or len(data) != FRAME_LENGTH:
+        return "length"
+    return None
+
+
+def header_error(cmd_type: int):
+    """Reason a decrypted frame's CmdType cannot be genuine, or None"""
+    if cmd_type > MAX_CMD_TYPE:
+        return "header"
+    return None
+
+
+def payload_error(cmd_type: int, payload: bytes):
+    """Reason a decrypted payload must be dropped before parsing, or None"""
+    if len(payload) != PAYLOAD_LENGTH:
+        return "length"
+    for offset, allowed in ENUM_BYTES.get(cmd_type, ()):
+        if payload[offset] not in allowed:
+            return "range"
+    for offset, lowest, highest in VALUE_RANGES.get(cmd_type, ()):
+        if not lowest <= payload[offset] <= highest:
+            return "range"
+    return None
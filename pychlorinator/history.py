@@ -0,0 +1,154 @@
+"""In-process ring buffer history per device and field
+
+HistoryStore is a halo_queue_consumer sink that appends every field of the
+shared state table layout (water temp, pH, ORP, heater, ...) to a fixed size
+ring of (epoch, value) doubles. Appends are O(1) and never allocate; window
+queries bisect the (monotonic) timestamps and work on array slices, so
+min/max/mean run in C.
+
+    history = HistoryStore(max_bytes_per_device=1 << 20)
+    ...
+    history.stats(address, "water_temp", since=time.time() - 3600)["mean"]
+    history.stats(address, "ph", since=midnight)  # min / max / mean / count
+"""
+
+from array import array
+from bisect import bisect_left
+
+from .state_table import EXTRACTORS, FIELDS, _value
+
+# epoch + value
+SAMPLE_BYTES = 2 * array("d").itemsize
+
+
+class _TimeView:
+    """Sequence view of a ring's timestamps in insertion order, for bisect"""
+
+    __slots__ = ("_ring",)
+
+    def __init__(self, ring: "FieldRing") -> None:
+        self._ring = ring
+
+    def __len__(self) -> int:
+        return self._ring.count
+
+    def __getitem__(self, index: int) -> float:
+        ring = self._ring
+        return ring.times[(ring.start + index) % ring.capacity]
+
+
+class FieldRing:
+    """Fixed capacity ring of (epoch, value) samples, oldest overwritten first"""
+
+    __slots__ = ("capacity", "times", "values", "start", "count")
+
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.times = array("d", bytes(capacity * 8))
+        self.values = array("d", bytes(capacity * 8))
+        self.start = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, epoch: float, value: float) -> None:
+        if self.count < self.capacity:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[index] = epoch
+        self.values[index] = value
+
+    def _slice(self, column: array, first: int, last: int) -> array:
+        """column[first:last] in insertion order, as one array"""
+        begin = (self.start + first) % self.capacity
+        end = begin + (last - first)
+        if end <= self.capacity:
+            return column[begin:end]
+        return column[begin:] + column[: end - self.capacity]
+
+    def _bounds(self, since=None, until=None, last=None):
+        first, end = 0, self.count
+        if since is not None:
+            first = bisect_left(_TimeView(self), since)
+        if until is not None:
+            end = bisect_left(_TimeView(self), until, first)
+        if last is not None:
+            first = max(first, end - last)
+        return first, end
+
+    def window(self, since: float = None, until: float = None, last: int = None):
+        """(times, values) arrays of samples with since <= epoch < until, at most the last N"""
+        first, end = self._bounds(since, until, last)
+        return self._slice(self.times, first, end), self._slice(self.values, first, end)
+
+    def stats(self, since: float = None, until: float = None, last: int = None):
+        """min, max, mean and count of the window, None when it is empty"""
+        first, end = self._bounds(since, until, last)
+        if first >= end:
+            return None
+        values = self._slice(self.values, first, end)
+        return {
+            "min": min(values),
+            "max": max(values),
+            "mean": sum(values) / len(values),
+            "count": len(values),
+        }
+
+
+class HistoryStore:
+    """Consumer sink keeping a FieldRing per device and state table field
+
+    Each device gets `max_bytes_per_device` for its rings, split evenly over
+    the state table FIELDS.
+    """
+
+    def __init__(self, max_bytes_per_device: int = 1 << 20) -> None:
+        self.capacity = max(1, max_bytes_per_device // (SAMPLE_BYTES * len(FIELDS)))
+        self._devices: dict[str, dict[str, FieldRing]] = {}
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        extract = EXTRACTORS.get(cmd_type)
+        if extract is None:
+            return
+        rings = self._devices.get(address)
+        if rings is None:
+            rings = self._devices[address] = {}
+        for field, value in extract(parsed).items():
+            ring = rings.get(field)
+            if ring is None:
+                ring = rings[field] = FieldRing(self.capacity)
+            ring.append(epoch, _value(value))
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        # Snapshot values are not new samples
+        pass
+
+    def devices(self):
+        return list(self._devices)
+
+    def fields(self, address: str):
+        return list(self._devices.get(address, ()))
+
+    def ring(self, address: str, field: str):
+        """FieldRing of a device field, None if nothing was recorded"""
+        return self._devices.get(address, {}).get(field)
+
+    def window(self, address: str, field: str, since: float = None, until: float = None, last: int = None):
+        """(times, values) arrays, empty when nothing was recorded"""
+        ring = self.ring(address, field)
+        if ring is None:
+            return array("d"), array("d")
+        return ring.window(since, until, last)
+
+    def stats(self, address: str, field: str, since: float = None, until: float = None, last: int = None):
+        """min/max/mean/count over a window, None when it is empty"""
+        ring = self.ring(address, field)
+        if ring is None:
+            return None
+        return ring.stats(since, until, last)
@@ -0,0 +1,324 @@
+"""Local HTTP state API fed by halo_queue_consumer
+
+Serves the latest parsed characteristics of every device so several local
+services can share one BLE session. Responses come from pre-serialized JSON
+that is only re-rendered when a payload actually changes.
+
+    GET /devices                        list of device addresses
+    GET /devices/<address>              snapshot of all characteristics
+    GET /devices/<address>/<CmdType>    one characteristic
+    GET /devices/<address>/events       server-sent events on every change
+    GET /devices/<address>/history/<field>?since=&until=&last=
+                                        min/max/mean/count of a field's history
+    GET /devices/<address>/clock        device clock offset, drift and lag
+    GET /metrics                        Prometheus metrics (see metrics.py)
+
+Characteristics restored from a warm-start snapshot carry "stale":true until
+a live frame for them arrives. Every JSON response carries an ETag. A request with a matching If-None-Match
+gets 304, or with ?wait=<seconds> is held open until the data changes
+(long-poll).
+"""
+
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import parse_qs, urlsplit
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_LONG_POLL = 300
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class _DeviceState:
+    def __init__(self) -> None:
+        self.version = 0
+        self.payloads = {}
+        self.stale = set()
+        self.entries = {}
+        self.snapshot = None
+        self.changed = None
+
+
+class StateCache:
+    """Consumer sink keeping pre-serialized JSON per device and CmdType"""
+
+    def __init__(self) -> None:
+        self._devices: dict[str, _DeviceState] = {}
+        self._boot = os.urandom(3).hex()
+        self._device_list = None
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed, stale=False) -> None:
+        device = self._devices.get(address)
+        if device is None:
+            device = self._devices[address] = _DeviceState()
+            self._device_list = None
+        if device.payloads.get(cmd_type) == payload and (cmd_type in device.stale) == stale:
+            return
+        device.payloads[cmd_type] = payload
+        if stale:
+            device.stale.add(cmd_type)
+        else:
+            device.stale.discard(cmd_type)
+        device.version += 1
+        device.entries[cmd_type] = (
+            self._etag(device.version),
+            b'{"name":"%s","updated":%r,"stale":%s,"data":%s}'
+            % (
+                type(parsed).__name__.encode(),
+                epoch,
+                b"true" if stale else b"false",
+                parsed.to_json_bytes(),
+            ),
+        )
+        device.snapshot = None
+        if device.changed is not None:
+            device.changed.set_result(device.version)
+            device.changed = None
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        """Last known value from a snapshot, replaced by the next live frame"""
+        if cmd_type not in self._devices.get(address, _DeviceState()).payloads:
+            self(address, epoch, cmd_type, payload, parsed, stale=True)
+
+    def _etag(self, version: int) -> str:
+        return f'"{self._boot}-{version}"'
+
+    def devices(self):
+        """(etag, body) of the device list"""
+        if self._device_list is None:
+            self._device_list = (
+                self._etag(len(self._devices)),
+                json.dumps(sorted(self._devices)).encode(),
+            )
+        return self._device_list
+
+    def device(self, address: str):
+        """(etag, body) of a device snapshot, or None for an unknown device"""
+        device = self._devices.get(address)
+        if device is None:
+            return None
+        if device.snapshot is None:
+            entries = b",".join(
+                b'"%d":%s' % (cmd_type, body)
+                for cmd_type, (_, body) in sorted(device.entries.items())
+            )
+            device.snapshot = (
+                self._etag(device.version),
+                b'{"address":%s,"characteristics":{%s}}'
+                % (json.dumps(address).encode(), entries),
+            )
+        return device.snapshot
+
+    def characteristic(self, address: str, cmd_type: int):
+        """(etag, body) of one characteristic, or None if it was never received"""
+        device = self._devices.get(address)
+        if device is None:
+            return None
+        return device.entries.get(cmd_type)
+
+    async def wait_for_change(self, address: str, timeout: float) -> bool:
+        """Wait until the device's data changes, False on timeout"""
+        device = self._devices.get(address)
+        if device is None:
+            return False
+        if device.changed is None:
+            device.changed = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(device.changed), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class HttpStateServer:
+    """Minimal HTTP/1.1 keep-alive server in front of a StateCache and/or metrics Registry"""
+
+    def __init__(
+        self,
+        cache: StateCache,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        registry=None,
+        history=None,
+        clock=None,
+    ) -> None:
+        self.cache = cache
+        self.registry = registry
+        self.history = history
+        self.clock = clock
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        _LOGGER.info(f"HTTP state API listening on http://{self.host}:{self.port}/")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, b"")
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if method != "GET":
+                    await self._respond(writer, 405, b"")
+                else:
+                    try:
+                        if not await self._route(writer, target, headers):
+                            break
+                    except (ConnectionError, asyncio.IncompleteReadError):
+                        raise
+                    except Exception:  # pylint: disable=broad-except
+                        _LOGGER.exception(f"Failed to serve {target}")
+                        await self._respond(writer, 500, b"")
+                        break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, writer, target: str, headers: dict) -> bool:
+        """Serve one request, False if the connection should be closed afterwards"""
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["metrics"] and self.registry is not None:
+            await self._respond(
+                writer, 200, self.registry.render().encode(), content_type=METRICS_CONTENT_TYPE
+            )
+            return True
+        if len(parts) == 4 and parts[0] == "devices" and parts[2] == "history" and self.history is not None:
+            await self._respond_history(writer, parts[1], parts[3], query)
+            return True
+        if len(parts) == 3 and parts[0] == "devices" and parts[2] == "clock" and self.clock is not None:
+            status = self.clock.status(parts[1])
+            if not status:
+                await self._respond(writer, 404, b"")
+            else:
+                await self._respond(writer, 200, json.dumps({"address": parts[1], **status}).encode())
+            return True
+        if self.cache is None or not parts or parts[0] != "devices" or len(parts) > 3:
+            await self._respond(writer, 404, b"")
+            return True
+        if len(parts) == 1:
+            await self._respond_cached(writer, self.cache.devices(), headers)
+            return True
+
+        address = parts[1]
+        if len(parts) == 3 and parts[2] == "events":
+            await self._stream_events(writer, address)
+            return False
+        if len(parts) == 3:
+            if not parts[2].isdigit():
+                await self._respond(writer, 404, b"")
+                return True
+            cmd_type = int(parts[2])
+            lookup = lambda: self.cache.characteristic(address, cmd_type)
+        else:
+            lookup = lambda: self.cache.device(address)
+
+        cached = lookup()
+        try:
+            wait = min(float(query.get("wait", ["0"])[0]), MAX_LONG_POLL)
+        except ValueError:
+            await self._respond(writer, 400, b"")
+            return True
+        if cached is not None and wait > 0 and headers.get("if-none-match") == cached[0]:
+            # Long-poll: hold the request until the data changes or we time out
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + wait
+            while cached[0] == headers["if-none-match"]:
+                remaining = deadline - loop.time()
+                if remaining <= 0 or not await self.cache.wait_for_change(address, remaining):
+                    break
+                cached = lookup()
+        await self._respond_cached(writer, cached, headers)
+        return True
+
+    async def _respond_history(self, writer, address: str, field: str, query: dict) -> None:
+        try:
+            window = {
+                name: convert(query[name][0])
+                for name, convert in (("since", float), ("until", float), ("last", int))
+                if name in query
+            }
+        except ValueError:
+            await self._respond(writer, 400, b"")
+            return
+        if self.history.ring(address, field) is None:
+            await self._respond(writer, 404, b"")
+            return
+        stats = self.history.stats(address, field, **window)
+        body = json.dumps({"address": address, "field": field, "stats": stats}).encode()
+        await self._respond(writer, 200, body)
+
+    async def _respond_cached(self, writer, cached, headers: dict) -> None:
+        if cached is None:
+            await self._respond(writer, 404, b"")
+            return
+        etag, body = cached
+        if headers.get("if-none-match") == etag:
+            await self._respond(writer, 304, b"", etag)
+        else:
+            await self._respond(writer, 200, body, etag)
+
+    async def _respond(
+        self, writer, status: int, body: bytes, etag: str = None, content_type: str = "application/json"
+    ) -> None:
+        head = [f"HTTP/1.1 {status} {_REASONS[status]}", f"Content-Length: {len(body)}"]
+        if body:
+            head.append(f"Content-Type: {content_type}")
+        if etag is not None:
+            head.append(f"ETag: {etag}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _stream_events(self, writer, address: str) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+        etag = None
+        while True:
+            cached = self.cache.device(address)
+            if cached is not None and cached[0] != etag:
+                etag, body = cached
+                writer.write(b"event: snapshot\nid: %s\ndata: %s\n\n" % (etag.encode(), body))
+                await writer.drain()
+            if cached is None or not await self.cache.wait_for_change(address, 15):
+                # Comment line as a keep-alive, also notices closed clients
+                writer.write(b": keep-alive\n\n")
+                await writer.drain()
+                if cached is None:
+                    await asyncio.sleep(1)
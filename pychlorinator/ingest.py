@@ -0,0 +1,129 @@
+"""Synchronous BLE notification ingest into a preallocated ring
+
+bleak runs a coroutine notification callback as a new task per frame, and
+asyncio.Queue.put() builds and links a tuple per frame on top of that.
+notification_callback() returns a plain function that copies the frame
+into the preallocated columns of a NotificationQueue without leaving the
+BLE callback. With decrypt=True the frame is decrypted right there, so the
+consumer only parses (the queued session key is None for such frames).
+
+    queue = NotificationQueue(slots=4096)
+    await client.start_notify(UUID_TX_CHARACTERISTIC, notification_callback(queue, address, session_key))
+"""
+
+import asyncio
+import time
+
+from . import metrics
+from .chlorinator import decrypt_characteristic
+from .tracing import FrameTracer
+
+_FULL_SLEEP = 0.001
+
+
+class NotificationQueue:
+    """Single consumer ring of (epoch, data, session_key, address, trace) with the asyncio.Queue calls the consumer uses
+
+    push() and put_nowait() never block, a full ring drops the newest frame.
+    """
+
+    __slots__ = ("slots", "dropped", "_epochs", "_data", "_keys", "_addresses", "_traces", "_read", "_write", "_waiter")
+
+    def __init__(self, slots: int = 4096) -> None:
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+        self.slots = slots
+        self.dropped = 0
+        self._epochs = [0.0] * slots
+        self._data = [None] * slots
+        self._keys = [None] * slots
+        self._addresses = [None] * slots
+        self._traces = [None] * slots
+        self._read = 0
+        self._write = 0
+        self._waiter = None
+
+    def qsize(self) -> int:
+        return self._write - self._read
+
+    def empty(self) -> bool:
+        return self._write == self._read
+
+    def full(self) -> bool:
+        return self._write - self._read >= self.slots
+
+    def push(self, epoch: float, data, session_key, address, trace=None) -> bool:
+        """Append a frame, returns False (and counts a drop) if the ring is full"""
+        write = self._write
+        if write - self._read >= self.slots:
+            self.dropped += 1
+            metrics.REJECTED_FRAMES.inc("queue_full")
+            return False
+        index = write % self.slots
+        self._epochs[index] = epoch
+        self._data[index] = data
+        self._keys[index] = session_key
+        self._addresses[index] = address
+        self._traces[index] = trace
+        self._write = write + 1
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+        return True
+
+    def put_nowait(self, item) -> bool:
+        return self.push(*item)
+
+    async def put(self, item) -> None:
+        """Wait for a free slot, used for control messages that must not be dropped"""
+        while self.full():
+            await asyncio.sleep(_FULL_SLEEP)
+        self.push(*item)
+
+    async def get(self):
+        while self._write == self._read:
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+        index = self._read % self.slots
+        item = (
+            self._epochs[index],
+            self._data[index],
+            self._keys[index],
+            self._addresses[index],
+            self._traces[index],
+        )
+        self._data[index] = self._traces[index] = None
+        self._read += 1
+        return item
+
+
+def notification_callback(queue, address: str, session_key: bytes, tracer=None, decrypt: bool = False):
+    """Synchronous bleak notification callback queueing frames of one connection
+
+    `queue` is anything with put_nowait() (NotificationQueue, ShardedGateway,
+    asyncio.Queue). The session key is bound when the callback is made.
+    """
+    put = queue.push if isinstance(queue, NotificationQueue) else None
+    clock = time.time
+
+    if tracer is None and not decrypt and put is not None:
+        # Hot path: one call, no tuple
+        def callback(_, data):
+            put(clock(), data, session_key, address)
+
+        return callback
+
+    def callback(_, data):
+        trace = tracer.start() if tracer is not None else None
+        key = session_key
+        if decrypt and len(data) == 20:
+            data, key = decrypt_characteristic(data, session_key), None
+        if put is not None:
+            put(clock(), data, key, address, trace)
+        else:
+            queue.put_nowait((clock(), data, key, address, trace))
+        FrameTracer.mark(trace)  # enqueue
+
+    return callback
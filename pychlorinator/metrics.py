@@ -0,0 +1,176 @@
+"""Prometheus-style metrics for the BLE and decode pipeline
+
+Metrics are plain Python objects updated from the event loop thread, so no
+locks are taken. Histograms keep per-bucket counts and only build the
+cumulative series when rendered. REGISTRY.render() returns the Prometheus
+text exposition format, served at /metrics by the HTTP state API.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic counter"""
+
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, *labelvalues) -> None:
+        self._values[labelvalues] = value
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labelvalues) -> None:
+        series = self._values.get(labelvalues)
+        if series is None:
+            # bucket counts (last one is +Inf), sum
+            series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues) -> int:
+        series = self._values.get(labelvalues)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self) -> None:
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONNECT_SECONDS = Histogram(
+    "ble_connect_seconds", "Time to establish a BLE connection", ("device_type",)
+)
+AUTH_SECONDS = Histogram(
+    "ble_auth_seconds", "Time from connection to authenticated session", ("device_type",)
+)
+WRITE_SECONDS = Histogram(
+    "ble_write_seconds", "Round trip time of GATT characteristic writes", ("device_type",)
+)
+NOTIFICATIONS = Counter(
+    "halo_notifications_total", "Decoded Halo notifications", ("cmd_type",)
+)
+UNKNOWN_CMD_TYPES = Counter(
+    "halo_unknown_cmd_type_total", "Halo notifications with a CmdType we have no handler for", ("cmd_type",)
+)
+REJECTED_FRAMES = Counter(
+    "halo_rejected_frames_total", "Halo frames dropped by validation or a failing parser", ("reason",)
+)
+SINK_ERRORS = Counter(
+    "halo_sink_errors_total", "Exceptions raised by consumer sinks", ("sink",)
+)
+PRUNED_FRAMES = Counter(
+    "halo_pruned_frames_total", "Halo frames not parsed because the device lacks the feature", ("cmd_type",)
+)
+REQUEST_SECONDS = Histogram(
+    "halo_request_seconds", "Time from a ReadForCatchAll request until its response", ("cmd_type",)
+)
+REQUEST_RETRIES = Counter(
+    "halo_request_retries_total", "ReadForCatchAll requests resent after a timeout", ("cmd_type",)
+)
+DEVICE_LATENCY_SECONDS = Histogram(
+    "device_clock_latency_seconds", "Time from a device clock reading until it reached the sinks, beyond the fastest delivery seen"
+)
+STALE_READINGS = Counter(
+    "device_clock_stale_readings_total", "Device clock readings that arrived late enough to have been queued or cached"
+)
+QUEUE_DEPTH = Gauge("halo_queue_depth", "Frames waiting in the decode queue")
+QUEUE_WAIT_SECONDS = Histogram(
+    "halo_queue_wait_seconds", "Time from BLE callback until the consumer dequeues the frame"
+)
+DECRYPT_SECONDS = Histogram("halo_decrypt_seconds", "Time to decrypt one frame")
+PARSE_SECONDS = Histogram(
+    "halo_parse_seconds", "Time to parse one frame", ("cmd_type",)
+)
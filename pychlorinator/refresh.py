@@ -0,0 +1,88 @@
+"""Single-flight refresh of device data shared by many callers
+
+Devices only allow one BLE connection, so concurrent readers must not each
+open their own session. RefreshCoordinator runs at most one fetch at a time,
+lets every caller that arrives meanwhile await that same fetch, serves
+results younger than max_age from cache and coalesces refresh requests made
+in quick succession (e.g. after several actions) into one fetch.
+"""
+
+import asyncio
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RefreshCoordinator:
+    """Shares one in-flight fetch and a cached result between callers
+
+    `fetch` is a coroutine function without arguments returning the data.
+    """
+
+    def __init__(self, fetch, max_age: float = 30.0, debounce: float = 2.0) -> None:
+        self._fetch = fetch
+        self.max_age = max_age
+        self.debounce = debounce
+        self._data = None
+        self._fetched_at = None
+        self._inflight: asyncio.Future = None
+        self._debounce_handle: asyncio.TimerHandle = None
+
+    @property
+    def age(self):
+        """Seconds since the cached data was fetched, None if never"""
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    async def async_get(self, max_age: float = None):
+        """Cached data if fresh enough, otherwise the result of a (shared) fetch"""
+        max_age = self.max_age if max_age is None else max_age
+        age = self.age
+        if age is not None and age <= max_age and self._inflight is None:
+            return self._data
+        return await self.async_refresh()
+
+    async def async_refresh(self):
+        """Fetch now, or join the fetch already in progress"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._run())
+        # shield so one cancelled caller does not cancel the fetch for the others
+        return await asyncio.shield(self._inflight)
+
+    async def _run(self):
+        try:
+            data = await self._fetch()
+            self._data = data
+            self._fetched_at = time.monotonic()
+            return data
+        finally:
+            self._inflight = None
+
+    def request_refresh(self) -> None:
+        """Schedule a refresh `debounce` seconds from the last request"""
+        if self._debounce_handle is not None:
+            self._debounce_handle.cancel()
+        self._debounce_handle = asyncio.get_running_loop().call_later(
+            self.debounce, self._debounced_refresh
+        )
+
+    def _debounced_refresh(self) -> None:
+        self._debounce_handle = None
+        task = asyncio.ensure_future(self.async_refresh())
+        task.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            _LOGGER.warning(f"debounced refresh failed: {task.exception()}")
+
+    def invalidate(self) -> None:
+        """Forget the cached data so the next async_get fetches"""
+        self._fetched_at = None
+
+    def close(self) -> None:
+        if self._debounce_handle is not None:
+            self._debounce_handle.cancel()
+            self._debounce_handle = None
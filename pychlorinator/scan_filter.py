@@ -0,0 +1,43 @@
+"""Cheap handling of the advertisements seen while scanning for a Halo
+
+In a busy RF environment most advertisers are phones, TVs and trackers.
+is_halo_advertisement() rejects them with one dict lookup for the Halo
+manufacturer ID, before names, RSSI bookkeeping or parsing. A Halo repeats
+the same manufacturer data scan after scan, so ScanResponseCache decodes
+each distinct value once.
+
+    responses = ScanResponseCache()
+    for device, adv in devices.values():
+        if is_halo_advertisement(adv):
+            response = responses.get(adv.manufacturer_data[HALO_MANUFACTURER_ID])
+"""
+
+from .halo_parsers import ScanResponse
+
+HALO_MANUFACTURER_ID = 1095
+# The last byte (TimeAlive) counts up, so each Halo has up to 256 distinct values
+CACHE_SIZE = 1024
+
+
+def is_halo_advertisement(adv) -> bool:
+    """Whether an AdvertisementData carries Halo manufacturer data"""
+    return HALO_MANUFACTURER_ID in adv.manufacturer_data
+
+
+class ScanResponseCache:
+    """Decoded ScanResponse per raw manufacturer data, oldest dropped past `size`"""
+
+    def __init__(self, size: int = CACHE_SIZE) -> None:
+        self.size = size
+        self._responses: dict[bytes, ScanResponse] = {}
+
+    def get(self, data: bytes) -> ScanResponse:
+        response = self._responses.get(data)
+        if response is None:
+            if len(self._responses) >= self.size:
+                del self._responses[next(iter(self._responses))]
+            response = self._responses[bytes(data)] = ScanResponse(data)
+        return response
+
+    def __len__(self) -> int:
+        return len(self._responses)
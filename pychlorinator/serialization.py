@@ -0,0 +1,130 @@
+"""Fast conversion of parsed characteristics to primitive values"""
+
+import datetime
+import json
+from collections import namedtuple
+from enum import Enum, IntEnum, IntFlag
+from json.encoder import encode_basestring
+from operator import attrgetter, methodcaller
+
+_PRIMITIVE = frozenset((int, float, bool, str, type(None)))
+_CONVERTERS = {}
+_PLANS = {}
+_enum_value = attrgetter("value")
+_hex = methodcaller("hex")
+_encode_json = json.JSONEncoder(separators=(",", ":")).encode
+_JSON_BOOL = ("false", "true")
+
+
+def _convert_sequence(values):
+    return [_converter(type(value))(value) for value in values]
+
+
+def _identity(value):
+    return value
+
+
+def _converter(kind):
+    """Converter from a value type to a JSON friendly primitive, built once per type"""
+    converter = _CONVERTERS.get(kind)
+    if converter is not None:
+        return converter
+    if kind in _PRIMITIVE:
+        converter = _identity
+    elif issubclass(kind, (IntFlag, IntEnum)):
+        converter = int
+    elif issubclass(kind, Enum):
+        converter = _enum_value
+    elif issubclass(kind, (bytes, bytearray)):
+        converter = _hex
+    elif issubclass(kind, datetime.timedelta):
+        converter = datetime.timedelta.total_seconds
+    elif issubclass(kind, (list, tuple)):
+        converter = _convert_sequence
+    elif issubclass(kind, FastSerializable):
+        converter = kind.to_dict
+    else:
+        converter = str
+    _CONVERTERS[kind] = converter
+    return converter
+
+
+class _Plan:
+    """Attribute layout of one parser class, compiled from its first instance"""
+
+    __slots__ = ("size", "private", "keys", "conversions", "json_template", "json_fixups", "record", "sequences")
+
+    def __init__(self, state: dict, name: str) -> None:
+        self.size = len(state)
+        self.private = [i for i, key in enumerate(state) if key[0] == "_"]
+        self.keys = []
+        self.conversions = []
+        self.json_fixups = []
+        self.sequences = []
+        parts = []
+        for index, (key, value) in enumerate(state.items()):
+            if key[0] == "_":
+                continue
+            kind = type(value)
+            if kind not in _PRIMITIVE:
+                convert = _converter(kind)
+                self.conversions.append((index, convert))
+                kind = type(convert(value))
+            position = len(self.keys)
+            if kind is list:
+                self.sequences.append(position)
+            self.keys.append(key)
+            parts.append(encode_basestring(key) + ":%s")
+            # ints and floats already print as JSON, everything else is rendered first
+            if kind is bool:
+                self.json_fixups.append((position, _JSON_BOOL.__getitem__))
+            elif kind not in (int, float):
+                self.json_fixups.append((position, _encode_json))
+        self.json_template = "{" + ",".join(parts) + "}"
+        self.record = namedtuple(name + "Record", self.keys, rename=True)
+
+
+class FastSerializable:
+    """Mixin giving parser classes primitive-valued to_dict/to_tuple/to_json_bytes
+
+    Enum members become their value, flags become ints, bytes become hex and
+    timedeltas become seconds. Private attributes are left out. The attribute
+    layout is compiled once per class, assuming each attribute keeps its type.
+    """
+
+    def _primitive_values(self):
+        state = self.__dict__
+        plan = _PLANS.get(type(self))
+        if plan is None or plan.size != len(state):
+            plan = _PLANS[type(self)] = _Plan(state, type(self).__name__)
+        values = list(state.values())
+        for index, convert in plan.conversions:
+            values[index] = convert(values[index])
+        for index in reversed(plan.private):
+            del values[index]
+        return plan, values
+
+    def to_dict(self) -> dict:
+        plan, values = self._primitive_values()
+        return dict(zip(plan.keys, values))
+
+    def to_tuple(self) -> tuple:
+        """Values in the same order as the keys of to_dict()"""
+        return tuple(self._primitive_values()[1])
+
+    def to_record(self) -> tuple:
+        """Compact immutable NamedTuple of the primitive values, for keeping history
+
+        The record type (e.g. StateCharacteristic3Record) is built once per
+        class, so samples carry no per-instance dict or key strings.
+        """
+        plan, values = self._primitive_values()
+        for index in plan.sequences:
+            values[index] = tuple(values[index])
+        return plan.record._make(values)
+
+    def to_json_bytes(self) -> bytes:
+        plan, values = self._primitive_values()
+        for index, render in plan.json_fixups:
+            values[index] = render(values[index])
+        return (plan.json_template % tuple(values)).encode()
@@ -0,0 +1,98 @@
+"""Warm-start snapshot of the last raw payload per device and CmdType
+
+SnapshotWriter is a halo_queue_consumer sink that periodically writes the
+newest payload of every characteristic to a small binary file. On startup
+read_snapshot() memory-maps that file so the consumer can decode it again
+and hand the values to sinks as stale, long before the first full round of
+live frames has arrived.
+
+File layout (little endian): header (magic, version, record count) followed
+by fixed size records (address, CmdType, epoch, 16 byte payload).
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"HSNP"
+VERSION = 1
+_HEADER = struct.Struct("<4sHI")
+_RECORD = struct.Struct("<40sHd16s")
+
+
+def write_snapshot(path: str, records) -> None:
+    """Atomically write (address, epoch, cmd_type, payload) records"""
+    records = list(records)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, len(records)))
+        file.write(
+            b"".join(
+                _RECORD.pack(address.encode("ascii"), cmd_type, epoch, bytes(payload))
+                for address, epoch, cmd_type, payload in records
+            )
+        )
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path: str) -> list:
+    """(address, epoch, cmd_type, payload) records of a snapshot, [] if missing or invalid"""
+    try:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < _HEADER.size:
+                return []
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                magic, version, count = _HEADER.unpack_from(view)
+                end = _HEADER.size + count * _RECORD.size
+                if magic != MAGIC or version != VERSION or len(view) < end:
+                    _LOGGER.warning(f"ignoring invalid snapshot {path}")
+                    return []
+                return [
+                    (address.rstrip(b"\0").decode("ascii"), epoch, cmd_type, payload)
+                    for address, cmd_type, epoch, payload in _RECORD.iter_unpack(
+                        view[_HEADER.size:end]
+                    )
+                ]
+    except FileNotFoundError:
+        return []
+
+
+class SnapshotWriter:
+    """Consumer sink keeping the last payloads and writing them every `interval` seconds"""
+
+    def __init__(self, path: str, interval: float = 30.0) -> None:
+        self._path = path
+        self._interval = interval
+        self._latest = {}  # (address, cmd_type) -> (epoch, payload)
+        self._dirty = False
+        self._written = time.monotonic()
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        self._latest[(address, cmd_type)] = (epoch, payload)
+        self._dirty = True
+        if time.monotonic() - self._written >= self._interval:
+            self.save()
+
+    def restore(self, address, epoch, cmd_type, payload, parsed) -> None:
+        # Keep restored values so devices not yet seen live stay in the snapshot
+        self._latest.setdefault((address, cmd_type), (epoch, payload))
+
+    def save(self) -> None:
+        self._written = time.monotonic()
+        if not self._dirty:
+            return
+        write_snapshot(
+            self._path,
+            (
+                (address, epoch, cmd_type, payload)
+                for (address, cmd_type), (epoch, payload) in self._latest.items()
+            ),
+        )
+        self._dirty = False
+
+    def close(self) -> None:
+        self.save()
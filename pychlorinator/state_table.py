@@ -0,0 +1,284 @@
+"""Shared memory latest-state table per Halo device
+
+The decoder keeps one small fixed-layout SharedMemory block per device with
+the latest temperatures, chemistry, equipment, heater and solar values. Writes
+are protected by a seqlock so any number of local reader processes can take
+a consistent snapshot without locks and without talking to the BLE process.
+
+Reader example:
+
+    from pychlorinator.state_table import StateTableReader, available_tables
+
+    for name in available_tables():
+        with StateTableReader(name) as table:
+            print(table.snapshot())
+"""
+
+import math
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+TABLE_PREFIX = "halo_"
+TABLE_VERSION = 1
+
+FIELDS = (
+    # TempCharacteristic (9)
+    "board_temp",
+    "water_temp",
+    "chloro_water_temp",
+    "solar_water_temp",
+    "solar_roof_temp",
+    "heater_temp",
+    # StateCharacteristic3 (104)
+    "ph",
+    "orp",
+    "cell_level",
+    "cell_current_ma",
+    "state_flags",
+    # EquipmentModeCharacteristic (201)
+    "filter_pump_mode",
+    "filter_pump_state",
+    "equipment_state_bitfield",
+    "equipment_auto_bitfield",
+    "gpo1_mode",
+    "gpo2_mode",
+    "gpo3_mode",
+    "gpo4_mode",
+    "valve1_mode",
+    "valve2_mode",
+    "valve3_mode",
+    "valve4_mode",
+    "relay1_mode",
+    "relay2_mode",
+    # HeaterStateCharacteristic (1102)
+    "heater_on",
+    "heater_mode",
+    "heater_setpoint",
+    "heater_water_temp",
+    "heat_pump_mode",
+    "heater_error",
+    # SolarStateCharacteristic (1202)
+    "solar_mode",
+    "solar_pump_state",
+    "solar_flush_active",
+    "solar_message",
+)
+
+# magic, version, field count, device address
+_HEADER = struct.Struct("<4sHH40s")
+# sequence, last update epoch
+_SEQ = struct.Struct("<Q")
+_RECORD = struct.Struct(f"<d{len(FIELDS)}d")
+_SEQ_OFFSET = _HEADER.size
+_RECORD_OFFSET = _SEQ_OFFSET + _SEQ.size
+_TABLE_SIZE = _RECORD_OFFSET + _RECORD.size
+_MAGIC = b"HALO"
+_INDEX = {name: i for i, name in enumerate(FIELDS)}
+
+
+def _value(value) -> float:
+    return float(getattr(value, "value", value))
+
+
+def _temp_fields(temp):
+    return {
+        "board_temp": temp.BoardTemp,
+        "water_temp": temp.WaterTemp,
+        "chloro_water_temp": temp.ChloroWater,
+        "solar_water_temp": temp.SolarWater,
+        "solar_roof_temp": temp.SolarRoof,
+        "heater_temp": temp.Heater,
+    }
+
+
+def _state_fields(state):
+    return {
+        "ph": state.PHMeasurement,
+        "orp": state.ORPMeasurement,
+        "cell_level": state.RealCelllevel,
+        "cell_current_ma": state.CellCurrentmA,
+        "state_flags": state.Flags,
+    }
+
+
+def _equipment_fields(equipment):
+    return {
+        "filter_pump_mode": equipment.FilterPumpMode,
+        "filter_pump_state": equipment.FilterPumpState,
+        "equipment_state_bitfield": equipment.StateBitfield,
+        "equipment_auto_bitfield": equipment.AutoEnabledBitfield,
+        "gpo1_mode": equipment.GPO1_Mode,
+        "gpo2_mode": equipment.GPO2_Mode,
+        "gpo3_mode": equipment.GPO3_Mode,
+        "gpo4_mode": equipment.GPO4_Mode,
+        "valve1_mode": equipment.Valve1_Mode,
+        "valve2_mode": equipment.Valve2_Mode,
+        "valve3_mode": equipment.Valve3_Mode,
+        "valve4_mode": equipment.Valve4_Mode,
+        "relay1_mode": equipment.Relay1_Mode,
+        "relay2_mode": equipment.Relay2_Mode,
+    }
+
+
+def _heater_fields(heater):
+    return {
+        "heater_on": heater.HeaterOn,
+        "heater_mode": heater.HeaterMode,
+        "heater_setpoint": heater.HeaterSetpoint,
+        "heater_water_temp": heater.HeaterWaterTemp,
+        "heat_pump_mode": heater.HeatPumpMode,
+        "heater_error": heater.HeaterError,
+    }
+
+
+def _solar_fields(solar):
+    return {
+        "solar_mode": solar.SolarMode,
+        "solar_pump_state": solar.SolarPumpState,
+        "solar_flush_active": solar.SolarFlushActive,
+        "solar_message": solar.SolarMessage,
+    }
+
+
+EXTRACTORS = {
+    9: _temp_fields,
+    104: _state_fields,
+    201: _equipment_fields,
+    1102: _heater_fields,
+    1202: _solar_fields,
+}
+
+
+def table_name(address: str) -> str:
+    """SharedMemory name of a device table (kept short for macOS's 31 char limit)"""
+    cleaned = "".join(c for c in address if c.isalnum()).lower()
+    return TABLE_PREFIX + cleaned[-12:]
+
+
+def available_tables() -> list[str]:
+    """Names of the device tables currently published on this host (Linux only)"""
+    try:
+        return sorted(n for n in os.listdir("/dev/shm") if n.startswith(TABLE_PREFIX))
+    except FileNotFoundError:
+        return []
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing SharedMemory block without taking ownership of it"""
+    shm = shared_memory.SharedMemory(name=name)
+    if sys.version_info < (3, 13):
+        # Python < 3.13 registers attached blocks with this process's resource
+        # tracker, which would unlink them under the writer when we exit.
+        resource_tracker.unregister(shm._name, "shared_memory")  # pylint: disable=protected-access
+    return shm
+
+
+class DeviceStateTable:
+    """Writer side of one device's latest-state table"""
+
+    def __init__(self, address: str) -> None:
+        name = table_name(address)
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=_TABLE_SIZE)
+        except FileExistsError:
+            # Left behind by a previous run that did not shut down cleanly
+            self._shm = shared_memory.SharedMemory(name)
+        _HEADER.pack_into(
+            self._shm.buf, 0, _MAGIC, TABLE_VERSION, len(FIELDS), address.encode("ascii")
+        )
+        self._seq = _SEQ.unpack_from(self._shm.buf, _SEQ_OFFSET)[0] & ~1
+        self._values = [math.nan] * len(FIELDS)
+        self._write(0.0)
+
+    def _write(self, epoch: float) -> None:
+        buf = self._shm.buf
+        self._seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self._seq)
+        _RECORD.pack_into(buf, _RECORD_OFFSET, epoch, *self._values)
+        self._seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self._seq)
+
+    def update(self, cmd_type: int, parsed, epoch: float = None) -> bool:
+        """Publish the table fields carried by a parsed characteristic"""
+        extractor = EXTRACTORS.get(cmd_type)
+        if extractor is None:
+            return False
+        for name, value in extractor(parsed).items():
+            self._values[_INDEX[name]] = _value(value)
+        self._write(time.time() if epoch is None else epoch)
+        return True
+
+    def close(self) -> None:
+        self._shm.close()
+        self._shm.unlink()
+
+
+class StateTableWriter:
+    """halo_queue_consumer sink that publishes each device's latest state
+
+    Tables are created lazily on the first frame, so an instance can be handed
+    to decoder processes before it is used.
+    """
+
+    def __init__(self) -> None:
+        self._tables: dict[str, DeviceStateTable] = {}
+
+    def __call__(self, address, epoch, cmd_type, payload, parsed) -> None:
+        if cmd_type not in EXTRACTORS:
+            return
+        table = self._tables.get(address)
+        if table is None:
+            table = self._tables[address] = DeviceStateTable(address)
+        table.update(cmd_type, parsed, epoch)
+
+    def close(self) -> None:
+        for table in self._tables.values():
+            table.close()
+        self._tables.clear()
+
+
+class StateTableReader:
+    """Read-only view of a device table, by device address or table name"""
+
+    def __init__(self, address_or_name: str, retries: int = 1000) -> None:
+        name = address_or_name
+        if not name.startswith(TABLE_PREFIX):
+            name = table_name(address_or_name)
+        self._shm = attach_shared_memory(name)
+        self._retries = retries
+        magic, version, field_count, address = _HEADER.unpack_from(self._shm.buf, 0)
+        if magic != _MAGIC or version != TABLE_VERSION or field_count != len(FIELDS):
+            self._shm.close()
+            raise ValueError(f"{name} is not a version {TABLE_VERSION} Halo state table")
+        self.address = address.rstrip(b"\0").decode("ascii")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def read(self) -> tuple:
+        """Consistent (epoch, values) pair, unknown values are NaN"""
+        buf = self._shm.buf
+        for _ in range(self._retries):
+            seq = _SEQ.unpack_from(buf, _SEQ_OFFSET)[0]
+            if seq & 1:
+                continue
+            record = _RECORD.unpack_from(buf, _RECORD_OFFSET)
+            if _SEQ.unpack_from(buf, _SEQ_OFFSET)[0] == seq:
+                return record[0], record[1:]
+        raise TimeoutError(f"no consistent snapshot of {self._shm.name}")
+
+    def snapshot(self) -> dict:
+        """Latest values keyed by field name, plus address and updated epoch"""
+        epoch, values = self.read()
+        result = {"address": self.address, "updated": epoch}
+        result.update(zip(FIELDS, values))
+        return result
+
+    def close(self) -> None:
+        self._shm.close()
@@ -0,0 +1,234 @@
+"""Synthetic Halo frames and Viron characteristic payloads for load testing
+
+FrameGenerator builds encrypted frames that pass validation and parse, for
+every CmdType halo_queue_consumer handles. Bytes the parsers turn into an
+Enum get one of its values (see halo_validation.ENUM_BYTES), the
+measurements the state table follows (temperatures, ORP, pH, cell current,
+statistics) are drawn from plausible ranges and everything else is random.
+
+    generator = FrameGenerator(session_key, mix={9: 5, 104: 5, 600: 1}, seed=1)
+    cmd_type, frame = generator.frame()
+    uuid, value = generator.viron()
+"""
+
+import os
+import random
+import struct
+
+from .chlorinator import PARSERS, encrypt_characteristic
+from .chlorinator_parsers import (
+    NUMBER_OF_PUMP_TIMERS_SUPPORTED,
+    AcidDosingInhibitStatuses,
+    ChlorinatorCapabilities,
+    ChlorinatorSettings,
+    ChlorinatorSetup,
+    ChlorinatorState,
+    ChlorinatorStatistics,
+    ChlorinatorTimers,
+    ChlorineControlStatuses,
+    ChlorineControlTypes,
+    InfoMessages,
+    Modes,
+    PhControlTypes,
+    SpeedLevels,
+)
+from .halo_validation import ENUM_BYTES, FRAME_LENGTH, PAYLOAD_LENGTH
+
+# Every CmdType halo_queue_consumer has a handler for
+CMD_TYPES = (
+    1, 2, 3, 5, 6, 9,
+    100, 101, 102, 104, 105, 106, 107,
+    201, 202,
+    300, 301, 302,
+    400, 401, 402, 403,
+    600, 601, 602, 603,
+    1100, 1101, 1102, 1104,
+    1200, 1201, 1202,
+    1300, 1301, 1302,
+)
+
+# Frames a connected Halo sends over and over, for load mixes
+TELEMETRY_MIX = {9: 10, 104: 10, 300: 2, 402: 2, 1102: 5, 1202: 5, 600: 1, 601: 1, 602: 1}
+
+_NOTIFICATION = 0x01
+
+
+def _byte_values(enum) -> list:
+    return [member.value for member in enum if 0 <= member.value <= 0xFF]
+
+
+_VIRON_ENUMS = {
+    enum: _byte_values(enum)
+    for enum in (
+        AcidDosingInhibitStatuses,
+        ChlorineControlStatuses,
+        ChlorineControlTypes,
+        InfoMessages,
+        Modes,
+        PhControlTypes,
+        SpeedLevels,
+    )
+}
+_ENUM_CHOICES = {
+    cmd_type: tuple((offset, sorted(v for v in allowed if 0 <= v <= 0xFF)) for offset, allowed in enum_bytes)
+    for cmd_type, enum_bytes in ENUM_BYTES.items()
+}
+_SPEEDS = [value for value in _VIRON_ENUMS[SpeedLevels] if value <= 3]
+
+
+def _temp(rng) -> int:
+    return rng.randint(80, 380)  # tenths of a degree
+
+
+def _halo_temp(rng) -> bytes:
+    return struct.pack(
+        "<BBHHHHBHHB", 0, 63, rng.randint(200, 600), _temp(rng), _temp(rng), _temp(rng), 1, _temp(rng), _temp(rng), 2
+    )
+
+
+def _halo_state(rng) -> bytes:
+    return struct.pack(
+        "<BBHBBHBBB2sHB",
+        rng.randrange(256), rng.randint(0, 100), rng.randint(0, 8000), rng.randrange(8), rng.randrange(8),
+        rng.randint(550, 850), rng.randrange(8), rng.randint(68, 82), 0, b"\0\0", 0, 0,
+    )
+
+
+def _halo_probe(rng) -> bytes:
+    low_ph = rng.randint(68, 76)
+    low_orp = rng.randint(550, 700)
+    return struct.pack("<BBHH", low_ph + rng.randint(0, 6), low_ph, low_orp + rng.randint(0, 150), low_orp)
+
+
+def _halo_cell(rng) -> bytes:
+    hours = rng.randint(0, 20000)
+    return struct.pack(
+        "<HIIBHH", rng.randint(0, 5000), hours, rng.randint(0, hours), rng.randint(0, 100),
+        rng.randint(0, 3000), rng.randint(0, 1440),
+    )
+
+
+def _halo_heater(rng) -> bytes:
+    return struct.pack(
+        "<BBBBBBBBBHB", rng.randrange(4), 0, 0, rng.randint(18, 40), 0, 0, rng.randrange(24), rng.randrange(60),
+        1, _temp(rng), 0,
+    )
+
+
+def _halo_solar(rng) -> bytes:
+    return struct.pack(
+        "<HHHBBBBBHB", _temp(rng) + 100, _temp(rng), _temp(rng), rng.randrange(2), 0, rng.randrange(4), 1, 1,
+        _temp(rng), 0,
+    )
+
+
+_HALO_PAYLOADS = {
+    2: lambda rng: struct.pack("<BBB", rng.randrange(24), rng.randrange(60), rng.randrange(60)),
+    3: lambda rng: struct.pack("<BBH", rng.randint(1, 28), rng.randint(1, 12), rng.randint(2020, 2030)),
+    9: _halo_temp,
+    104: _halo_state,
+    600: _halo_probe,
+    601: _halo_cell,
+    602: lambda rng: struct.pack("<I", rng.randint(0, 50000)),
+    1102: _halo_heater,
+    1202: _halo_solar,
+}
+
+
+def _viron_state(rng) -> bytes:
+    return struct.pack(
+        "@BBBBBBBBBBB",
+        rng.choice(_VIRON_ENUMS[Modes]), rng.choice(_VIRON_ENUMS[SpeedLevels]), rng.randrange(5),
+        rng.choice(_VIRON_ENUMS[InfoMessages]), 0, rng.randrange(256), rng.randint(68, 82),
+        rng.choice(_VIRON_ENUMS[ChlorineControlStatuses]), rng.randrange(24), rng.randrange(60), rng.randrange(60),
+    )
+
+
+def _viron_setup(rng) -> bytes:
+    return struct.pack(
+        "@BBHB", rng.choice(_VIRON_ENUMS[SpeedLevels]), rng.randint(70, 78), rng.randint(600, 800), rng.randrange(4)
+    )
+
+
+def _viron_capabilities(rng) -> bytes:
+    return struct.pack(
+        "@BBBBBBBBBBBBBBB3sH",
+        1, 10, 1, 10, 70, 78, 60, 80,
+        rng.choice(_VIRON_ENUMS[PhControlTypes]), rng.choice(_VIRON_ENUMS[ChlorineControlTypes]),
+        rng.randrange(64), rng.randint(1, 5), rng.randint(1, 5), rng.randint(5, 15), rng.randint(2, 8),
+        rng.randint(10, 120).to_bytes(3, "little"), rng.randint(0, 5000),
+    )
+
+
+def _viron_timers(rng) -> bytes:
+    timers = b""
+    for _ in range(NUMBER_OF_PUMP_TIMERS_SUPPORTED):
+        start = rng.randrange(24) | (0x20 if rng.random() < 0.5 else 0) | rng.choice(_SPEEDS) << 6
+        timers += struct.pack("@BBBB", start, rng.randrange(60), rng.randrange(24), rng.randrange(60))
+    return timers
+
+
+def _viron_statistics(rng) -> bytes:
+    hours = rng.randint(0, 20000)
+    low_ph = rng.randint(68, 76)
+    return struct.pack(
+        "@BBHHHIIB", low_ph + rng.randint(0, 6), low_ph, rng.randint(700, 850), rng.randint(550, 700),
+        rng.randint(0, 5000), hours, rng.randint(0, hours), rng.randint(0, 100),
+    )
+
+
+_VIRON_PAYLOADS = {
+    ChlorinatorState: _viron_state,
+    ChlorinatorSetup: _viron_setup,
+    ChlorinatorCapabilities: _viron_capabilities,
+    ChlorinatorTimers: _viron_timers,
+    ChlorinatorStatistics: _viron_statistics,
+    ChlorinatorSettings: lambda rng: struct.pack(
+        "@HB", rng.randint(0, 3600), rng.choice(_VIRON_ENUMS[AcidDosingInhibitStatuses])
+    ),
+}
+VIRON_UUIDS = tuple(uuid for uuid, parser in PARSERS.items() if parser in _VIRON_PAYLOADS)
+
+
+class FrameGenerator:
+    """Random but valid encrypted Halo frames and Viron characteristic values
+
+    `mix` maps CmdType (or Viron UUID for viron()) to a relative weight,
+    by default all of them are equally likely.
+    """
+
+    def __init__(self, session_key: bytes = None, mix: dict = None, viron_mix: dict = None, seed=None) -> None:
+        self.session_key = session_key or os.urandom(16)
+        self._rng = random.Random(seed)
+        mix = mix or dict.fromkeys(CMD_TYPES, 1)
+        unknown = set(mix) - set(CMD_TYPES)
+        if unknown:
+            raise ValueError(f"no handler for CmdType {sorted(unknown)}")
+        self._cmd_types, self._weights = list(mix), list(mix.values())
+        viron_mix = viron_mix or dict.fromkeys(VIRON_UUIDS, 1)
+        self._uuids, self._uuid_weights = list(viron_mix), list(viron_mix.values())
+
+    def payload(self, cmd_type: int) -> bytes:
+        """16 byte plaintext payload of a CmdType"""
+        rng = self._rng
+        make = _HALO_PAYLOADS.get(cmd_type)
+        payload = bytearray(make(rng) if make is not None else rng.randbytes(PAYLOAD_LENGTH))
+        payload.extend(rng.randbytes(PAYLOAD_LENGTH - len(payload)))
+        for offset, allowed in _ENUM_CHOICES.get(cmd_type, ()):
+            payload[offset] = rng.choice(allowed)
+        return bytes(payload)
+
+    def frame(self, cmd_type: int = None):
+        """(CmdType, encrypted 20 byte notification), CmdType drawn from the mix unless given"""
+        if cmd_type is None:
+            cmd_type = self._rng.choices(self._cmd_types, self._weights)[0]
+        plain = bytes([_NOTIFICATION]) + cmd_type.to_bytes(2, "little") + self.payload(cmd_type)
+        plain += bytes(FRAME_LENGTH - len(plain))
+        return cmd_type, encrypt_characteristic(plain, self.session_key)
+
+    def viron(self, uuid: str = None):
+        """(UUID, encrypted characteristic value) of a Viron chlorinator read"""
+        if uuid is None:
+            uuid = self._rng.choices(self._uuids, self._uuid_weights)[0]
+        payload = _VIRON_PAYLOADS[PARSERS[uuid]](self._rng)
+        return uuid, encrypt_characteristic(payload.ljust(FRAME_LENGTH, b"\0"), self.session_key)
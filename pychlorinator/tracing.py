@@ -0,0 +1,94 @@
+"""Sampled per-frame stage tracing from BLE callback to sink
+
+A sampled frame carries a trace (list of monotonic timestamps) through the
+queue. Each stage appends its timestamp, and finish() aggregates per-stage
+latencies so percentiles show whether time goes to the BLE stack, the queue
+or a slow consumer. Finished traces can be written as a Chrome trace /
+Perfetto JSON file.
+"""
+
+import json
+import time
+from collections import deque
+
+STAGES = ("callback", "enqueue", "dequeue", "decrypt", "parse", "dispatch", "sink")
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FrameTracer:
+    """Samples frames and aggregates the time spent between pipeline stages"""
+
+    def __init__(self, sample_rate: float = 0.01, max_traces: int = 10000) -> None:
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+        self._interval = max(1, round(1 / sample_rate))
+        self._countdown = 1
+        self._traces = deque(maxlen=max_traces)
+        self._latencies = {stage: deque(maxlen=max_traces) for stage in STAGES[1:] + ("total",)}
+
+    def start(self):
+        """Called in the BLE callback, returns a new trace for sampled frames, else None"""
+        self._countdown -= 1
+        if self._countdown:
+            return None
+        self._countdown = self._interval
+        return [time.perf_counter_ns()]
+
+    @staticmethod
+    def mark(trace) -> None:
+        """Stamp the next stage of a trace (no-op for unsampled frames)"""
+        if trace is not None:
+            trace.append(time.perf_counter_ns())
+
+    def finish(self, trace, address: str = None, cmd_type: int = None) -> None:
+        """Stamp the sink stage and record the trace"""
+        if trace is None:
+            return
+        trace.append(time.perf_counter_ns())
+        for stage, before, after in zip(STAGES[1:], trace, trace[1:]):
+            self._latencies[stage].append(after - before)
+        self._latencies["total"].append(trace[-1] - trace[0])
+        self._traces.append((address, cmd_type, trace))
+
+    def percentiles(self, fractions=(0.5, 0.9, 0.99)) -> dict:
+        """Per-stage latency percentiles in microseconds, keyed by stage then 'p50' etc"""
+        result = {}
+        for stage, samples in self._latencies.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            stats = {f"p{round(f * 100)}": _percentile(ordered, f) / 1000 for f in fractions}
+            stats["max"] = ordered[-1] / 1000
+            stats["count"] = len(ordered)
+            result[stage] = stats
+        return result
+
+    def export_chrome_trace(self, path: str) -> int:
+        """Write the recorded traces as Chrome trace events, returns the number of traces"""
+        events = []
+        threads = {}
+        for address, cmd_type, trace in self._traces:
+            tid = threads.setdefault(address, len(threads) + 1)
+            for stage, before, after in zip(STAGES[1:], trace, trace[1:]):
+                events.append(
+                    {
+                        "name": stage,
+                        "cat": "halo",
+                        "ph": "X",
+                        "ts": before / 1000,
+                        "dur": (after - before) / 1000,
+                        "pid": 1,
+                        "tid": tid,
+                        "args": {"cmd_type": cmd_type},
+                    }
+                )
+        for address, tid in threads.items():
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": str(address)}}
+            )
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+        return len(self._traces)